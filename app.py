@@ -1,24 +1,55 @@
 # System level imports
-import os, io, logging, json, time, re, glob, math, tempfile
-from datetime import datetime
+import os, sys, io, logging, json, time, re, glob, math, tempfile, copy, atexit, hashlib, hmac, base64, gzip, mimetypes, zipfile
+import http.client, urllib.parse
+from datetime import datetime, timezone
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+import functools
 from threading import Condition
-import threading, subprocess
+import threading, subprocess, sqlite3, asyncio, bisect, contextlib, shutil
 import argparse
 
 # Flask imports
-from flask import Flask, render_template, request, jsonify, Response, send_file, abort, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, Response, send_file, send_from_directory, abort, session, redirect, url_for, g
+from werkzeug.exceptions import NotFound
 import secrets
 
-# picamera2 imports
-from picamera2 import Picamera2
-from picamera2.encoders import JpegEncoder
-from picamera2.encoders import MJPEGEncoder
-#from picamera2.encoders import H264Encoder
-from picamera2.outputs import FileOutput
-from libcamera import Transform, controls
+# Cameras are opened at import, so the camera backend is picked from the command line here:
+# picamera2, or the simulated cameras in sim_camera.py (--camera-backend sim or CAMUI_CAMERA_BACKEND=sim)
+backend_parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+backend_parser.add_argument('--camera-backend', choices=['picamera2', 'sim'], default=os.environ.get('CAMUI_CAMERA_BACKEND', 'picamera2'))
+backend_parser.add_argument('--sim-cameras', default=None)
+backend_parser.add_argument('--sim-fps', type=float, default=None)
+backend_args = backend_parser.parse_known_args()[0]
+camera_backend = backend_args.camera_backend
+
+if camera_backend == 'sim':
+    import sim_camera
+    sim_camera.configure(cameras=backend_args.sim_cameras, fps=backend_args.sim_fps)
+    from sim_camera import Picamera2, JpegEncoder, MJPEGEncoder, FileOutput, Transform, controls
+else:
+    # picamera2 imports
+    from picamera2 import Picamera2
+    from picamera2.encoders import JpegEncoder
+    from picamera2.encoders import MJPEGEncoder
+    #from picamera2.encoders import H264Encoder
+    from picamera2.outputs import FileOutput
+    from libcamera import Transform, controls
+
+# Optional: brotli variants of static assets are only generated when it is installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import uvicorn  # Only needed for --server async
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    uvicorn = None
 
 # Image handeling imports
-from PIL import Image, ImageDraw, ImageFont, ImageEnhance, ImageOps, ExifTags
+from PIL import Image, ImageDraw, ImageFont, ImageOps, ExifTags
+import numpy as np
 
 ####################
 # Initialize Flask 
@@ -29,12 +60,344 @@ app.secret_key = secrets.token_hex(16)  # Generates a random 32-character hexade
 # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Set-Cookie#samesitesamesite-value
 app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
 
+####################
+# Metrics
+####################
+
+class MetricChild:
+    """One labelled series. Updates are plain attribute writes with no lock on the hot
+    path, most series have a single writer and a rare lost update is fine for monitoring."""
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+class HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextlib.contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+class Metric:
+    def __init__(self, name, help_text, kind, labelnames=(), buckets=None, collect=None):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.collect = collect  # For gauges worked out at scrape time: returns {label values: value}
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        """Return the series for these label values, keep it around on hot paths."""
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, HistogramChild(self.buckets) if self.kind == "histogram" else MetricChild())
+        return child
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        if self.collect is not None:
+            try:
+                series = self.collect()
+            except Exception as e:
+                log.error("error collecting metric", extra=log_fields(metric=self.name, error=str(e)))
+                return
+        else:
+            series = {values: child for values, child in list(self.children.items())}
+        for values, child in series.items():
+            labels = [f'{name}="{escape_label(value)}"' for name, value in zip(self.labelnames, values)]
+            if self.kind != "histogram":
+                value = child.value if isinstance(child, MetricChild) else child
+                lines.append(f"{self.name}{{{','.join(labels)}}} {value}" if labels else f"{self.name} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip((*child.buckets, "+Inf"), list(child.counts)):
+                cumulative += count
+                bucket_labels = ",".join([*labels, f'le="{bound}"'])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+            suffix = f"{{{','.join(labels)}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {child.sum}")
+            lines.append(f"{self.name}_count{suffix} {child.count}")
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class MetricsRegistry:
+    """Counters, gauges and histograms exposed in the Prometheus text format on /metrics."""
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, *args, **kwargs):
+        metric = Metric(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.add(name, help_text, "counter", labelnames)
+
+    def gauge(self, name, help_text, labelnames=(), collect=None):
+        return self.add(name, help_text, "gauge", labelnames, collect=collect)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.add(name, help_text, "histogram", labelnames, buckets=tuple(buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            metric.render(lines)
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+encoder_frames = metrics.counter("picamera_encoder_frames_total", "MJPEG frames produced by the encoder", ("camera",))
+encoder_bytes = metrics.counter("picamera_encoder_bytes_total", "Bytes of MJPEG frames produced by the encoder", ("camera",))
+capture_seconds = metrics.histogram("picamera_capture_seconds", "Time taken by still captures", ("camera",))
+capture_failures = metrics.counter("picamera_capture_failures_total", "Still captures that failed", ("camera",))
+reconfigure_seconds = metrics.histogram("picamera_reconfigure_seconds", "Time taken to reconfigure the camera pipeline", ("camera", "kind"))
+pipeline_faults = metrics.counter("picamera_pipeline_faults_total", "Stalled or failing camera pipelines found by the watchdog", ("camera", "reason"))
+pipeline_recoveries = metrics.counter("picamera_pipeline_recoveries_total", "Watchdog recovery attempts", ("camera", "action", "result"))
+settings_updates = metrics.counter("picamera_settings_updates_total", "Settings updates, applied or coalesced into a newer queued update", ("camera", "result"))
+gallery_query_seconds = metrics.histogram("picamera_gallery_query_seconds", "Gallery index query time", ("kind",))
+request_seconds = metrics.histogram("picamera_http_request_seconds", "Time to produce a response (headers) per route", ("route", "method", "status"))
+
+####################
+# Logging and tracing
+####################
+
+class StructuredFormatter(logging.Formatter):
+    """One line per record: logfmt (key=value) by default, or JSON objects.
+
+    Fields passed as extra={"fields": {...}} (see log_fields()) are added to the line.
+    """
+    def __init__(self, fmt="logfmt"):
+        super().__init__()
+        self.fmt = fmt
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        if self.fmt == "json":
+            return json.dumps(entry, default=str)
+        return " ".join(f"{key}={self.quote(value)}" for key, value in entry.items())
+
+    @staticmethod
+    def quote(value):
+        text = value if isinstance(value, str) else json.dumps(value, default=str) if isinstance(value, (dict, list, tuple)) else str(value)
+        return json.dumps(text) if not text or any(c in text for c in ' "=\n') else text
+
+class DebugSampler(logging.Filter):
+    """Lets through one DEBUG record in `every` per call site, so debug logging on
+    per-frame or per-control paths can stay enabled. Other levels always pass."""
+    def __init__(self, every=1):
+        super().__init__()
+        self.every = every
+        self.counts = {}
+
+    def filter(self, record):
+        if record.levelno != logging.DEBUG or self.every <= 1:
+            return True
+        site = (record.pathname, record.lineno)
+        count = self.counts.get(site, 0)
+        self.counts[site] = count + 1
+        if count % self.every:
+            return False
+        record.fields = {**getattr(record, "fields", {}), "sampled": f"1/{self.every}"}
+        return True
+
+def log_fields(**fields):
+    return {"fields": fields}
+
+log = logging.getLogger("camui")
+log_handler = logging.StreamHandler()
+debug_sampler = DebugSampler()
+log_handler.addFilter(debug_sampler)
+
+def parse_log_level(value):
+    """Numeric level for a level name (any case) or number, raises ValueError for anything else."""
+    if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+        return value
+    level = logging.getLevelName(value.upper()) if isinstance(value, str) else None
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown log level: {value!r}")
+    return level
+
+def configure_logging(level=None, fmt=None, picamera2_level=None, debug_sample_every=None, loggers=None):
+    """Apply logging settings, at startup or at runtime through /logging. Returns the settings.
+
+    Every value is checked before anything is applied, so a ValueError leaves the settings unchanged.
+    """
+    if level is not None:
+        level = parse_log_level(level)
+    if fmt is not None and fmt not in ("logfmt", "json"):
+        raise ValueError(f"Unknown log format: {fmt}")
+    if picamera2_level is not None:
+        picamera2_level = parse_log_level(picamera2_level)
+    if debug_sample_every is not None:
+        try:
+            debug_sample_every = max(int(debug_sample_every), 1)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid debug_sample_every: {debug_sample_every!r}")
+    if loggers is not None and not isinstance(loggers, dict):
+        raise ValueError("loggers must map logger names to levels")
+    loggers = {name: parse_log_level(logger_level) for name, logger_level in (loggers or {}).items()}
+
+    root = logging.getLogger()
+    if log_handler not in root.handlers:
+        root.addHandler(log_handler)
+    if level is not None:
+        root.setLevel(level)
+    if fmt is not None:
+        log_handler.setFormatter(StructuredFormatter(fmt))
+    elif log_handler.formatter is None:
+        log_handler.setFormatter(StructuredFormatter())
+    if picamera2_level is not None:
+        logging.getLogger("picamera2").setLevel(picamera2_level)
+    if debug_sample_every is not None:
+        debug_sampler.every = debug_sample_every
+    for name, logger_level in loggers.items():
+        logging.getLogger(name).setLevel(logger_level)
+    return logging_settings()
+
+def logging_settings():
+    return {
+        "level": logging.getLevelName(logging.getLogger().level),
+        "format": log_handler.formatter.fmt if log_handler.formatter else "logfmt",
+        "picamera2_level": logging.getLevelName(logging.getLogger("picamera2").getEffectiveLevel()),
+        "debug_sample_every": debug_sampler.every,
+    }
+
+configure_logging(level=os.environ.get("CAMUI_LOG_LEVEL", "INFO"), fmt=os.environ.get("CAMUI_LOG_FORMAT", "logfmt"),
+                  picamera2_level=os.environ.get("PICAMERA2_LOG_LEVEL", "WARNING"),
+                  debug_sample_every=os.environ.get("CAMUI_DEBUG_SAMPLE_EVERY", 1))
+
+# The most recent finished spans per span name as (end time, record), served by /traces. Each
+# name has its own ring so frequent spans (update_settings) never push out rare ones (take_still)
+recent_spans = {}
+RECENT_SPANS_PER_NAME = 50
+# The innermost span open in each thread, so helpers can mark phases without passing it around
+active_spans = threading.local()
+
+class Span:
+    """Lightweight tracing span with per-phase timings.
+
+        with Span("take_still", camera=0) as span:
+            ...
+            span.phase("capture")  # Time since the previous phase (or the start)
+
+    Code further down the call stack marks phases with span_phase(). add() accumulates
+    time measured elsewhere. A finished span is kept in recent_spans and logged at
+    `level`, or at INFO when it took longer than app.config['trace_slow_seconds'].
+    Generators, which can resume in other threads, call start() and finish() instead.
+    """
+    __slots__ = ("name", "fields", "level", "start_time", "mark", "phases", "parent")
+
+    def __init__(self, name, level=logging.DEBUG, **fields):
+        self.name = name
+        self.fields = fields
+        self.level = level
+        self.phases = {}
+        self.parent = None
+
+    def start(self):
+        self.start_time = self.mark = time.perf_counter()
+        return self
+
+    def __enter__(self):
+        self.parent = getattr(active_spans, "span", None)
+        active_spans.span = self
+        return self.start()
+
+    def phase(self, name):
+        now = time.perf_counter()
+        self.add(name, now - self.mark)
+        self.mark = now
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def __exit__(self, exc_type, exc, tb):
+        active_spans.span = self.parent
+        self.finish(error=exc_type.__name__ if exc_type else None)
+        return False
+
+    def finish(self, error=None, **fields):
+        total = time.perf_counter() - self.start_time
+        record = {"span": self.name, "seconds": round(total, 4), **self.fields, **fields,
+                  "phases": {name: round(seconds, 4) for name, seconds in self.phases.items()}}
+        if self.parent is not None:
+            record["parent"] = self.parent.name
+        if error:
+            record["error"] = error
+        ring = recent_spans.get(self.name)
+        if ring is None:
+            ring = recent_spans.setdefault(self.name, deque(maxlen=RECENT_SPANS_PER_NAME))
+        ring.append((time.time(), record))
+        level = logging.INFO if total >= app.config['trace_slow_seconds'] else self.level
+        if log.isEnabledFor(level):
+            log.log(level, "span", extra={"fields": record})
+
+def span_phase(name):
+    """End a phase of the innermost open span in this thread, if there is one."""
+    span = getattr(active_spans, "span", None)
+    if span is not None:
+        span.phase(name)
+
+def traced(name, level=logging.DEBUG, fields=None):
+    """Run the decorated CameraObject method in a Span tagged with the camera number.
+    `fields` is a function of the method's arguments returning extra span fields."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            extra = fields(*args, **kwargs) if fields else {}
+            with Span(name, level, camera=self.camera_info['Num'], **extra):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
 ####################
 # Initialize picamera2 
 ####################
 
-# Set debug level to Warning
-Picamera2.set_logging(Picamera2.DEBUG)
+# picamera2 logs through the handler set up above, its level comes from PICAMERA2_LOG_LEVEL
+# (WARNING by default) or --picamera2-log-level
 # Ask picamera2 for what cameras are connected
 global_cameras = Picamera2.global_camera_info()
 
@@ -44,7 +407,7 @@ global_cameras = Picamera2.global_camera_info()
 ##### Uncomment the line below simulate having no cameras connected
 # global_cameras = []
 
-print(f'\nInitialize picamera2 - Cameras Found:\n{global_cameras}\n')
+log.info("cameras found", extra=log_fields(backend=camera_backend, cameras=global_cameras))
 
 ####################
 # Initialize default values 
@@ -72,6 +435,55 @@ os.makedirs(app.config['upload_folder'], exist_ok=True)
 # For the image gallery set items per page
 items_per_page = 12
 
+# Most index rows one gallery page reads when collapsing duplicates, a longer run of near-identical frames continues on the next page
+app.config['gallery_collapse_scan_rows'] = 2000
+
+# Disk budget for generated gallery thumbnails
+app.config['thumbnail_cache_bytes'] = 200 * 1024 * 1024
+
+# Seconds a request waits for a DNG to be developed
+app.config['dng_develop_timeout'] = 120
+# Preview-size DNG developments at once, one per core by default
+app.config['dng_develop_workers'] = os.cpu_count() or 1
+# Full-size DNG developments at once, each holds several float32 copies of the frame in memory.
+# None sizes it from the memory available at start (see DngDeveloper.FULL_SIZE_JOB_BYTES)
+app.config['dng_full_size_jobs'] = None
+# Disk budget for developed DNG previews and full-size exports
+app.config['dng_cache_bytes'] = 500 * 1024 * 1024
+
+# Seconds a request waits for its turn on a camera before giving up with a 503
+app.config['camera_command_timeout'] = 30
+# Stills can take much longer with long exposures
+app.config['camera_capture_timeout'] = 300
+
+# Metadata is served from the per-camera sampler while it is younger than this (seconds)
+app.config['metadata_max_age'] = 1.0
+# Default and fastest rate of the /metadata_stream_<n> Server-Sent Events (seconds)
+app.config['metadata_stream_interval'] = 1.0
+app.config['metadata_min_interval'] = 0.2
+# Slowest rate a client may ask for; longer intervals are clamped to this (seconds)
+app.config['metadata_max_interval'] = 60.0
+
+# Spans that take at least this long are logged at INFO whatever their own level (seconds)
+app.config['trace_slow_seconds'] = 2.0
+
+# Pipeline watchdog: how often each camera is checked (seconds). Frames count as stalled after
+# `watchdog_stall_frames` frame intervals without one, but never sooner than `watchdog_min_stall_seconds`
+app.config['watchdog_interval'] = 1.0
+app.config['watchdog_stall_frames'] = 15
+app.config['watchdog_min_stall_seconds'] = 3.0
+# Failed stills in a row that count as a fault
+app.config['watchdog_capture_errors'] = 3
+# Wait after a recovery before trying the next one, doubled on every attempt up to the maximum (seconds)
+app.config['watchdog_backoff'] = 2.0
+app.config['watchdog_max_backoff'] = 60.0
+# Frames must flow this long after a recovery before escalation starts over (seconds)
+app.config['watchdog_reset_seconds'] = 30.0
+# A camera command still running this long after its caller gave up counts as hung (seconds)
+app.config['watchdog_command_grace'] = 10.0
+# Viewers are sent the placeholder when no frame arrives within this long (or two frame intervals if longer)
+app.config['stream_frame_timeout'] = 1.0
+
 # Define the minimum required configuration
 minimum_last_config = {
     "cameras": []
@@ -83,50 +495,310 @@ last_config_file_path = os.path.join(current_dir, 'camera-last-config.json')
 with open(os.path.join(current_dir, 'camera-module-info.json'), 'r') as file:
     camera_module_info = json.load(file)
 
-# Function to load or initialize configuration
-def load_or_initialize_config(file_path, default_config):
-    if os.path.exists(file_path):
-        with open(file_path, 'r') as file:
-            try:
+def write_json_atomic(file_path, data):
+    """Write JSON to a temp file in the same folder and rename it over file_path."""
+    folder = os.path.dirname(file_path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, file_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class ConfigStore:
+    """Keeps camera-last-config.json in memory and persists it in the background.
+
+    Mutations are serialized by a lock and flushed with write_json_atomic() after
+    `debounce` seconds, so a burst of profile switches costs a single write.
+    """
+    def __init__(self, file_path, default_config, debounce=1.0):
+        self.file_path = file_path
+        self.debounce = debounce
+        self.lock = threading.Lock()
+        self.timer = None
+        self.dirty = False
+        self.config = self.load(default_config)
+        atexit.register(self.flush)
+
+    def load(self, default_config):
+        try:
+            with open(self.file_path, 'r') as file:
                 config = json.load(file)
-                if not config:  # Check if the file is empty
-                    raise ValueError("Empty configuration file")
-            except (json.JSONDecodeError, ValueError):
-                # If file is empty or invalid, create new config
-                with open(file_path, 'w') as file:
-                    json.dump(default_config, file, indent=4)
-                config = default_config
-    else:
-        # Create the file with minimum configuration if it doesn't exist
-        with open(file_path, 'w') as file:
-            json.dump(default_config, file, indent=4)
-        config = default_config
-    return config
-
-def list_profiles():
-    profiles = []
-    if not os.path.exists(camera_profile_folder):
-        os.makedirs(camera_profile_folder)
-    
-    for filename in os.listdir(camera_profile_folder):
-        if filename.endswith(".json"):
-            filepath = os.path.join(camera_profile_folder, filename)
-            try:
-                with open(filepath, "r") as f:
-                    data = json.load(f)
-                model = data.get("model", "Unknown")
-                profiles.append({"filename": filename, "model": model})
-            except Exception as e:
-                print(f"Error loading {filename}: {e}")
-    return profiles
+            if not config:  # Check if the file is empty
+                raise ValueError("Empty configuration file")
+            return config
+        except (FileNotFoundError, json.JSONDecodeError, ValueError):
+            # If the file is missing, empty or invalid, start from the default config
+            config = copy.deepcopy(default_config)
+            write_json_atomic(self.file_path, config)
+            return config
+
+    def get(self):
+        with self.lock:
+            return copy.deepcopy(self.config)
+
+    def set_cameras(self, cameras):
+        with self.lock:
+            self.config["cameras"] = copy.deepcopy(cameras)
+            self.schedule_flush()
+
+    def set_camera_profile(self, camera_num, profile_filename):
+        """Point a camera at a profile file. Returns False if the camera is unknown."""
+        with self.lock:
+            for camera in self.config.setdefault("cameras", []):
+                if camera["Num"] == camera_num:
+                    camera["Has_Config"] = True
+                    camera["Config_Location"] = profile_filename
+                    self.schedule_flush()
+                    return True
+        return False
+
+    def schedule_flush(self):
+        # Caller must hold self.lock
+        self.dirty = True
+        if self.timer is None:
+            self.timer = threading.Timer(self.debounce, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            self.timer = None
+            if not self.dirty:
+                return
+            data = copy.deepcopy(self.config)
+            self.dirty = False
+        try:
+            write_json_atomic(self.file_path, data)
+        except Exception as e:
+            log.error("error writing config", extra=log_fields(path=self.file_path, error=str(e)))
+            with self.lock:
+                self.schedule_flush()
+
+class ProfileCatalogue:
+    """In-memory index of the saved camera profiles.
+
+    The profile folder is only rescanned when its mtime changes, otherwise only the known
+    profiles are stat'ed, since editing a file in place doesn't touch the folder. Only
+    files whose mtime or size changed are re-parsed. save_profile() updates the index
+    directly.
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.entries = {}  # filename -> {"filename", "model", "mtime", "size"}
+        self.folder_mtime = None
+
+    def refresh(self, force=False):
+        os.makedirs(self.folder, exist_ok=True)
+        folder_mtime = os.stat(self.folder).st_mtime_ns
+        with self.lock:
+            if not force and folder_mtime == self.folder_mtime:
+                candidates = [(name, os.path.join(self.folder, name)) for name in self.entries]
+            else:
+                with os.scandir(self.folder) as it:
+                    # Skip in-progress temp files from write_json_atomic()
+                    candidates = [(entry.name, entry.path) for entry in it
+                                  if entry.name.endswith(".json") and not entry.name.startswith(".") and entry.is_file()]
+            entries = {}
+            for name, path in candidates:
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                cached = self.entries.get(name)
+                if cached and cached["mtime"] == stat.st_mtime_ns and cached["size"] == stat.st_size:
+                    entries[name] = cached
+                    continue
+                try:
+                    with open(path, "r") as f:
+                        data = json.load(f)
+                    model = data.get("model", "Unknown")
+                except Exception as e:
+                    log.error("error loading profile", extra=log_fields(profile=name, error=str(e)))
+                    continue
+                entries[name] = {"filename": name, "model": model, "mtime": stat.st_mtime_ns, "size": stat.st_size}
+            self.entries = entries
+            self.folder_mtime = folder_mtime
+
+    def update(self, filename, profile):
+        """Record a profile that has just been written to disk without rescanning."""
+        path = os.path.join(self.folder, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        with self.lock:
+            self.entries[filename] = {"filename": filename, "model": profile.get("model", "Unknown"), "mtime": stat.st_mtime_ns, "size": stat.st_size}
+
+    def list(self, model=None):
+        self.refresh()
+        with self.lock:
+            entries = sorted(self.entries.values(), key=lambda e: e["filename"])
+        return [{"filename": e["filename"], "model": e["model"]} for e in entries if model is None or e["model"] == model]
+
+profile_catalogue = ProfileCatalogue(camera_profile_folder)
+
+def list_profiles(model=None):
+    return profile_catalogue.list(model)
+
+controls_db_path = os.path.join(current_dir, "camera_controls_db.json")
+
+# Folder for generated artifacts that can safely be deleted at any time
+cache_folder = os.path.join(current_dir, 'cache')
+os.makedirs(cache_folder, exist_ok=True)
 
 def control_template():
-    with open(os.path.join(current_dir, "camera_controls_db.json"), "r") as f:
-        settings = json.load(f)
-    return settings
+    return control_template_cache.load_db()
+
+def compile_controls_template(camera_json, picamera2_controls, camera_resolutions):
+    """Merge the camera controls DB with the ranges picamera2 reports for one camera.
+
+    Returns the live controls template and the default control values for the profile.
+    """
+    default_controls = {}
+    if "sections" not in camera_json:
+        log.error("'sections' key not found in camera_json")
+        return camera_json, default_controls  # Return unchanged if it's not structured as expected
+    for section in camera_json["sections"]:
+        if "settings" not in section:
+            log.warning("missing 'settings' key in section", extra=log_fields(section=section.get('title', 'Unknown')))
+            continue
+        section_enabled = False  # Track if any setting is enabled
+        for setting in section["settings"]:
+            if not isinstance(setting, dict):
+                log.warning("unexpected setting format", extra=log_fields(setting=setting))
+                continue  # Skip if it's not a dictionary
+            setting_id = setting.get("id")  # Use `.get()` to avoid crashes
+            source = setting.get("source", None)  # Check if source exists
+            original_enabled = setting.get("enabled", False)  # Preserve original enabled state
+
+            if source == "controls":
+                if setting_id in picamera2_controls:
+                    min_val, max_val, default_val = picamera2_controls[setting_id]
+                    setting["min"] = min_val
+                    setting["max"] = max_val
+                    if default_val is not None:
+                        setting["default"] = default_val
+                    else:
+                        default_val = False if isinstance(min_val, bool) else min_val
+                    if setting["enabled"]:
+                        default_controls[setting_id] = default_val
+                    setting["enabled"] = original_enabled
+                    if original_enabled:
+                        section_enabled = True
+                else:
+                    setting["enabled"] = False  # Disable setting not available on this camera
+            elif source == "generatedresolutions":
+                # Use the dynamically generated resolutions
+                setting["options"] = [
+                    {"value": i, "label": f"{w} x {h}", "enabled": True}
+                    for i, (w, h) in enumerate(camera_resolutions)
+                ]
+                section_enabled = True
+            else:
+                section_enabled = True  # No source specified, keep existing values
+
+            for child in setting.get("childsettings", []):
+                child_id = child.get("id")
+                if child.get("source", None) == "controls" and child_id in picamera2_controls:
+                    min_val, max_val, default_val = picamera2_controls[child_id]
+                    child["min"] = min_val
+                    child["max"] = max_val
+                    default_controls[child_id] = default_val if default_val is not None else min_val
+                    if default_val is not None:
+                        child["default"] = default_val
+                    child["enabled"] = child.get("enabled", False)
+                    if child["enabled"]:
+                        section_enabled = True
+        section["enabled"] = section_enabled
+    return camera_json, default_controls
+
+class ControlTemplateCache:
+    """Compiled control templates keyed by sensor model and picamera2 control ranges.
+
+    Compiled templates are kept in memory and written to cache/control_templates so
+    later startups skip the merge. The key includes a hash of the controls DB, so
+    editing camera_controls_db.json or a change in a camera's ranges starts a new entry.
+    """
+    VERSION = 1
+
+    def __init__(self, db_path, folder):
+        self.db_path = db_path
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.db = None
+        self.db_stat = None
+        self.db_hash = None
+        self.templates = {}
+        os.makedirs(self.folder, exist_ok=True)
+
+    def load_db(self):
+        """Return a copy of the controls DB, re-reading it only when the file changed."""
+        stat = os.stat(self.db_path)
+        with self.lock:
+            if self.db_stat != (stat.st_mtime_ns, stat.st_size):
+                with open(self.db_path, "rb") as f:
+                    raw = f.read()
+                self.db = json.loads(raw)
+                self.db_hash = hashlib.sha1(raw).hexdigest()
+                self.db_stat = (stat.st_mtime_ns, stat.st_size)
+            return copy.deepcopy(self.db)
+
+    def cache_key(self, model, picamera2_controls, camera_resolutions):
+        controls_signature = repr(sorted((key, repr(value)) for key, value in picamera2_controls.items()))
+        signature = f"{self.VERSION}|{self.db_hash}|{controls_signature}|{list(camera_resolutions)}"
+        safe_model = re.sub(r'[^A-Za-z0-9_.-]', '_', model)
+        return f"{safe_model}-{hashlib.sha1(signature.encode()).hexdigest()[:16]}"
+
+    def get(self, model, picamera2_controls, camera_resolutions):
+        """Return (live_controls, default_controls) as fresh copies the caller may modify."""
+        camera_json = self.load_db()
+        key = self.cache_key(model, picamera2_controls, camera_resolutions)
+        with self.lock:
+            compiled = self.templates.get(key)
+        if compiled is None:
+            compiled = self.read_artifact(key)
+        if compiled is None:
+            start = time.perf_counter()
+            live_controls, default_controls = compile_controls_template(camera_json, picamera2_controls, camera_resolutions)
+            compiled = {"live_controls": live_controls, "default_controls": default_controls}
+            log.info("control template compiled", extra=log_fields(key=key, seconds=round(time.perf_counter() - start, 3)))
+            self.write_artifact(key, compiled)
+        with self.lock:
+            self.templates[key] = compiled
+        compiled = copy.deepcopy(compiled)
+        return compiled["live_controls"], compiled["default_controls"]
+
+    def read_artifact(self, key):
+        path = os.path.join(self.folder, f"{key}.json")
+        try:
+            with open(path, "r") as f:
+                artifact = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if artifact.get("version") != self.VERSION:
+            return None
+        return {"live_controls": artifact["live_controls"], "default_controls": artifact["default_controls"]}
+
+    def write_artifact(self, key, compiled):
+        try:
+            write_json_atomic(os.path.join(self.folder, f"{key}.json"), {"version": self.VERSION, **compiled})
+        except (TypeError, ValueError, OSError) as e:
+            # Controls that can't be stored as JSON are still cached in memory
+            log.warning("could not write control template cache", extra=log_fields(key=key, error=str(e)))
+
+control_template_cache = ControlTemplateCache(controls_db_path, os.path.join(cache_folder, 'control_templates'))
 
 # Load or initialize the configuration
-camera_last_config = load_or_initialize_config(last_config_file_path, minimum_last_config)
+config_store = ConfigStore(last_config_file_path, minimum_last_config)
+camera_last_config = config_store.get()
 
 def get_camera_info(camera_model, camera_module_info):
     return next(
@@ -139,21 +811,346 @@ def get_camera_info(camera_model, camera_module_info):
 ####################
 
 class StreamingOutput(io.BufferedIOBase):
-    def __init__(self):
-        self.buffer = io.BytesIO()
+    def __init__(self, on_frame=None):
+        self.frame = None
         self.condition = Condition()
+        self.on_frame = on_frame  # Called with every frame, from the encoder thread
 
     def write(self, buf):
-        # Clear the buffer before writing the new frame
-        self.buffer.seek(0)
-        self.buffer.truncate()
-        self.buffer.write(buf)
+        # Keep the frame as immutable bytes so readers never see it half overwritten
+        frame = bytes(buf)
         with self.condition:
+            self.frame = frame
             self.condition.notify_all()
+        if self.on_frame:
+            self.on_frame(frame)
 
     def read_frame(self):
-        self.buffer.seek(0)
-        return self.buffer.read()
+        with self.condition:
+            return self.frame
+
+####################
+# Metadata sampler
+####################
+
+class MetadataSampler:
+    """Caches the metadata of requests already flowing through the camera pipeline.
+
+    on_request() is installed as the Picamera2 post_callback, so sampling needs no extra
+    capture. At most one sample is taken per `sample_interval` seconds.
+    """
+    def __init__(self, sample_interval=0.2):
+        self.sample_interval = sample_interval
+        self.condition = Condition()
+        self.metadata = None
+        self.timestamp = 0.0
+
+    def on_request(self, request):
+        now = time.time()
+        if now - self.timestamp < self.sample_interval:
+            return
+        try:
+            metadata = request.get_metadata()
+        except Exception as e:
+            log.error("error sampling metadata", extra=log_fields(error=str(e)))
+            return
+        with self.condition:
+            self.metadata = metadata
+            self.timestamp = now
+            self.condition.notify_all()
+
+    def latest(self):
+        """Return (metadata, timestamp) of the newest sample, metadata is None if there is none yet."""
+        with self.condition:
+            return self.metadata, self.timestamp
+
+    def wait_newer(self, timestamp, timeout):
+        """Block until a sample newer than `timestamp` arrives or `timeout` seconds pass."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.timestamp > timestamp, timeout=timeout)
+            return self.metadata, self.timestamp
+
+####################
+# Camera command queue
+####################
+
+class CameraCommandTimeout(Exception):
+    """A camera command did not finish within its timeout, the camera is busy."""
+
+class CameraCommandQueue:
+    """Runs every hardware operation of one camera, one at a time, on a worker thread.
+
+    submit() returns a Future. A command submitted with a `key` while the newest waiting
+    command with that key runs the same function replaces it: only the newest arguments
+    run, every caller gets that result, and the merged command moves to the back of the
+    queue so it still runs after everything submitted before it. Commands of another
+    function in between (stop, start, stop) are never merged across. Commands submitted
+    from the worker itself run inline, so commands can call each other.
+
+    A command stuck in a driver call that never returns would block the camera for
+    good, abandon() gives up on it and carries on with a new worker thread.
+    """
+    def __init__(self, name, on_coalesce=None):
+        self.on_coalesce = on_coalesce  # Called with the key when a waiting command is replaced
+        self.condition = threading.Condition()
+        self.pending = deque()
+        self.by_key = {}  # key -> newest waiting command with that key
+        self.current = None  # Name of the running command
+        self.current_start = None  # When it started (time.monotonic())
+        self.current_timeout = None  # How long its callers wait for it
+        self.current_futures = []
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    def on_worker(self):
+        return threading.current_thread() is self.thread
+
+    def submit(self, fn, *args, key=None, timeout=None, **kwargs):
+        future = Future()
+        with self.condition:
+            command = self.by_key.get(key) if key is not None else None
+            if command is not None and command["fn"] == fn:
+                command.update(args=args, kwargs=kwargs, timeout=timeout)
+                command["futures"].append(future)
+                self.pending.remove(command)
+                self.pending.append(command)
+                if self.on_coalesce:
+                    self.on_coalesce(key)
+            else:
+                command = {"fn": fn, "args": args, "kwargs": kwargs, "key": key, "timeout": timeout, "futures": [future]}
+                self.pending.append(command)
+                if key is not None:
+                    self.by_key[key] = command
+            self.condition.notify()
+        return future
+
+    def call(self, fn, *args, key=None, timeout=None, **kwargs):
+        """Run `fn` on the worker and return its result, raises CameraCommandTimeout."""
+        if self.on_worker():
+            return fn(*args, **kwargs)
+        future = self.submit(fn, *args, key=key, timeout=timeout, **kwargs)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()  # Only succeeds if it hasn't started, a running command finishes
+            raise CameraCommandTimeout(f"Camera busy, {getattr(fn, '__name__', 'command')} did not finish within {timeout}s")
+
+    def depth(self):
+        with self.condition:
+            return len(self.pending) + (1 if self.current else 0)
+
+    def running(self):
+        """(name, seconds running, caller timeout) of the running command, or None when idle."""
+        with self.condition:
+            if self.current is None:
+                return None
+            return self.current, time.monotonic() - self.current_start, self.current_timeout
+
+    def abandon(self):
+        """Give up on the running command and start a new worker for the rest of the queue.
+
+        The stuck thread is left behind; if its command ever returns, the thread exits
+        instead of taking more commands. Callers waiting on the command get
+        CameraCommandTimeout straight away.
+        """
+        with self.condition:
+            if self.current is None:
+                return False
+            name, futures = self.current, self.current_futures
+            self.current = self.current_start = self.current_timeout = None
+            self.current_futures = []
+            self.thread = threading.Thread(target=self.run, name=self.thread.name, daemon=True)
+            self.thread.start()
+        for future in futures:
+            future.set_exception(CameraCommandTimeout(f"Camera stuck, {name} was abandoned"))
+        return True
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                command = self.pending.popleft()
+                if command["key"] is not None and self.by_key.get(command["key"]) is command:
+                    del self.by_key[command["key"]]
+                # Callers that timed out before it started have cancelled their future
+                futures = [future for future in command["futures"] if future.set_running_or_notify_cancel()]
+                if not futures:
+                    continue
+                self.current = getattr(command["fn"], "__name__", "command")
+                self.current_start = time.monotonic()
+                self.current_timeout = command["timeout"]
+                self.current_futures = futures
+            error = None
+            try:
+                result = command["fn"](*command["args"], **command["kwargs"])
+            except BaseException as e:
+                error = e
+            with self.condition:
+                if not self.on_worker():
+                    return  # Abandoned, its callers were already told and a new worker runs the queue
+                self.current = self.current_start = self.current_timeout = None
+                self.current_futures = []
+            for future in futures:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+def camera_command(key=None, timeout_setting='camera_command_timeout'):
+    """Run the decorated CameraObject method on the camera's command queue.
+
+    `key` is a merge key, or a function of the method's arguments that returns one.
+    The caller waits up to app.config[timeout_setting] seconds.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            commands = getattr(self, "commands", None)
+            if commands is None:  # Still initialising, nothing else can reach the camera yet
+                return method(self, *args, **kwargs)
+            merge_key = key(*args, **kwargs) if callable(key) else key
+            return commands.call(method, self, *args, key=merge_key, timeout=app.config[timeout_setting], **kwargs)
+        return wrapper
+    return decorator
+
+def timed_reconfigure(kind):
+    """Record how long the decorated CameraObject method takes in picamera_reconfigure_seconds,
+    and trace it as a "reconfigure" span (phases are marked with span_phase())."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with Span("reconfigure", logging.INFO, camera=self.camera_info['Num'], kind=kind) as span:
+                try:
+                    return method(self, *args, **kwargs)
+                finally:
+                    reconfigure_seconds.labels(self.camera_info['Num'], kind).observe(time.perf_counter() - span.start_time)
+        return wrapper
+    return decorator
+
+####################
+# Pipeline watchdog
+####################
+
+class PipelineWatchdog:
+    """Brings the pipeline of one camera back when its frames stop.
+
+    Every app.config['watchdog_interval'] seconds the age of the newest MJPEG frame is
+    compared with the frame interval the camera runs at. A fault (the camera stalled,
+    the encoder stopped producing frames or stills keep failing) is recovered with the
+    first of ACTIONS not tried yet; if that doesn't bring the frames back the next
+    attempt escalates, waiting twice as long each time. A recovery only counts as ok
+    once a frame arrives after it.
+
+    A command that hangs in the driver (a capture or stop_recording that never returns)
+    holds the command queue, so a recovery would queue behind it. Once it runs well
+    past its callers' timeout the worker is abandoned and the camera reopened on a new one.
+    """
+    ACTIONS = ("restart_stream", "reconfigure", "reopen")
+
+    def __init__(self, camera):
+        self.camera = camera
+        self.attempts = 0  # Recoveries since frames last flowed, picks the action and the backoff
+        self.next_attempt = 0.0  # No recovery is tried before this (time.monotonic())
+        self.last_attempt = None
+        self.stuck_since = None  # When capturing_still was first seen set with nothing running
+        self.last_fault = None
+        self.pending_action = None  # Last recovery, until frames show whether it worked
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=f"camera-{camera.camera_info['Num']}-watchdog", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        while not self.stop_event.wait(app.config['watchdog_interval']):
+            try:
+                self.check()
+            except Exception as e:
+                log.error("watchdog check failed", extra=log_fields(camera=self.camera.camera_info['Num'], error=str(e)))
+
+    def diagnose(self):
+        """Return why the pipeline needs recovering, or None if it is healthy (or meant to be idle)."""
+        camera = self.camera
+        now = time.monotonic()
+        running = camera.commands.running()
+        if running is not None:
+            _, seconds, timeout = running
+            if seconds >= (timeout or app.config['camera_command_timeout']) + app.config['watchdog_command_grace']:
+                return "command_hung"
+        if camera.capture_errors >= app.config['watchdog_capture_errors']:
+            return "capture_errors"
+        if camera.capturing_still:
+            # Stills and reconfigures hold the flag while they run on the command queue,
+            # set with the queue idle it was left behind by a command that failed half way
+            if camera.commands.depth():
+                self.stuck_since = None
+            elif self.stuck_since is None:
+                self.stuck_since = now
+            elif now - self.stuck_since >= app.config['watchdog_min_stall_seconds']:
+                return "stuck_capture"
+            return None
+        self.stuck_since = None
+        if not camera.feed_enabled or camera.output is None:
+            return None
+        stall_after = max(app.config['watchdog_min_stall_seconds'], app.config['watchdog_stall_frames'] * camera.expected_frame_interval())
+        if now - camera.last_frame_time < stall_after:
+            return None
+        # Requests still completing means the sensor runs and only the encoder stopped
+        return "encoder_stopped" if now - camera.last_request_time < stall_after else "stalled"
+
+    def check(self):
+        camera_num = self.camera.camera_info['Num']
+        reason = self.diagnose()
+        now = time.monotonic()
+        if self.pending_action is not None and self.camera.last_frame_time > self.last_attempt:
+            self.record_result("ok")
+        if reason is None:
+            if self.attempts and now - self.last_attempt >= app.config['watchdog_reset_seconds']:
+                log.info("pipeline recovered", extra=log_fields(camera=camera_num, attempts=self.attempts))
+                self.attempts = 0
+            return
+        if now < self.next_attempt:
+            return  # Give the last recovery time to work
+        if self.pending_action is not None:
+            self.record_result("failed")  # No frame since the last recovery
+        if reason == "command_hung":
+            # Anything queued would wait behind the stuck command, recover on a new worker
+            running = self.camera.commands.running()
+            if self.camera.commands.abandon():
+                log.error("camera command hung, abandoned", extra=log_fields(camera=camera_num, command=running[0], seconds=round(running[1], 1)))
+            action = "reopen"
+        else:
+            action = self.ACTIONS[min(self.attempts, len(self.ACTIONS) - 1)]
+        self.attempts += 1
+        frame_age = round(now - self.camera.last_frame_time, 3)
+        pipeline_faults.labels(camera_num, reason).inc()
+        log.warning("pipeline fault, recovering", extra=log_fields(camera=camera_num, reason=reason, action=action,
+                                                                    attempt=self.attempts, frame_age=frame_age))
+        self.last_fault = {"reason": reason, "action": action, "result": "pending", "attempt": self.attempts,
+                           "frame_age": frame_age, "time": time.time()}
+        self.pending_action = action
+        try:
+            self.camera.recover_pipeline(action)
+        except Exception as e:
+            log.error("pipeline recovery failed", extra=log_fields(camera=camera_num, action=action, error=str(e)))
+            self.record_result("failed")
+        self.last_attempt = time.monotonic()
+        backoff = min(app.config['watchdog_backoff'] * 2 ** (self.attempts - 1), app.config['watchdog_max_backoff'])
+        self.next_attempt = self.last_attempt + backoff
+
+    def record_result(self, result):
+        # "ok" once frames flow after a recovery, "failed" if it raised or the next fault came first
+        pipeline_recoveries.labels(self.camera.camera_info['Num'], self.pending_action, result).inc()
+        self.last_fault["result"] = result
+        self.pending_action = None
+
+    def status(self):
+        return {"frame_age": round(time.monotonic() - self.camera.last_frame_time, 3),
+                "attempts": self.attempts, "last_fault": self.last_fault}
 
 ####################
 # CameraObject that will store the itteration of 1 or more cameras
@@ -163,25 +1160,56 @@ class CameraObject:
     def __init__(self, camera):
         self.camera_init = True
         self.camera_info = camera
+        # Seconds spent in each startup phase, logged once the camera is ready
+        self.init_timings = {}
+        phase_start = time.perf_counter()
+        def phase_done(phase):
+            nonlocal phase_start
+            now = time.perf_counter()
+            self.init_timings[phase] = round(now - phase_start, 3)
+            phase_start = now
         # Generate default Camera profile
         self.camera_profile = self.generate_camera_profile()
+        # Name of the profile file last loaded or saved, recorded with each capture
+        self.profile_name = None
         # Init camera to picamera2 using the camera number
         self.picam2 = Picamera2(camera['Num'])
+        # Keep the latest frame metadata without extra captures
+        self.metadata_sampler = MetadataSampler()
+        self.picam2.post_callback = self.on_request
+        # Arrival of the newest request and MJPEG frame, watched by the pipeline watchdog
+        self.last_request_time = self.last_frame_time = time.monotonic()
+        # False while the live feed is switched off from the UI, so no frames are expected
+        self.feed_enabled = True
+        # Stills that failed in a row
+        self.capture_errors = 0
+        # Called with every MJPEG frame, used by the async server's stream hub
+        self.frame_listeners = set()
+        # Metric series written on every frame or capture, looked up once
+        self.frames_metric = encoder_frames.labels(camera['Num'])
+        self.frame_bytes_metric = encoder_bytes.labels(camera['Num'])
+        self.capture_metric = capture_seconds.labels(camera['Num'])
+        self.capture_failures_metric = capture_failures.labels(camera['Num'])
+        phase_done("open")
         # Get Camera specs
         self.camera_module_spec = self.get_camera_module_spec()
         # Fetch Avaialble Sensor modes and generate available resolutions
         self.sensor_modes = self.picam2.sensor_modes
         self.camera_resolutions = self.generate_camera_resolutions()
+        phase_done("sensor_modes")
         # Ready buffer for feed
         self.output = None
         # Initialize configs as empty dictionaries for the still and video configs
         self.init_configure_camera()
         # Compare camera controls DB flushing out settings not avaialbe from picamera2
         self.live_controls = self.initialize_controls_template(self.picam2.camera_controls)
+        phase_done("controls_template")
         # Set the Camers sensor mode 
         self.set_sensor_mode(self.camera_profile["sensor_mode"])
+        phase_done("sensor_mode")
         # Load saved camaera profile if one exists
         self.load_saved_camera_profile()
+        phase_done("profile")
         self.camera_init = False
         # Set capture flag and set placeholder image
         self.capturing_still = False
@@ -189,13 +1217,20 @@ class CameraObject:
         
         # Start Stream and sync metadata
         self.start_streaming()
+        phase_done("streaming")
         self.update_camera_from_metadata()
+        phase_done("metadata")
+
+        # Full dumps are only useful when debugging a camera module
+        log.debug("camera initialised", extra=log_fields(camera=camera['Num'], controls=self.picam2.camera_controls,
+                                                       resolutions=self.camera_resolutions, profile=self.camera_profile))
+        # From here on every hardware operation goes through the command queue
+        coalesced = settings_updates.labels(camera['Num'], "coalesced")
+        self.commands = CameraCommandQueue(f"camera-{camera['Num']}-commands",
+                                           on_coalesce=lambda key: coalesced.inc() if key.startswith("setting:") else None)
+        self.watchdog = PipelineWatchdog(self)
+        self.watchdog.start()
 
-        # Final debug statements
-        print(f"Available Camera Controls: {self.picam2.camera_controls}")
-        print(f"Available Resolutions: {self.camera_resolutions}")
-        print(f"Final Camera Profile: {self.camera_profile}")
-        
 
     #-----
     # Camera Config Functions
@@ -207,28 +1242,36 @@ class CameraObject:
         self.still_config = self.picam2.create_still_configuration()
         self.video_config = self.picam2.create_video_configuration()
 
+    @timed_reconfigure("camera_config")
     def update_camera_config(self):
         if not self.camera_init:
             self.picam2.stop()
+            span_phase("stop")
         self.set_orientation()
         self.set_still_config()
         self.set_video_config()
+        span_phase("configure")
         if not self.camera_init:
             self.picam2.start()
+            span_phase("start")
 
+    @timed_reconfigure("camera")
     def configure_camera(self):
         if not self.camera_init:
             self.capturing_still = True
             self.stop_streaming()
             self.picam2.stop()
             time.sleep(0.1)
+            span_phase("stop")
         self.set_still_config()
         self.set_video_config()
+        span_phase("configure")
         if not self.camera_init:
             time.sleep(0.1)
             self.picam2.start()
             self.start_streaming()
             self.capturing_still = False
+            span_phase("start")
 
     def set_still_config(self):
         self.picam2.configure(self.still_config)
@@ -236,6 +1279,7 @@ class CameraObject:
     def set_video_config(self):
         self.picam2.configure(self.video_config)
 
+    @timed_reconfigure("video")
     def configure_video_config(self):
         if not self.camera_init:
             self.capturing_still = True
@@ -244,27 +1288,34 @@ class CameraObject:
             self.picam2.stop()
             self.picam2.stop()
             time.sleep(0.1)
+            span_phase("stop")
         self.set_orientation()
         self.picam2.configure(self.video_config)
+        span_phase("configure")
         if not self.camera_init:    
             time.sleep(0.1)
             self.picam2.start()
             self.start_streaming()
             self.capturing_still = False
+            span_phase("start")
     
+    @timed_reconfigure("still")
     def configure_still_config(self):
         if not self.camera_init:
             self.capturing_still = True
             self.stop_streaming()
             self.picam2.stop()
             time.sleep(0.1)
+            span_phase("stop")
         self.set_orientation()
         self.picam2.configure(self.still_config)
+        span_phase("configure")
         if not self.camera_init:
             time.sleep(0.1)
             self.picam2.start()
             self.start_streaming()
             self.capturing_still = False
+            span_phase("start")
         
 
     def load_saved_camera_profile(self):
@@ -272,51 +1323,41 @@ class CameraObject:
         if self.camera_info.get("Has_Config") and self.camera_info.get("Config_Location"):
             self.load_camera_profile(self.camera_info["Config_Location"])
 
+    @camera_command(key="profile")
+    @traced("load_camera_profile", logging.INFO, fields=lambda profile_filename: {"profile": profile_filename})
     def load_camera_profile(self, profile_filename):
         """Load and apply a camera profile from a given filename."""
         profile_path = os.path.join(camera_profile_folder, profile_filename)
+        camera_num = self.camera_info['Num']
         if not os.path.exists(profile_path):
-            print(f"Profile file not found: {profile_path}")
+            log.warning("profile file not found", extra=log_fields(camera=camera_num, path=profile_path))
             return False
         try:
             with open(profile_path, "r") as f:
                 profile_data = json.load(f)
             # ✅ Load the profile before applying any settings
             self.camera_profile = profile_data
+            span_phase("read")
             # ✅ Apply settings after loading the profile
             self.set_sensor_mode(self.camera_profile.get("sensor_mode", 0))
+            span_phase("sensor_mode")
             self.set_orientation()
             self.update_settings('hflip', self.camera_profile['hflip'])
             self.update_settings('vflip', self.camera_profile['vflip'])
             self.update_settings('saveRAW', self.camera_profile['saveRAW'])
+            span_phase("transform")
             self.apply_profile_controls()
             self.sync_live_controls()  # Ensure UI updates with the latest settings
+            span_phase("controls")
             # ✅ Update camera-last-config.json
-            try:
-                if os.path.exists(last_config_file_path):
-                    with open(last_config_file_path, "r") as f:
-                        last_config = json.load(f)
-                else:
-                    last_config = {"cameras": []}
-                # Find the matching camera entry
-                camera_num = self.camera_info['Num']
-                updated = False
-                for camera in last_config["cameras"]:
-                    if camera["Num"] == camera_num:
-                        camera["Has_Config"] = True
-                        camera["Config_Location"] = profile_filename
-                        updated = True
-                        break
-                if not updated:
-                    print(f"Camera {camera_num} not found in camera-last-config.json.")
-                with open(last_config_file_path, "w") as f:
-                    json.dump(last_config, f, indent=4)
-                print(f"Loaded profile '{profile_filename}' and updated camera-last-config.json.")
-            except Exception as e:
-                print(f"Error updating camera-last-config.json: {e}")
+            self.profile_name = profile_filename
+            if config_store.set_camera_profile(camera_num, profile_filename):
+                log.info("profile loaded", extra=log_fields(camera=camera_num, profile=profile_filename))
+            else:
+                log.warning("camera not found in camera-last-config.json", extra=log_fields(camera=camera_num, profile=profile_filename))
             return True
         except Exception as e:
-            print(f"Error loading camera profile '{profile_filename}': {e}")
+            log.error("error loading camera profile", extra=log_fields(camera=camera_num, profile=profile_filename, error=str(e)))
             return False
 
     def generate_camera_profile(self):
@@ -340,101 +1381,32 @@ class CameraObject:
         return self.camera_profile
     
     def initialize_controls_template(self, picamera2_controls):
-        with open(os.path.join(current_dir, "camera_controls_db.json"), "r") as f:
-            camera_json = json.load(f)
-        if "sections" not in camera_json:
-            print("Error: 'sections' key not found in camera_json!")
-            return camera_json  # Return unchanged if it's not structured as expected
-        # Initialize empty controls in camera_profile
-        self.camera_profile["controls"] = {}
-        for section in camera_json["sections"]:
-            if "settings" not in section:
-                print(f"Warning: Missing 'settings' key in section: {section.get('title', 'Unknown')}")
-                continue        
-            section_enabled = False  # Track if any setting is enabled
-            for setting in section["settings"]:
-                if not isinstance(setting, dict):
-                    print(f"Warning: Unexpected setting format: {setting}")
-                    continue  # Skip if it's not a dictionary
-                setting_id = setting.get("id")  # Use `.get()` to avoid crashes
-                source = setting.get("source", None)  # Check if source exists
-                original_enabled = setting.get("enabled", False)  # Preserve original enabled state
-                
-                if source == "controls":
-                    if setting_id in picamera2_controls:
-                        min_val, max_val, default_val = picamera2_controls[setting_id]
-                        print(f"Updating {setting_id}: Min={min_val}, Max={max_val}, Default={default_val}")  # Debugging
-                        setting["min"] = min_val
-                        setting["max"] = max_val
-                        if default_val is not None:
-                            setting["default"] = default_val
-                        else:
-                            default_val = False if isinstance(min_val, bool) else min_val                        
-                        if setting["enabled"]:
-                            self.camera_profile["controls"][setting_id] = default_val
-                        setting["enabled"] = original_enabled  
-                        if original_enabled:
-                            section_enabled = True                 
-                    else:
-                        print(f"Disabling {setting_id}: Not found in picamera2_controls")  # Debugging
-                        setting["enabled"] = False  # Disable setting         
-                elif source == "generatedresolutions":
-                    resolution_options = [
-                        {"value": i, "label": f"{w} x {h}", "enabled": True}
-                        for i, (w, h) in enumerate(self.camera_resolutions)
-                    ]
-                    # Use the dynamically generated resolutions
-                    setting["options"] = resolution_options
-                    section_enabled = True
-                    print(f"Updated {setting_id} with generated resolutions")
-                else:
-                    print(f"Skipping {setting_id}: No source specified, keeping existing values.")
-                    section_enabled = True  
-            
-                if "childsettings" in setting:
-                    for child in setting["childsettings"]:
-                        child_id = child.get("id")
-                        child_source = child.get("source", None)
-                        if child_source == "controls" and child_id in picamera2_controls:
-                            min_val, max_val, default_val = picamera2_controls[child_id]
-                            print(f"Updating Child Setting {child_id}: Min={min_val}, Max={max_val}, Default={default_val}")  # Debugging
-                            child["min"] = min_val
-                            child["max"] = max_val
-                            self.camera_profile["controls"][child_id] = default_val if default_val is not None else min_val
-                            if default_val is not None:
-                                child["default"] = default_val  
-                            child["enabled"] = child.get("enabled", False)
-                            if child["enabled"]:
-                                section_enabled = True  
-                        else:
-                            print(f"Skipping or Disabling Child Setting {child_id}: Not found or no source specified")
-            section["enabled"] = section_enabled
-        print(f"Initialized camera_profile controls: {self.camera_profile}")
-        return camera_json
+        live_controls, default_controls = control_template_cache.get(self.camera_info.get("Model", "Unknown"), picamera2_controls, self.camera_resolutions)
+        # Initialize controls in camera_profile with the defaults for this camera
+        self.camera_profile["controls"] = default_controls
+        return live_controls
 
+    @camera_command(key=lambda setting_id, setting_value: f"setting:{setting_id}")
+    @traced("update_settings", fields=lambda setting_id, setting_value: {"setting": setting_id})
     def update_settings(self, setting_id, setting_value):
+        camera_num = self.camera_info['Num']
+        settings_updates.labels(camera_num, "applied").inc()
         # Handle sensor mode separately
         if setting_id == "sensor_mode":
-            def sensor_mode_task():
-                try:
-                    self.set_sensor_mode(setting_value)
-                    self.camera_profile['sensor_mode'] = setting_value
-                    print(f"Sensor mode {setting_value} applied")
-                except ValueError as e:
-                    print(f"⚠️ Error: {e}")
-
-            # Start a thread and block until it completes
-            thread = threading.Thread(target=sensor_mode_task)
-            thread.start()
-            thread.join()
+            try:
+                self.set_sensor_mode(setting_value)
+                self.camera_profile['sensor_mode'] = setting_value
+                log.info("sensor mode applied", extra=log_fields(camera=camera_num, sensor_mode=setting_value))
+            except ValueError as e:
+                log.error("invalid setting", extra=log_fields(camera=camera_num, setting=setting_id, value=setting_value, error=str(e)))
         # Handle hflip and vflip separately
         elif setting_id in ["hflip", "vflip"]:
             try:
                 self.camera_profile[setting_id] = bool(int(setting_value))
                 self.update_camera_config()
-                print(f"Applied transform: {setting_id} -> {setting_value} (Camera restarted)")
+                log.info("transform applied, camera restarted", extra=log_fields(camera=camera_num, setting=setting_id, value=setting_value))
             except ValueError as e:
-                print(f"⚠️ Error: {e}")
+                log.error("invalid setting", extra=log_fields(camera=camera_num, setting=setting_id, value=setting_value, error=str(e)))
         elif setting_id in ["StillCaptureResolution", "LiveFeedResolution"]:
             try:
                 self.camera_profile['resolutions'][setting_id] = int(setting_value)
@@ -446,15 +1418,12 @@ class CameraObject:
                 if setting_id == 'LiveFeedResolution':
                     self.set_live_feed_resolution(setting_value)
 
-                print(f"Applied transform: {setting_id} -> {setting_value} (Camera restarted)")
+                log.info("resolution applied, camera restarted", extra=log_fields(camera=camera_num, setting=setting_id, value=setting_value))
             except ValueError as e:
-                print(f"⚠️ Error: {e}")
+                log.error("invalid setting", extra=log_fields(camera=camera_num, setting=setting_id, value=setting_value, error=str(e)))
         elif setting_id == "saveRAW":
-            try:
-                self.camera_profile[setting_id] = setting_value
-                print(f"Applied transform: {setting_id} -> {setting_value}")
-            except ValueError as e:
-                print(f"⚠️ Error: {e}")
+            self.camera_profile[setting_id] = setting_value
+            log.debug("setting applied", extra=log_fields(camera=camera_num, setting=setting_id, value=setting_value))
         else:
             # Convert setting_value to correct type
             if "." in str(setting_value):
@@ -463,6 +1432,8 @@ class CameraObject:
                 setting_value = int(setting_value)
             # Apply the setting
             self.picam2.set_controls({setting_id: setting_value})
+            span_phase("set_controls")
+            log.debug("control applied", extra=log_fields(camera=camera_num, setting=setting_id, value=setting_value))
             # Store in camera_profile["controls"]
             self.camera_profile.setdefault("controls", {})[setting_id] = setting_value
         # Update live settings
@@ -482,7 +1453,7 @@ class CameraObject:
             if updated:
                 break  # Exit loop once found
         if not updated:
-            print(f"⚠️ Warning: Setting {setting_id} not found in live_controls!")
+            log.warning("setting not found in live_controls", extra=log_fields(camera=camera_num, setting=setting_id))
         return setting_value  # Returning for confirmation
 
     def sync_live_controls(self):
@@ -497,7 +1468,7 @@ class CameraObject:
                     child_id = child["id"]
                     if child_id in self.camera_profile["controls"]:
                         child["value"] = self.camera_profile["controls"][child_id]
-        print("✅ Live controls updated to match camera profile.")
+        log.debug("live controls synced with camera profile", extra=log_fields(camera=self.camera_info['Num']))
 
     def apply_profile_controls(self):
         if "controls" in self.camera_profile:
@@ -505,10 +1476,9 @@ class CameraObject:
                 for setting_id, setting_value in self.camera_profile["controls"].items():
                     self.picam2.set_controls({setting_id: setting_value})
                     self.update_settings(setting_id, setting_value)  # ✅ Use the loop variables
-                    print(f"Applied Control: {setting_id} -> {setting_value}")
-                print("✅ All profile controls applied successfully")
+                log.debug("profile controls applied", extra=log_fields(camera=self.camera_info['Num'], controls=len(self.camera_profile["controls"])))
             except Exception as e:
-                print(f"⚠️ Error applying profile controls: {e}")
+                log.error("error applying profile controls", extra=log_fields(camera=self.camera_info['Num'], error=str(e)))
     
     def set_orientation(self):
         # Get current transform settings
@@ -519,8 +1489,9 @@ class CameraObject:
         # Update both video and still configs
         self.still_config['transform'] = transform
         self.video_config['transform'] = transform
-        print("Applied Orientation - hflip:", transform.hflip, "vflip:", transform.vflip)
+        log.debug("orientation applied", extra=log_fields(camera=self.camera_info['Num'], hflip=transform.hflip, vflip=transform.vflip))
     
+    @camera_command(key="sensor_mode")
     def set_sensor_mode(self, mode_index):
         try:
             # Ensure setting_value is an integer (mode index)
@@ -529,8 +1500,7 @@ class CameraObject:
                 raise ValueError("Invalid sensor mode index")
             mode = self.sensor_modes[mode_index]
             self.camera_profile["sensor_mode"] = mode_index  
-            # Print the mode for debugging
-            print(f"📷 Sensor mode selected for Camera {self.camera_info['Num']}: {mode}")
+            log.debug("sensor mode selected", extra=log_fields(camera=self.camera_info['Num'], mode=mode_index, size=mode['size'], bit_depth=mode['bit_depth']))
             # Set still and video configs
             self.still_config = self.picam2.create_still_configuration(
                 sensor={'output_size': mode['size'], 'bit_depth': mode['bit_depth']}
@@ -540,31 +1510,31 @@ class CameraObject:
             )
             self.configure_video_config()  # Apply new configuration
         except Exception as e:
-            print(f"Error saving profile: {e}")
+            log.error("error setting sensor mode", extra=log_fields(camera=self.camera_info['Num'], mode=mode_index, error=str(e)))
         
 
+    @camera_command(key="live_feed_resolution")
     def set_live_feed_resolution(self, resolution_index):
-        with self.sensor_mode_lock:  # Prevent conflicts with sensor mode changes
-            # Ensure resolution_index is an integer
-            resolution_index = int(resolution_index)
-            if resolution_index < 0 or resolution_index >= len(self.camera_resolutions):
-                raise ValueError("Invalid resolution index")
-            
-            resolution = self.camera_resolutions[resolution_index]
-            print(f"Setting live feed resolution to: {resolution}")
-
-            # Update video config
-            self.video_config = self.picam2.create_video_configuration(main={"size": resolution})
-            # Apply new configuration
-            self.configure_video_config()
+        # Ensure resolution_index is an integer
+        resolution_index = int(resolution_index)
+        if resolution_index < 0 or resolution_index >= len(self.camera_resolutions):
+            raise ValueError("Invalid resolution index")
+
+        resolution = self.camera_resolutions[resolution_index]
+        log.info("setting live feed resolution", extra=log_fields(camera=self.camera_info['Num'], resolution=resolution))
+
+        # Update video config
+        self.video_config = self.picam2.create_video_configuration(main={"size": resolution})
+        # Apply new configuration
+        self.configure_video_config()
 
     def update_camera_from_metadata(self):
         metadata = self.capture_metadata()
         if not metadata:
-            print("Failed to fetch metadata")
+            log.warning("failed to fetch metadata", extra=log_fields(camera=self.camera_info['Num']))
             return
         if "sections" not in self.live_controls:
-            print("Error: 'sections' key not found in live_controls!")
+            log.error("'sections' key not found in live_controls", extra=log_fields(camera=self.camera_info['Num']))
             return
         enabled_controls = {}
         # Extract enabled settings (including childsettings)
@@ -581,48 +1551,33 @@ class CameraObject:
             if key in metadata:
                 self.camera_profile["controls"][key] = metadata[key]
                 self.update_settings(key, metadata[key])
-                print(f"Updated from metadata - {key}: {metadata[key]}")
+                log.debug("setting updated from metadata", extra=log_fields(camera=self.camera_info['Num'], setting=key, value=metadata[key]))
 
+    @camera_command()
     def save_profile(self, filename):
         """Save the current camera profile and update camera-last-config.json."""
         try:
-            print(self.camera_profile)
+            log.debug("saving profile", extra=log_fields(camera=self.camera_info['Num'], profile=self.camera_profile))
             # Ensure .json is not already in the filename
             if filename.lower().endswith(".json"):
                 filename = filename[:-5]
             profile_path = os.path.join(camera_profile_folder, f"{filename}.json")
             # Save the profile
-            with open(profile_path, "w") as f:
-                json.dump(self.camera_profile, f, indent=4)
+            write_json_atomic(profile_path, self.camera_profile)
+            profile_catalogue.update(f"{filename}.json", self.camera_profile)
+            self.profile_name = f"{filename}.json"
             # ✅ Update camera-last-config.json
-            try:
-                if os.path.exists(last_config_file_path):
-                    with open(last_config_file_path, "r") as f:
-                        last_config = json.load(f)
-                else:
-                    last_config = {"cameras": []}  # Create an empty structure if missing
-                # Find the camera entry matching the current camera number
-                camera_num = self.camera_info["Num"]
-                updated = False
-                for camera in last_config["cameras"]:
-                    if camera["Num"] == camera_num:
-                        camera["Has_Config"] = True
-                        camera["Config_Location"] = f"{filename}.json"  # Set the new config file
-                        updated = True
-                        break
-                if not updated:
-                    print(f"Warning: Camera {camera_num} not found in camera-last-config.json.")
-                # Save the updated configuration back
-                with open(last_config_file_path, "w") as f:
-                    json.dump(last_config, f, indent=4)
-                print(f"Updated camera-last-config.json for camera {camera_num} after saving profile.")
-            except Exception as e:
-                print(f"Error updating camera-last-config.json: {e}")
+            camera_num = self.camera_info["Num"]
+            if config_store.set_camera_profile(camera_num, f"{filename}.json"):
+                log.info("profile saved", extra=log_fields(camera=camera_num, profile=f"{filename}.json"))
+            else:
+                log.warning("camera not found in camera-last-config.json", extra=log_fields(camera=camera_num, profile=f"{filename}.json"))
             return True
         except Exception as e:
-            print(f"Error saving profile: {e}")
+            log.error("error saving profile", extra=log_fields(camera=self.camera_info['Num'], error=str(e)))
             return False
 
+    @camera_command()
     def reset_to_default(self):
         # Resets camera settings to default and applies them.
         self.camera_profile = {
@@ -641,22 +1596,43 @@ class CameraObject:
         # Reinitialize UI settings
         self.live_controls = self.initialize_controls_template(self.picam2.camera_controls)
         self.update_settings("saveRAW", self.camera_profile["saveRAW"])
-        print(self.camera_profile["saveRAW"])
         self.update_camera_from_metadata()
         # Apply the default settings using the new function
         self.apply_profile_controls()
-        print("Camera profile reset to default and settings applied.")
+        log.info("camera profile reset to default", extra=log_fields(camera=self.camera_info['Num']))
 
     #-----
     # Camera Information Functions
     #-----
 
-    def capture_metadata(self):
+    def capture_metadata(self, max_age=None):
+        # Serve the sampled metadata when it is recent enough, otherwise wait for a frame
+        if max_age is not None:
+            metadata, timestamp = self.metadata_sampler.latest()
+            if metadata is not None and time.time() - timestamp <= max_age:
+                self.metadata = metadata
+                return self.metadata
+        return self.read_metadata()
+
+    @camera_command(key="metadata")
+    def read_metadata(self):
+        # Callers waiting at the same time share one capture
         self.metadata = self.picam2.capture_metadata()
-        #print(f"Metadata: {self.metadata}")
-        print(self.picam2.sensor_resolution)
         return self.metadata
 
+    def generate_metadata_events(self, interval):
+        """Server-Sent Events stream of sampled metadata, at most one event per `interval` seconds."""
+        last_timestamp = 0.0
+        while True:
+            metadata, timestamp = self.metadata_sampler.wait_newer(last_timestamp, timeout=15)
+            if timestamp <= last_timestamp:
+                yield ": keepalive\n\n"  # Nothing new, keep the connection open
+                continue
+            last_timestamp = timestamp
+            payload = json.dumps({"timestamp": timestamp, "metadata": metadata}, default=str)
+            yield f"data: {payload}\n\n"
+            time.sleep(interval)
+
     def get_camera_module_spec(self):
         # Find and return the camera module details based on the sensor model.
         camera_module = next((cam for cam in camera_module_info["camera_modules"] if cam["sensor_model"] == self.camera_info["Model"]), None)
@@ -671,7 +1647,7 @@ class CameraObject:
             if mode['size'] == active_mode.get('output_size') and mode['bit_depth'] == active_mode.get('bit_depth'):
                 active_mode_index = index
                 break
-        print(f"Active Sensor Mode: {active_mode_index}")
+        log.debug("active sensor mode", extra=log_fields(camera=self.camera_info['Num'], mode=active_mode_index))
         return active_mode_index
 
     def generate_camera_resolutions(self):
@@ -680,14 +1656,14 @@ class CameraObject:
         This list is shared between still capture and live feed resolution settings.
         """
         if not self.sensor_modes:
-            print("⚠️ Warning: No sensor modes available!")
+            log.warning("no sensor modes available", extra=log_fields(camera=self.camera_info['Num']))
             return []
 
         # Extract sensor mode resolutions
         resolutions = sorted(set(mode['size'] for mode in self.sensor_modes if 'size' in mode), reverse=True)
 
         if not resolutions:
-            print("⚠️ Warning: No valid resolutions found in sensor modes!")
+            log.warning("no valid resolutions found in sensor modes", extra=log_fields(camera=self.camera_info['Num']))
             return []
 
         max_resolution = resolutions[0]  # Highest resolution
@@ -721,56 +1697,72 @@ class CameraObject:
     
     def generate_stream(self):
         last_resolution = None  # Track last known resolution
-
-        while True:
-            if self.capturing_still:
-                frame = self.placeholder_frame
-            else:
-                with self.output.condition:
-                    self.output.condition.wait()
-                    frame = self.output.read_frame()
-
-                # 🚨 Handle invalid frames
-                if frame is None:
-                    print("🚨 Error: read_frame() returned None! Using placeholder.")
-                    frame = self.placeholder_frame
-                    continue  
-
-                if not isinstance(frame, bytes):
-                    print(f"⚠️ Warning: Frame is not bytes! Type: {type(frame)}")
-                    frame = self.placeholder_frame
-                    continue  
-
-                # ✅ Extract actual frame resolution from metadata
-                config = self.picam2.stream_configuration("main")
-                if config is None:
-                    print("🚨 stream_configuration returned None! Skipping frame...")
-                    frame = self.placeholder_frame
-                    continue  
-
-                actual_resolution = config["size"]
-                expected_resolution = self.video_config["main"]["size"]
-
-                # 🚨 Detect resolution mismatch
-                if last_resolution is None or actual_resolution != expected_resolution:
-                    print(f"🔄 Resolution change detected: {last_resolution} → {expected_resolution}")
-                    last_resolution = expected_resolution  # Update last known resolution
-
-                    # 🧹 CLEAR BUFFER to avoid old mismatched frames
-                    self.picam2.stop()
-                    self.picam2.start(show_preview=False)  # Restart stream cleanly
-                    print("✅ Buffer cleared. Restarting stream with new resolution...")
-                    continue  # Skip current frame after restart
-
-                # ✅ Check resolution before sending frame
-                if actual_resolution != expected_resolution:
-                    print(f"⚠️ Skipping frame due to resolution mismatch: {actual_resolution} expected: {expected_resolution}")
+        camera_num = self.camera_info['Num']
+        # One span per viewer, with the time spent waiting for frames and handing them to the server
+        span = Span("generate_stream", logging.INFO, camera=camera_num).start()
+        frames = placeholders = 0
+        try:
+            while True:
+                output = self.output
+                if self.capturing_still or output is None:
                     frame = self.placeholder_frame
-                    continue  
-
-            # Send frame to the stream
-            yield (b'--frame\r\n'
-                b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+                    placeholders += 1
+                    time.sleep(0.1)
+                else:
+                    wait_start = time.perf_counter()
+                    with output.condition:
+                        # Bounded, so a stalled pipeline never leaves the viewer hanging
+                        arrived = output.condition.wait(timeout=self.frame_wait_timeout())
+                        frame = output.read_frame()
+                    span.add("wait", time.perf_counter() - wait_start)
+                    if not arrived:
+                        if self.output is not output:
+                            continue  # Streaming was restarted, wait on the new output
+                        frame = self.placeholder_frame
+                        placeholders += 1
+                    else:
+                        # 🚨 Handle invalid frames
+                        if frame is None:
+                            log.debug("read_frame() returned None, skipping", extra=log_fields(camera=camera_num))
+                            continue
+
+                        if not isinstance(frame, bytes):
+                            log.debug("frame is not bytes, skipping", extra=log_fields(camera=camera_num, type=type(frame).__name__))
+                            continue
+
+                        # ✅ Extract actual frame resolution from metadata
+                        config = self.picam2.stream_configuration("main")
+                        if config is None:
+                            log.debug("stream_configuration returned None, skipping frame", extra=log_fields(camera=camera_num))
+                            continue
+
+                        actual_resolution = config["size"]
+                        expected_resolution = self.video_config["main"]["size"]
+
+                        # 🚨 Detect resolution mismatch
+                        if last_resolution is None or actual_resolution != expected_resolution:
+                            log.info("resolution change detected, restarting pipeline",
+                                     extra=log_fields(camera=camera_num, previous=last_resolution, resolution=expected_resolution))
+                            last_resolution = expected_resolution  # Update last known resolution
+
+                            # 🧹 CLEAR BUFFER to avoid old mismatched frames, queued so viewers never touch the camera directly
+                            self.commands.submit(self.restart_pipeline, key="restart_pipeline")
+                            continue  # Skip current frame after restart
+
+                        # ✅ Check resolution before sending frame
+                        if actual_resolution != expected_resolution:
+                            log.debug("skipping frame due to resolution mismatch",
+                                      extra=log_fields(camera=camera_num, resolution=actual_resolution, expected=expected_resolution))
+                            continue
+                        frames += 1
+
+                # Send frame to the stream
+                send_start = time.perf_counter()
+                yield (b'--frame\r\n'
+                    b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+                span.add("send", time.perf_counter() - send_start)
+        finally:
+            span.finish(frames=frames, placeholders=placeholders)
 
     def oldgenerate_stream(self):
         while True:
@@ -782,19 +1774,22 @@ class CameraObject:
                     self.output.condition.wait()  # Wait for new frame
                     frame = self.output.read_frame()
 
-            # Debugging print statements
             if frame is None:
-                print("🚨 Error: read_frame() returned None!")
+                log.error("read_frame() returned no frame", extra=log_fields(camera=self.camera_info['Num']))
                 continue  # Skip this iteration
 
             if not isinstance(frame, bytes):
-                print(f"⚠️ Warning: Frame is not bytes! Type: {type(frame)}")
+                log.warning("frame is not bytes", extra=log_fields(camera=self.camera_info['Num'], type=type(frame).__name__))
                 continue  # Skip this iteration
 
             # Send frame to the stream
             yield (b'--frame\r\n'
                 b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
 
+    def restart_pipeline(self):
+        self.picam2.stop()
+        self.picam2.start(show_preview=False)  # Restart stream cleanly
+
     def generate_placeholder_frame(self):
         mode_index = int(self.camera_profile["sensor_mode"])
         if mode_index < 0 or mode_index >= len(self.sensor_modes):
@@ -806,55 +1801,145 @@ class CameraObject:
         img.save(buf, format='JPEG')
         return buf.getvalue()
 
+    def on_request(self, request):
+        # Installed as the Picamera2 post_callback, called for every completed request
+        self.last_request_time = time.monotonic()
+        self.metadata_sampler.on_request(request)
+
+    def expected_frame_interval(self):
+        """Seconds between frames at the current frame duration (exposure can make it longer than configured)."""
+        metadata, _ = self.metadata_sampler.latest()
+        duration = (metadata or {}).get("FrameDuration")
+        if not duration:
+            limits = (self.video_config.get("controls") or {}).get("FrameDurationLimits")
+            duration = max(limits) if limits else None
+        return duration / 1e6 if duration else 1 / 30
+
+    def frame_wait_timeout(self):
+        # How long a viewer waits for a frame before it is sent the placeholder
+        return max(app.config['stream_frame_timeout'], 2 * self.expected_frame_interval())
+
+    def publish_frame(self, frame):
+        self.last_frame_time = time.monotonic()
+        self.frames_metric.inc()
+        self.frame_bytes_metric.inc(len(frame))
+        for listener in list(self.frame_listeners):
+            listener(frame)
+
+    @camera_command(key="streaming")
     def start_streaming(self):
-        self.output = StreamingOutput()
+        self.output = StreamingOutput(on_frame=self.publish_frame)
+        self.last_frame_time = time.monotonic()  # The watchdog times a new stream from here
         self.picam2.start_recording(MJPEGEncoder(), output=FileOutput(self.output))
-        print("[INFO] Streaming started")
+        log.info("streaming started", extra=log_fields(camera=self.camera_info['Num']))
         time.sleep(1)
 
+    @camera_command(key="streaming")
     def stop_streaming(self):
         if self.output:  # Ensure streaming was started before stopping
             self.picam2.stop_recording()
-            print("[INFO] Streaming stopped")
+            log.info("streaming stopped", extra=log_fields(camera=self.camera_info['Num']))
+
+    @camera_command(key="recover")
+    def recover_pipeline(self, action):
+        """Bring the pipeline back, called by the watchdog with one of PipelineWatchdog.ACTIONS.
+
+        restart_stream restarts the encoder, reconfigure also stops and configures the
+        camera, reopen closes the camera and opens it again with the current profile.
+        """
+        camera_num = self.camera_info['Num']
+        with Span("recover_pipeline", logging.INFO, camera=camera_num, action=action):
+            # The pipeline is broken, so stopping it may fail too
+            try:
+                self.stop_streaming()
+            except Exception as e:
+                log.warning("error stopping stream", extra=log_fields(camera=camera_num, error=str(e)))
+            span_phase("stop_streaming")
+            if action in ("reconfigure", "reopen"):
+                try:
+                    self.picam2.stop()
+                    if action == "reopen":
+                        self.picam2.close()
+                except Exception as e:
+                    log.warning("error stopping camera", extra=log_fields(camera=camera_num, error=str(e)))
+                span_phase("stop")
+                if action == "reopen":
+                    self.picam2 = Picamera2(camera_num)
+                    self.picam2.post_callback = self.on_request
+                    span_phase("open")
+                self.set_orientation()
+                self.picam2.configure(self.video_config)
+                span_phase("configure")
+                self.picam2.start()
+                if action == "reopen":
+                    self.apply_profile_controls()
+                span_phase("start")
+            self.capture_errors = 0
+            self.capturing_still = False
+            self.start_streaming()
+            span_phase("start_streaming")
 
     #-----
     # Camera Capture Functions
     #-----
 
+    @camera_command(timeout_setting='camera_capture_timeout')
     def take_still(self, camera_num, image_name):
-        try:
-            self.capturing_still = True  # Start sending placeholder frames
-            time.sleep(0.5)  # Short delay to allow clients to receive the placeholder
-            self.stop_streaming()
-            filepath = os.path.join(app.config['upload_folder'], image_name)
-            # This will be the new way to save images at max quality just need to make the save as DNG setting available
-            buffers, metadata = self.picam2.switch_mode_and_capture_buffers(self.still_config, ["main", "raw"])
-            self.picam2.helpers.save(self.picam2.helpers.make_image(buffers[0], self.still_config["main"]), metadata, f"{filepath}.jpg")
-            if self.camera_profile["saveRAW"]:
-                self.picam2.helpers.save_dng(buffers[1], metadata, self.still_config["raw"], f"{filepath}.dng")
-            
-            # Switch to still mode and capture the image
-            #self.picam2.switch_mode_and_capture_file(self.still_config, f"{filepath}.jpg")
-            print(f"Image captured successfully. Path: {filepath}")
-            # Restart video mode
-            self.start_streaming()
-            print("Applied video config:", self.picam2.camera_configuration())
-             
-            self.capturing_still = False
-            return f'{filepath}.jpg'
-        except Exception as e:
-            print(f"Error capturing image: {e}")
-            return None
-
+        with Span("take_still", logging.INFO, camera=camera_num, image=image_name) as span:
+            try:
+                self.capturing_still = True  # Start sending placeholder frames
+                time.sleep(0.5)  # Short delay to allow clients to receive the placeholder
+                span.phase("placeholder")
+                self.stop_streaming()
+                span.phase("stop_streaming")
+                filepath = os.path.join(app.config['upload_folder'], image_name)
+                # This will be the new way to save images at max quality just need to make the save as DNG setting available
+                buffers, metadata = self.picam2.switch_mode_and_capture_buffers(self.still_config, ["main", "raw"])
+                span.phase("capture")
+                self.picam2.helpers.save(self.picam2.helpers.make_image(buffers[0], self.still_config["main"]), metadata, f"{filepath}.jpg")
+                span.phase("save_jpeg")
+                if self.camera_profile["saveRAW"]:
+                    self.picam2.helpers.save_dng(buffers[1], metadata, self.still_config["raw"], f"{filepath}.dng")
+                    span.phase("save_dng")
+                raw = self.still_config.get("raw") or {}
+                sensor_mode = f"{raw['size'][0]}x{raw['size'][1]} {raw.get('format', '')}".strip() if raw.get("size") else None
+                try:
+                    write_json_atomic(capture_sidecar_path(f"{filepath}.jpg"), build_capture_record(metadata, camera_num, sensor_mode, self.profile_name))
+                except OSError as e:
+                    log.error("error saving capture metadata", extra=log_fields(camera=camera_num, image=image_name, error=str(e)))
+                image_gallery_manager.add_image(f"{image_name}.jpg")
+                span.phase("index")
+                
+                # Switch to still mode and capture the image
+                #self.picam2.switch_mode_and_capture_file(self.still_config, f"{filepath}.jpg")
+                # Restart video mode
+                self.start_streaming()
+                span.phase("start_streaming")
+                log.debug("video config restored", extra=log_fields(camera=camera_num, config=self.picam2.camera_configuration()))
+                 
+                self.capturing_still = False
+                self.capture_errors = 0
+                self.capture_metric.observe(time.perf_counter() - span.start_time)
+                return f'{filepath}.jpg'
+            except Exception as e:
+                log.error("error capturing image", extra=log_fields(camera=camera_num, image=image_name, error=str(e)))
+                self.capture_failures_metric.inc()
+                self.capture_errors += 1
+                # Back to the live feed, the watchdog restarts the stream if the capture left it stopped
+                self.capturing_still = False
+                span.fields["error"] = type(e).__name__
+                return None
+
+    @camera_command(key=lambda camera_num, image_name: f"snapshot:{image_name}")
     def take_still_from_feed(self, camera_num, image_name):
         try:
             filepath = os.path.join(app.config['upload_folder'], image_name)
             request = self.picam2.capture_request()
             request.save("main", f'{filepath}.jpg')
-            print(f"Image captured successfully. Path: {filepath}")
+            log.info("image captured from feed", extra=log_fields(camera=camera_num, path=f"{filepath}.jpg"))
             return f'{filepath}.jpg'
         except Exception as e:
-            print(f"Error capturing image: {e}")
+            log.error("error capturing image from feed", extra=log_fields(camera=camera_num, image=image_name, error=str(e)))
             return None
 
 
@@ -884,7 +1969,7 @@ class GPIO:
                 return gpio_template
 
         except (json.JSONDecodeError, FileNotFoundError, ValueError) as e:
-            print(f"Error loading GPIO config: {e}")
+            log.error("error loading GPIO config", extra=log_fields(error=str(e)))
             return []
 
     def get_gpio_pins(self):
@@ -895,86 +1980,889 @@ class GPIO:
 # ImageGallery Class
 ####################
 
-class ImageGallery:
-    def __init__(self, upload_folder, items_per_page=10):
-        self.upload_folder = upload_folder
-        self.items_per_page = items_per_page
-        self.items_per_page = 12
+# Capture metadata kept for each still: sidecar/index field -> libcamera metadata key
+capture_metadata_fields = {
+    "exposure_time": "ExposureTime",  # Microseconds
+    "analogue_gain": "AnalogueGain",
+    "digital_gain": "DigitalGain",
+    "lux": "Lux",
+    "colour_temperature": "ColourTemperature",
+    "lens_position": "LensPosition",
+}
 
-    def get_image_files(self):
-         # Fetch image file details, including timestamps, resolution, and DNG presence.
+def capture_sidecar_path(image_path):
+    # photo.jpg -> photo.json, next to the image and its .dng
+    return os.path.splitext(image_path)[0] + '.json'
+
+def build_capture_record(metadata, camera_num, sensor_mode=None, profile=None):
+    """Pick the fields worth searching on out of the metadata of a capture."""
+    record = {field: metadata.get(key) for field, key in capture_metadata_fields.items()}
+    record.update(camera_num=camera_num, sensor_mode=sensor_mode, profile=profile, captured_at=int(time.time()))
+    return record
+
+def read_capture_sidecar(image_path):
+    try:
+        with open(capture_sidecar_path(image_path), 'r') as f:
+            record = json.load(f)
+        return record if isinstance(record, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        log.warning("ignoring unreadable capture metadata", extra=log_fields(file=os.path.basename(image_path), error=str(e)))
+        return {}
+
+class GalleryIndex:
+    """Persistent SQLite index of the images in the gallery folder.
+
+    Captures, edits and deletes update the index directly. reconcile() compares it
+    with the folder to pick up files that were added or removed some other way.
+    Only files whose mtime or size changed are opened again.
+
+    Capture metadata comes from the JSON sidecar written with each still, so the
+    gallery can filter and sort on it without opening the images.
+    """
+    SCHEMA_VERSION = 4
+    FILENAME_PATTERN = re.compile(r'_camera_(\d+)_')
+    SORT_COLUMNS = ("timestamp", "exposure_time", "analogue_gain", "lux", "colour_temperature", "lens_position")
+
+    def __init__(self, upload_folder, db_path):
+        self.upload_folder = upload_folder
+        self.lock = threading.Lock()
+        self.skipped = set()  # Files already reported as not matching the filename pattern
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+            # The index can always be rebuilt from the folder, so just start over
+            self.db.execute("DROP TABLE IF EXISTS images")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS images (
+                filename TEXT PRIMARY KEY,
+                camera_num INTEGER,
+                timestamp INTEGER NOT NULL,
+                width INTEGER,
+                height INTEGER,
+                has_dng INTEGER NOT NULL DEFAULT 0,
+                dng_size INTEGER NOT NULL DEFAULT 0,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                exposure_time INTEGER,
+                analogue_gain REAL,
+                digital_gain REAL,
+                lux REAL,
+                colour_temperature INTEGER,
+                lens_position REAL,
+                sensor_mode TEXT,
+                profile TEXT,
+                phash INTEGER
+            )""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS images_by_time ON images (timestamp DESC, filename DESC)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS images_by_camera ON images (camera_num, timestamp DESC, filename DESC)")
+        for column in self.SORT_COLUMNS[1:]:
+            self.db.execute(f"CREATE INDEX IF NOT EXISTS images_by_{column} ON images ({column}, filename)")
+        # Rewritten files lose their hash, this finds the ones the hasher still has to do
+        self.db.execute("CREATE INDEX IF NOT EXISTS images_missing_phash ON images (timestamp) WHERE phash IS NULL")
+        self.db.execute(f"PRAGMA user_version={self.SCHEMA_VERSION}")
+        self.db.commit()
+
+    @classmethod
+    def parse_filename(cls, filename):
+        """Return (camera_num, unix_timestamp) from a gallery filename, or None if it doesn't match."""
         try:
-            image_files = [f for f in os.listdir(self.upload_folder) if f.endswith('.jpg')]
-            files_and_timestamps = []
+            unix_timestamp = int(filename.split('_')[-1].split('.')[0])
+        except ValueError:
+            return None
+        match = cls.FILENAME_PATTERN.search(filename)
+        return (int(match.group(1)) if match else None), unix_timestamp
+
+    def build_row(self, filename, stat=None, dng_size=None):
+        parsed = self.parse_filename(filename)
+        if parsed is None:
+            if filename not in self.skipped:
+                log.warning("skipping file with an incorrect timestamp format", extra=log_fields(file=filename))
+                self.skipped.add(filename)
+            return None
+        img_path = os.path.join(self.upload_folder, filename)
+        if stat is None:
+            stat = os.stat(img_path)
+        # Only the header is read to get the resolution
+        with Image.open(img_path) as img:
+            width, height = img.size
+        if dng_size is None:
+            try:
+                dng_size = os.path.getsize(os.path.join(self.upload_folder, os.path.splitext(filename)[0] + '.dng'))
+            except FileNotFoundError:
+                dng_size = 0
+        camera_num, unix_timestamp = parsed
+        capture = read_capture_sidecar(img_path)
+        return {
+            **{field: capture.get(field) for field in capture_metadata_fields},
+            "sensor_mode": capture.get("sensor_mode"),
+            "profile": capture.get("profile"),
+            "filename": filename,
+            "camera_num": camera_num,
+            "timestamp": unix_timestamp,
+            "width": width,
+            "height": height,
+            "has_dng": int(dng_size > 0),
+            "dng_size": dng_size,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+        }
 
-            for image_file in image_files:
-                # Extract timestamp from filename
+    def upsert(self, rows):
+        # Caller must hold self.lock, all rows come from build_row() so share the same keys
+        if not rows:
+            return
+        columns = list(rows[0])
+        sql = f"INSERT OR REPLACE INTO images ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})"
+        self.db.executemany(sql, rows)
+
+    def add(self, filename):
+        """Index (or re-index) a single .jpg in the gallery folder."""
+        if os.path.dirname(filename) or not filename.endswith('.jpg'):
+            return
+        try:
+            row = self.build_row(filename)
+        except (OSError, Image.UnidentifiedImageError) as e:
+            log.error("error indexing image", extra=log_fields(file=filename, error=str(e)))
+            return
+        if row is None:
+            return
+        with self.lock:
+            self.upsert([row])
+            self.db.commit()
+
+    def remove(self, filename):
+        with self.lock:
+            self.db.execute("DELETE FROM images WHERE filename = ?", (filename,))
+            self.db.commit()
+
+    def set_dng(self, filename, dng_size):
+        """Record the size of the .dng next to `filename`, 0 if there is none."""
+        with self.lock:
+            self.db.execute("UPDATE images SET has_dng = ?, dng_size = ? WHERE filename = ?", (int(dng_size > 0), dng_size, filename))
+            self.db.commit()
+
+    def reconcile(self):
+        """Bring the index in line with the gallery folder. Returns (added, removed) counts."""
+        start = time.perf_counter()
+        on_disk = {}
+        dng_sizes = {}
+        with os.scandir(self.upload_folder) as it:
+            for entry in it:
+                if entry.name.endswith('.jpg') and entry.is_file():
+                    on_disk[entry.name] = entry.stat()
+                elif entry.name.endswith('.dng') and entry.is_file():
+                    dng_sizes[entry.name] = entry.stat().st_size
+        with self.lock:
+            indexed = {row["filename"]: (row["size"], row["mtime"], row["dng_size"]) for row in self.db.execute("SELECT filename, size, mtime, dng_size FROM images")}
+        removed = [name for name in indexed if name not in on_disk]
+        changed = []
+        dng_updates = []
+        for name, stat in on_disk.items():
+            dng_size = dng_sizes.get(os.path.splitext(name)[0] + '.dng', 0)
+            known = indexed.get(name)
+            if known is None or known[0] != stat.st_size or known[1] != stat.st_mtime_ns:
                 try:
-                    unix_timestamp = int(image_file.split('_')[-1].split('.')[0])
-                    timestamp = datetime.utcfromtimestamp(unix_timestamp).strftime('%Y-%m-%d %H:%M:%S')
-                except ValueError:
-                    logging.warning(f"Skipping file {image_file} due to incorrect timestamp format")
-                    continue  # Skip files with incorrect format
+                    row = self.build_row(name, stat, dng_size)
+                except (OSError, Image.UnidentifiedImageError) as e:
+                    log.error("error indexing image", extra=log_fields(file=name, error=str(e)))
+                    continue
+                if row is not None:
+                    changed.append(row)
+            elif known[2] != dng_size:
+                dng_updates.append((int(dng_size > 0), dng_size, name))
+        with self.lock:
+            self.db.executemany("DELETE FROM images WHERE filename = ?", [(name,) for name in removed])
+            self.upsert(changed)
+            self.db.executemany("UPDATE images SET has_dng = ?, dng_size = ? WHERE filename = ?", dng_updates)
+            self.db.commit()
+        if removed or changed:
+            log.info("gallery index reconciled", extra=log_fields(changed=len(changed), removed=len(removed), seconds=round(time.perf_counter() - start, 2)))
+        return len(changed), len(removed)
+
+    def start_reconciler(self, interval=300):
+        """Reconcile now and then every `interval` seconds in a background thread."""
+        def run():
+            while True:
+                try:
+                    self.reconcile()
+                except Exception as e:
+                    log.error("error reconciling gallery index", extra=log_fields(error=str(e)))
+                time.sleep(interval)
+        threading.Thread(target=run, name="gallery-reconciler", daemon=True).start()
+
+    def count(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def retention_rows(self):
+        """(filename, camera_num, timestamp, size, dng_size, phash) for every image, oldest first."""
+        with self.lock:
+            return self.db.execute("SELECT filename, camera_num, timestamp, size, dng_size, phash FROM images ORDER BY timestamp ASC, filename ASC").fetchall()
+
+    def missing_phashes(self, limit=50):
+        """Filenames of images that have no perceptual hash yet, newest first."""
+        with self.lock:
+            return [row["filename"] for row in self.db.execute("SELECT filename FROM images WHERE phash IS NULL ORDER BY timestamp DESC LIMIT ?", (limit,))]
+
+    def set_phashes(self, hashes):
+        """Store perceptual hashes, `hashes` maps filename -> unsigned 64 bit hash."""
+        with self.lock:
+            self.db.executemany("UPDATE images SET phash = ? WHERE filename = ?", [(to_signed64(value), filename) for filename, value in hashes.items()])
+            self.db.commit()
+
+    def phashes(self):
+        """filename -> unsigned 64 bit hash for every hashed image."""
+        with self.lock:
+            return {row["filename"]: to_unsigned64(row["phash"]) for row in self.db.execute("SELECT filename, phash FROM images WHERE phash IS NOT NULL")}
+
+    def query(self, limit=None, offset=0):
+        """Return image rows, newest first."""
+        sql = "SELECT * FROM images ORDER BY timestamp DESC, filename DESC"
+        params = ()
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params = (limit, offset)
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def query_page(self, filters=None, cursor=None, limit=12, sort="timestamp", descending=True):
+        """Keyset-paginated query, newest first by default.
+
+        `filters` may hold camera_num, since, until (unix seconds, inclusive), has_dng,
+        width, height, min_width, min_height, profile, sensor_mode and min_/max_ bounds
+        for each capture metadata field (e.g. max_exposure_time, min_lux). `sort` is
+        one of SORT_COLUMNS, sorting on a metadata field leaves out images without
+        it. `cursor` is the value returned as next_cursor by the previous page of
+        the same query. Returns (rows, next_cursor), next_cursor is None on the last
+        page.
+        """
+        if sort not in self.SORT_COLUMNS:
+            raise ValueError(f"Can't sort on {sort}")
+        filters = filters or {}
+        clauses = []
+        params = []
+        bounds = [("camera_num", "camera_num = ?"), ("since", "timestamp >= ?"), ("until", "timestamp <= ?"),
+                  ("width", "width = ?"), ("height", "height = ?"),
+                  ("min_width", "width >= ?"), ("min_height", "height >= ?"),
+                  ("profile", "profile = ?"), ("sensor_mode", "sensor_mode = ?")]
+        for field in capture_metadata_fields:
+            bounds += [(f"min_{field}", f"{field} >= ?"), (f"max_{field}", f"{field} <= ?")]
+        for key, clause in bounds:
+            if filters.get(key) is not None:
+                clauses.append(clause)
+                params.append(filters[key])
+        if filters.get("has_dng") is not None:
+            clauses.append("has_dng = ?")
+            params.append(int(bool(filters["has_dng"])))
+        if sort != "timestamp":
+            clauses.append(f"{sort} IS NOT NULL")
+        if cursor:
+            last_value, last_filename = self.decode_cursor(cursor)
+            clauses.append(f"({sort}, filename) {'<' if descending else '>'} (?, ?)")
+            params.extend([last_value, last_filename])
+        sql = "SELECT * FROM images"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        # Fetch one extra row to know whether there is a next page
+        direction = "DESC" if descending else "ASC"
+        sql += f" ORDER BY {sort} {direction}, filename {direction} LIMIT ?"
+        params.append(limit + 1)
+        start = time.perf_counter()
+        with self.lock:
+            rows = self.db.execute(sql, params).fetchall()
+        gallery_query_seconds.labels(sort).observe(time.perf_counter() - start)
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self.encode_cursor(rows[-1][sort], rows[-1]["filename"])
+        return rows, next_cursor
+
+    @staticmethod
+    def encode_cursor(value, filename):
+        return base64.urlsafe_b64encode(json.dumps([value, filename]).encode()).decode().rstrip("=")
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            value, filename = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise TypeError("cursor value must be a number")
+            return value, str(filename)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Invalid cursor: {cursor}") from e
+
+    @staticmethod
+    def row_to_image(row):
+        # Same shape the gallery templates have always used
+        return {
+            'filename': row["filename"],
+            'camera_num': row["camera_num"],
+            'unix_timestamp': row["timestamp"],
+            'timestamp': datetime.utcfromtimestamp(row["timestamp"]).strftime('%Y-%m-%d %H:%M:%S'),
+            'has_dng': bool(row["has_dng"]),
+            'dng_file': os.path.splitext(row["filename"])[0] + '.dng',
+            'width': row["width"],
+            'height': row["height"],
+            # Changes whenever the file is rewritten, used to version thumbnail URLs
+            'version': row["mtime"],
+            'capture': {key: row[key] for key in (*capture_metadata_fields, "sensor_mode", "profile")},
+            'phash': f"{to_unsigned64(row['phash']):016x}" if row["phash"] is not None else None
+        }
 
-                # Check if corresponding .dng file exists
-                dng_file = os.path.splitext(image_file)[0] + '.dng'
-                has_dng = os.path.exists(os.path.join(self.upload_folder, dng_file))
+# Lossless transposes for clockwise rotations by a multiple of 90 degrees
+rotation_transposes = {
+    90: Image.Transpose.ROTATE_270,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_90,
+}
 
-                # Get image resolution
-                img_path = os.path.join(self.upload_folder, image_file)
-                with Image.open(img_path) as img:
-                    width, height = img.size
-
-                # Append file details
-                files_and_timestamps.append({
-                    'filename': image_file,
-                    'timestamp': timestamp,
-                    'has_dng': has_dng,
-                    'dng_file': dng_file,
-                    'width': width,
-                    'height': height
-                })
-
-            # Sort files by timestamp (newest first)
-            files_and_timestamps.sort(key=lambda x: x['timestamp'], reverse=True)
-            return files_and_timestamps
+def build_adjustment_lut(edits, histogram=None):
+    """Compose every tonal edit into one 768 entry RGB lookup table for Image.point().
+
+    Per channel the steps are: white balance gain, levels (black/white point),
+    brightness, contrast and gamma. brightness and contrast use the editor's 0-200
+    range like ImageEnhance, contrast pivots around the mean grey of the image at
+    that point, which is worked out from `histogram` instead of another pass. The
+    histogram is only needed when contrast changes.
+    """
+    gains = [float(edits.get(key, 1.0)) for key in ("wb_red", "wb_green", "wb_blue")]
+    black_point = float(edits.get("black_point", 0))
+    white_point = float(edits.get("white_point", 255))
+    level_scale = 255.0 / max(white_point - black_point, 1.0)
+    brightness = max(0.1, float(edits.get("brightness", 100)) / 100)
+    contrast = max(0.1, float(edits.get("contrast", 100)) / 100)
+    gamma = max(0.05, float(edits.get("gamma", 1.0)))
+
+    # Everything before contrast, per channel, as floats in 0-255
+    pre_contrast = []
+    for gain in gains:
+        pre_contrast.append([min(max((min(v * gain, 255.0) - black_point) * level_scale, 0.0), 255.0) * brightness for v in range(256)])
+
+    mean = 0.0
+    if contrast != 1.0:
+        # Mean of the greyscale (ITU-R 601-2 luma, as ImageEnhance.Contrast uses) image
+        pixels = sum(histogram[0:256]) or 1
+        channel_means = [sum(count * table[v] for v, count in enumerate(histogram[c * 256:(c + 1) * 256])) / pixels for c, table in enumerate(pre_contrast)]
+        mean = int(min(0.299 * channel_means[0] + 0.587 * channel_means[1] + 0.114 * channel_means[2], 255.0) + 0.5)
+
+    lut = []
+    for table in pre_contrast:
+        for value in table:
+            value = min(max(value, 0.0), 255.0)
+            if contrast != 1.0:
+                value = min(max(mean + (value - mean) * contrast, 0.0), 255.0)
+            if gamma != 1.0:
+                value = 255.0 * (value / 255.0) ** (1.0 / gamma)
+            lut.append(int(value + 0.5))
+    return lut
+
+def apply_edits(img, edits):
+    """Apply gallery edits to an RGB image and return the result.
+
+    All tonal edits are applied in a single Image.point() pass through one lookup
+    table. Rotation is in degrees clockwise, multiples of 90 are lossless transposes.
+    """
+    tonal = {"brightness": 100, "contrast": 100, "gamma": 1.0, "black_point": 0, "white_point": 255, "wb_red": 1.0, "wb_green": 1.0, "wb_blue": 1.0}
+    if any(float(edits[key]) != default for key, default in tonal.items() if key in edits):
+        # The histogram is another full pass over the image, only contrast needs it
+        histogram = img.histogram() if float(edits.get("contrast", 100)) != 100 else None
+        img = img.point(build_adjustment_lut(edits, histogram))
+
+    # Apply absolute rotation (mod 360 to prevent stacking errors)
+    if "rotation" in edits:
+        rotation_angle = int(float(edits["rotation"])) % 360
+        if rotation_angle in rotation_transposes:
+            img = img.transpose(rotation_transposes[rotation_angle])
+        elif rotation_angle:
+            img = img.rotate(-rotation_angle, expand=True, resample=Image.BICUBIC)
+    return img
+
+class EditSessions:
+    """Interactive editing sessions backed by a downscaled proxy of the image.
+
+    Opening a session decodes the image once, in JPEG draft mode, down to
+    PROXY_SIZE. Every preview tweak reuses that proxy. Saving queues the
+    full-resolution render on a background worker and returns a job id to poll.
+    """
+    PROXY_SIZE = 1280
+    MAX_SESSIONS = 4
+    SESSION_TIMEOUT = 15 * 60
+
+    def __init__(self, gallery):
+        self.gallery = gallery
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()  # session id -> {"filename", "proxy", "last_used"}
+        self.jobs = {}
+        self.render_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="edit-render")
+
+    def open(self, filename):
+        image_path = os.path.join(self.gallery.upload_folder, filename)
+        with Image.open(image_path) as img:
+            img.draft('RGB', (self.PROXY_SIZE, self.PROXY_SIZE))
+            proxy = ImageOps.exif_transpose(img).convert('RGB')
+        proxy.thumbnail((self.PROXY_SIZE, self.PROXY_SIZE), Image.LANCZOS)
+        session_id = secrets.token_urlsafe(8)
+        with self.lock:
+            self.expire()
+            self.sessions[session_id] = {"filename": filename, "proxy": proxy, "last_used": time.time()}
+            while len(self.sessions) > self.MAX_SESSIONS:
+                self.sessions.popitem(last=False)
+        return session_id, proxy.size
+
+    def expire(self):
+        # Caller must hold self.lock
+        cutoff = time.time() - self.SESSION_TIMEOUT
+        for session_id in [sid for sid, session in self.sessions.items() if session["last_used"] < cutoff]:
+            del self.sessions[session_id]
+
+    def session_for_file(self, filename):
+        """Return the id of an open session for `filename`, opening one if needed."""
+        with self.lock:
+            for session_id, open_session in self.sessions.items():
+                if open_session["filename"] == filename:
+                    return session_id
+        return self.open(filename)[0]
+
+    def preview(self, session_id, edits, quality=85):
+        """Render `edits` on the session proxy and return JPEG bytes, None if the session expired."""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                return None
+            session["last_used"] = time.time()
+            self.sessions.move_to_end(session_id)
+        img = apply_edits(session["proxy"], edits)
+        buf = io.BytesIO()
+        img.save(buf, format='JPEG', quality=quality)
+        return buf.getvalue()
 
+    def submit_render(self, filename, edits, save_option, new_filename=None):
+        """Queue the full-resolution render of an edit. Returns a job id."""
+        job_id = secrets.token_urlsafe(8)
+        with self.lock:
+            self.jobs[job_id] = {"state": "queued", "filename": filename, "message": None, "submitted": time.time()}
+            # Only keep the most recent jobs around for polling
+            for old_id in list(self.jobs)[:-50]:
+                del self.jobs[old_id]
+        self.render_pool.submit(self._render, job_id, filename, edits, save_option, new_filename)
+        return job_id
+
+    def _render(self, job_id, filename, edits, save_option, new_filename):
+        self.update_job(job_id, state="running")
+        start = time.perf_counter()
+        try:
+            success, message = self.gallery.save_edit(filename, edits, save_option, new_filename)
         except Exception as e:
-            logging.error(f"Error loading image files: {e}")
-            return []
+            log.error("error rendering edit", extra=log_fields(file=filename, error=str(e)))
+            success, message = False, "Error saving edit"
+        self.update_job(job_id, state="done" if success else "failed", message=message, seconds=round(time.perf_counter() - start, 3))
+
+    def update_job(self, job_id, **changes):
+        # The job may already have been dropped to make room for newer ones
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job.update(changes)
+
+    def job_status(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+class ThumbnailCache:
+    """Downscaled JPEG copies of gallery images, kept on disk within a size budget.
+
+    Widths are snapped to WIDTHS so each image has a small, fixed set of variants.
+    JPEG draft mode lets the decoder downscale while decoding, so a thumbnail never
+    needs the full-resolution image in memory. The least recently used thumbnails
+    are evicted once the folder grows past `max_bytes`.
+    """
+    WIDTHS = (160, 320, 480, 640, 960)
+    EAGER_WIDTHS = (480,)  # Generated right after capture, the size the gallery grid uses
+
+    def __init__(self, upload_folder, folder, max_bytes=200 * 1024 * 1024, workers=2):
+        self.upload_folder = upload_folder
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnail")
+        os.makedirs(self.folder, exist_ok=True)
+        # Least recently used first: thumbnail name -> size in bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        existing = []
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if entry.name.endswith('.jpg') and entry.is_file():
+                    stat = entry.stat()
+                    existing.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(existing):
+            self.entries[name] = size
+            self.total_bytes += size
+
+    def snap_width(self, width):
+        return min(self.WIDTHS, key=lambda w: abs(w - width))
+
+    def thumbnail_name(self, filename, width):
+        return f"{os.path.splitext(filename)[0]}_w{width}.jpg"
+
+    def get(self, filename, width):
+        """Return the path of an up to date thumbnail, generating it if needed."""
+        width = self.snap_width(width)
+        source_path = os.path.join(self.upload_folder, filename)
+        name = self.thumbnail_name(filename, width)
+        thumb_path = os.path.join(self.folder, name)
+        source_mtime = os.stat(source_path).st_mtime
+        try:
+            if os.stat(thumb_path).st_mtime >= source_mtime:
+                with self.lock:
+                    if name in self.entries:
+                        self.entries.move_to_end(name)
+                return thumb_path
+        except FileNotFoundError:
+            pass
+        return self.generate(filename, width)
+
+    def generate(self, filename, width):
+        source_path = os.path.join(self.upload_folder, filename)
+        name = self.thumbnail_name(filename, width)
+        thumb_path = os.path.join(self.folder, name)
+        with Image.open(source_path) as img:
+            # Let the JPEG decoder scale down by 1/2, 1/4 or 1/8 while decoding
+            img.draft('RGB', (width, width))
+            img = ImageOps.exif_transpose(img).convert('RGB')
+            img.thumbnail((width, width * 4), Image.LANCZOS)
+            fd, tmp_path = tempfile.mkstemp(dir=self.folder, prefix=".tmp-", suffix=".jpg")
+            with os.fdopen(fd, "wb") as f:
+                img.save(f, format='JPEG', quality=80, optimize=True)
+            os.replace(tmp_path, thumb_path)
+        size = os.path.getsize(thumb_path)
+        with self.lock:
+            self.total_bytes += size - self.entries.pop(name, 0)
+            self.entries[name] = size
+        self.evict()
+        return thumb_path
+
+    def generate_in_background(self, filename):
+        """Queue the eager widths for a new or edited image."""
+        for width in self.EAGER_WIDTHS:
+            self.pool.submit(self._generate_quietly, filename, width)
+
+    def _generate_quietly(self, filename, width):
+        try:
+            self.generate(filename, width)
+        except Exception as e:
+            log.error("error generating thumbnail", extra=log_fields(file=filename, width=width, error=str(e)))
+
+    def remove(self, filename):
+        for width in self.WIDTHS:
+            name = self.thumbnail_name(filename, width)
+            with self.lock:
+                size = self.entries.pop(name, None)
+                if size is not None:
+                    self.total_bytes -= size
+            if size is not None:
+                try:
+                    os.remove(os.path.join(self.folder, name))
+                except FileNotFoundError:
+                    pass
 
-    def paginate_images(self, page):
-        """Paginate images dynamically after an image is deleted."""
-        all_images = self.get_image_files()
-        
-        # Recalculate total pages dynamically
-        total_pages = max((len(all_images) + self.items_per_page - 1) // self.items_per_page, 1)
+    def evict(self):
+        while True:
+            with self.lock:
+                if self.total_bytes <= self.max_bytes or not self.entries:
+                    return
+                name, size = self.entries.popitem(last=False)
+                self.total_bytes -= size
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                pass
+
+def to_signed64(value):
+    # SQLite integers are signed 64 bit
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def to_unsigned64(value):
+    return value & 0xFFFFFFFFFFFFFFFF
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+# Orthonormal DCT-II basis for the 32x32 perceptual hash image
+phash_dct = np.array([[math.cos(math.pi * (2 * n + 1) * k / 64) * math.sqrt((1 if k == 0 else 2) / 32) for n in range(32)] for k in range(32)])
+
+def perceptual_hash(image_path):
+    """64 bit DCT hash: the 8x8 lowest frequencies of a 32x32 greyscale copy, each bit set when above the median."""
+    with Image.open(image_path) as img:
+        img.draft('L', (64, 64))  # JPEGs decode at a fraction of their size
+        pixels = np.asarray(img.convert('L').resize((32, 32), Image.LANCZOS), dtype=np.float64)
+    low = (phash_dct @ pixels @ phash_dct.T)[:8, :8].flatten()
+    bits = low > np.median(low)
+    return int(sum(1 << i for i, bit in enumerate(bits) if bit))
+
+class BKTree:
+    """BK-tree over 64 bit hashes with Hamming distance, each node keeps the filenames sharing its hash."""
+    def __init__(self):
+        self.root = None  # [hash, filenames, {distance: child}]
+
+    def add(self, value, filename):
+        if self.root is None:
+            self.root = [value, {filename}, {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                node[1].add(filename)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, {filename}, {}]
+                return
+            node = child
+
+    def discard(self, value, filename):
+        # Nodes stay in place so the tree remains valid, they just hold no files
+        node = self.root
+        while node is not None:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                node[1].discard(filename)
+                return
+            node = node[2].get(distance)
+
+    def search(self, value, max_distance):
+        """Return [(distance, filename)] within `max_distance` of `value`, closest first."""
+        found = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= max_distance:
+                found.extend((distance, filename) for filename in node[1])
+            # Triangle inequality: only children in this band can be close enough
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        return sorted(found)
+
+class SimilarityIndex:
+    """Perceptual hashes of the gallery, computed in the background.
+
+    A worker thread hashes every image the index has no hash for yet, newest first,
+    and stores the result in the gallery index. A BK-tree over the hashes answers
+    "which images look like this one" without comparing against every image.
+    """
+    DEFAULT_DISTANCE = 6  # Hamming distance up to which two frames count as the same scene
+
+    def __init__(self, index, is_busy=lambda: False):
+        self.index = index
+        self.is_busy = is_busy
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.tree = None      # Built on first use
+        self.hashes = {}      # filename -> hash, for everything in the tree
+        self.failed = set()   # Files that could not be hashed, not retried until they change
+
+    def ensure_tree(self):
+        # Caller must hold self.lock
+        if self.tree is None:
+            self.tree = BKTree()
+            self.hashes = self.index.phashes()
+            for filename, value in self.hashes.items():
+                self.tree.add(value, filename)
+
+    def update(self, hashes):
+        with self.lock:
+            if self.tree is None:
+                return
+            for filename, value in hashes.items():
+                self.remove_locked(filename)
+                self.hashes[filename] = value
+                self.tree.add(value, filename)
+
+    def remove(self, filename):
+        with self.lock:
+            self.failed.discard(filename)
+            if self.tree is not None:
+                self.remove_locked(filename)
+
+    def remove_locked(self, filename):
+        old = self.hashes.pop(filename, None)
+        if old is not None:
+            self.tree.discard(old, filename)
+
+    def similar(self, filename, max_distance=None):
+        """[(distance, filename)] of images that look like `filename`, not including itself."""
+        with self.lock:
+            self.ensure_tree()
+            value = self.hashes.get(filename)
+            if value is None:
+                return None
+            matches = self.tree.search(value, self.DEFAULT_DISTANCE if max_distance is None else max_distance)
+        return [(distance, name) for distance, name in matches if name != filename]
+
+    def notify(self):
+        self.wake.set()
+
+    def hash_pending(self, batch=50):
+        """Hash one batch of images without a hash. Returns how many were hashed."""
+        pending = [name for name in self.index.missing_phashes(batch + len(self.failed)) if name not in self.failed][:batch]
+        hashes = {}
+        for filename in pending:
+            while self.is_busy():
+                time.sleep(0.5)  # Leave the CPU to captures
+            try:
+                hashes[filename] = perceptual_hash(os.path.join(self.index.upload_folder, filename))
+            except (OSError, Image.UnidentifiedImageError, ValueError) as e:
+                log.error("error hashing image", extra=log_fields(file=filename, error=str(e)))
+                self.failed.add(filename)
+        if hashes:
+            self.index.set_phashes(hashes)
+            self.update(hashes)
+        return len(hashes)
+
+    def start(self):
+        def run():
+            while True:
+                try:
+                    if self.hash_pending():
+                        continue
+                except Exception as e:
+                    log.error("error computing perceptual hashes", extra=log_fields(error=str(e)))
+                self.wake.wait(timeout=60)
+                self.wake.clear()
+        threading.Thread(target=run, name="perceptual-hash", daemon=True).start()
+
+def collapse_runs(rows, max_distance, groups=None):
+    """Group consecutive rows of the same camera that look like the first row of their run.
+
+    Returns [(representative, [duplicates])], extending `groups` when rows continue an
+    earlier call. Rows without a hash are never grouped.
+    """
+    groups = [] if groups is None else groups
+    for row in rows:
+        if groups and row["phash"] is not None:
+            first = groups[-1][0]
+            if (first["phash"] is not None and first["camera_num"] == row["camera_num"]
+                    and hamming_distance(to_unsigned64(first["phash"]), to_unsigned64(row["phash"])) <= max_distance):
+                groups[-1][1].append(row)
+                continue
+        groups.append((row, []))
+    return groups
+
+class ImageGallery:
+    def __init__(self, upload_folder, items_per_page=10, index_path=None, offload=None):
+        self.upload_folder = upload_folder
+        self.offload = offload  # StorageOffload that new files are queued on
+        self.items_per_page = items_per_page
+        self.items_per_page = 12
+        self.index = GalleryIndex(upload_folder, index_path or os.path.join(cache_folder, 'gallery_index.sqlite3'))
+        self.index.start_reconciler()
+        self.thumbnails = ThumbnailCache(upload_folder, os.path.join(cache_folder, 'thumbnails'), max_bytes=app.config['thumbnail_cache_bytes'])
+        self.edit_sessions = EditSessions(self)
+        self.dng_developer = DngDeveloper(upload_folder, os.path.join(cache_folder, 'dng'),
+                                          workers=app.config['dng_develop_workers'], full_size_jobs=app.config['dng_full_size_jobs'],
+                                          max_bytes=app.config['dng_cache_bytes'])
+        self.similarity = SimilarityIndex(self.index, is_busy=lambda: any(camera.capturing_still for camera in list(cameras.values())))
+        self.similarity.start()
 
-        # Adjust the current page if necessary
-        if page > total_pages:
-            page = total_pages  # Ensure we're not on a non-existent page
+    def get_image_files(self):
+        # Fetch image file details, including timestamps, resolution, and DNG presence.
+        try:
+            return [GalleryIndex.row_to_image(row) for row in self.index.query()]
+        except Exception as e:
+            log.error("error loading image files", extra=log_fields(error=str(e)))
+            return []
 
-        start_index = (page - 1) * self.items_per_page
-        end_index = start_index + self.items_per_page
-        paginated_images = all_images[start_index:end_index]
+    def query_images(self, filters=None, cursor=None, limit=None, sort="timestamp", descending=True, collapse=None):
+        """Filtered, sorted, cursor-paginated listing. Returns (images, next_cursor).
 
-        return paginated_images, total_pages
-    
+        With `collapse` (a Hamming distance) runs of near-identical consecutive frames
+        are listed once, as their first image with a count of the duplicates. A page
+        reads at most app.config['gallery_collapse_scan_rows'] rows, a run that is
+        longer than that is cut there and carries on as a new entry on the next page.
+        """
+        limit = limit or self.items_per_page
+        if collapse is None:
+            rows, next_cursor = self.index.query_page(filters, cursor, limit, sort, descending)
+            return [GalleryIndex.row_to_image(row) for row in rows], next_cursor
+        if sort != "timestamp":
+            raise ValueError("Duplicates can only be collapsed in time order")
+        # Read until a run past the last one on this page starts, so runs never span pages
+        scan_rows = max(app.config['gallery_collapse_scan_rows'], limit + 1)
+        groups = []
+        page_cursor = cursor
+        scanned = 0
+        while True:
+            page, page_cursor = self.index.query_page(filters, page_cursor, min(200, scan_rows - scanned), sort, descending)
+            scanned += len(page)
+            collapse_runs(page, collapse, groups)
+            if len(groups) > limit or page_cursor is None or scanned >= scan_rows:
+                break
+        images = []
+        for representative, duplicates in groups[:limit]:
+            image = GalleryIndex.row_to_image(representative)
+            image['duplicates'] = len(duplicates)
+            images.append(image)
+        next_cursor = None
+        if len(groups) > limit:
+            last = (groups[limit - 1][1] or [groups[limit - 1][0]])[-1]
+            next_cursor = GalleryIndex.encode_cursor(last["timestamp"], last["filename"])
+        elif page_cursor is not None:
+            # Out of rows to scan, the next page starts after the last row read
+            next_cursor = page_cursor
+        return images, next_cursor
+
+    def iter_export_entries(self, filenames=None, filters=None, include_dng=False):
+        """Yield (arcname, path) for a selection of filenames or for every image matching `filters`."""
+        if filenames is None:
+            def selected():
+                cursor = None
+                while True:
+                    rows, cursor = self.index.query_page(filters, cursor, limit=200)
+                    for row in rows:
+                        yield row["filename"]
+                    if cursor is None:
+                        return
+            filenames = selected()
+        for filename in filenames:
+            if os.path.basename(filename) != filename:
+                continue
+            path = os.path.join(self.upload_folder, filename)
+            if not os.path.isfile(path):
+                continue
+            yield filename, path
+            if include_dng and filename.endswith('.jpg'):
+                dng_file = os.path.splitext(filename)[0] + '.dng'
+                dng_path = os.path.join(self.upload_folder, dng_file)
+                if os.path.isfile(dng_path):
+                    yield dng_file, dng_path
 
     def find_last_image_taken(self):
         """Find the most recent image taken."""
-        all_images = self.get_image_files()
-        
-        if all_images:
-            first_image = all_images[0]
-            print(f"Filename: {first_image['filename']}")
-            image = first_image['filename']
-        else:
-            print("No image files found.")
-            image = None
-        
-        return image  # Extract only the filename
-    
+        rows = self.index.query(limit=1)
+        return rows[0]["filename"] if rows else None
+
+    def add_image(self, filename):
+        """Add a newly written .jpg (or a new .dng next to it) to the gallery index."""
+        self.index.add(filename)
+        self.similarity.remove(filename)  # A rewritten file is hashed again
+        self.similarity.notify()
+        if not os.path.dirname(filename) and filename.endswith('.jpg'):
+            self.thumbnails.generate_in_background(filename)
+        if self.offload and not os.path.dirname(filename):
+            # The image plus the .dng and capture metadata saved with it
+            base = os.path.splitext(filename)[0]
+            self.offload.enqueue([name for name in (filename, f"{base}.dng", f"{base}.json")
+                                  if name == filename or os.path.exists(os.path.join(self.upload_folder, name))])
+
     def delete_image(self, filename):
         image_path = os.path.join(self.upload_folder, filename)
 
@@ -982,71 +2870,788 @@ class ImageGallery:
             try:
                 
                 os.remove(image_path)
-                logging.info(f"Deleted image: {filename}")
+                log.info("image deleted", extra=log_fields(file=filename))
                 # Check if corresponding .dng file exists
                 dng_file = os.path.splitext(filename)[0] + '.dng'
-                print(dng_file)
                 has_dng = os.path.exists(os.path.join(self.upload_folder, dng_file))
-                print(has_dng)
                 if has_dng:
                     os.remove(os.path.join(self.upload_folder, dng_file))
+                try:
+                    os.remove(capture_sidecar_path(image_path))
+                except FileNotFoundError:
+                    pass
+                self.index.remove(filename)
+                self.thumbnails.remove(filename)
+                self.similarity.remove(filename)
                 return True, f"Image '{filename}' deleted successfully."
             except Exception as e:
-                logging.error(f"Error deleting image {filename}: {e}")
+                log.error("error deleting image", extra=log_fields(file=filename, error=str(e)))
                 return False, "Failed to delete image"
         else:
+            self.index.remove(filename)  # Drop stale index entries
             return False, "Image not found"
     
+    def delete_dng(self, filename):
+        """Delete only the .dng that belongs to `filename`, keeping the JPEG."""
+        dng_path = os.path.join(self.upload_folder, os.path.splitext(filename)[0] + '.dng')
+        try:
+            os.remove(dng_path)
+        except FileNotFoundError:
+            pass
+        self.index.set_dng(filename, 0)
+        return True
+
+    def resolve_save_path(self, filename, save_option, new_filename=None):
+        """Return where an edit should be written, or None if the save option is invalid."""
+        if save_option == "replace":
+            return os.path.join(self.upload_folder, filename)
+        if save_option == "new_file" and new_filename and os.path.basename(new_filename) == new_filename:
+            return os.path.join(self.upload_folder, new_filename)
+        return None
+
     def save_edit(self, filename, edits, save_option, new_filename=None):
         """Apply edits to an image and save it based on user selection."""
         image_path = os.path.join(self.upload_folder, filename)
-        print(f"Applying edits to {filename}: {edits}")
+        log.debug("applying edits", extra=log_fields(image=filename, edits=edits))
 
         if not os.path.exists(image_path):
             return False, "Original image not found."
 
+        # Determine save path
+        save_path = self.resolve_save_path(filename, save_option, new_filename)
+        if save_path is None:
+            return False, "Invalid save option."
+
         try:
             with Image.open(image_path) as img:
-                img = img.convert("RGB")  # Ensure no transparency issues
-
-                # Reset EXIF rotation before applying new rotation
-                img = ImageOps.exif_transpose(img)
-
-                # Convert brightness and contrast from 0-200 range to 0.1-2.0
-                if "brightness" in edits:
-                    brightness_factor = max(0.1, float(edits["brightness"]) / 100)
-                    enhancer = ImageEnhance.Brightness(img)
-                    img = enhancer.enhance(brightness_factor)
-
-                if "contrast" in edits:
-                    contrast_factor = max(0.1, float(edits["contrast"]) / 100)
-                    enhancer = ImageEnhance.Contrast(img)
-                    img = enhancer.enhance(contrast_factor)
-
-                # Apply absolute rotation (mod 360 to prevent stacking errors)
-                if "rotation" in edits:
-                    rotation_angle = int(edits["rotation"]) % 360
-                    # Automatically convert the rotation to negative
-                    rotation_angle = -rotation_angle
-                    img = img.rotate(rotation_angle, expand=True)
-                    print(f"Applied rotation: {rotation_angle}°")
-
-                # Determine save path
-                if save_option == "replace":
-                    save_path = image_path
-                elif save_option == "new_file" and new_filename:
-                    save_path = os.path.join(self.upload_folder, new_filename)
-                else:
-                    return False, "Invalid save option."
+                if img.mode != "RGB":
+                    img = img.convert("RGB")  # Ensure no transparency issues
+
+                # Reset EXIF rotation before applying new rotation, exif_transpose copies even when there is nothing to do
+                if img.getexif().get(0x0112, 1) != 1:
+                    img = ImageOps.exif_transpose(img)
+                img = apply_edits(img, edits)
 
                 img.save(save_path)
+                capture = read_capture_sidecar(image_path)
+                if capture and save_path != image_path:
+                    # An edited copy is still the same capture
+                    write_json_atomic(capture_sidecar_path(save_path), capture)
+                self.add_image(os.path.basename(save_path))
                 return True, "Image saved successfully."
 
         except Exception as e:
-            logging.error(f"Error applying edits to image {filename}: {e}")
+            log.error("error applying edits", extra=log_fields(file=filename, error=str(e)))
             return False, "Failed to edit image."
 
 
+####################
+# DNG development
+####################
+
+class DngDeveloper:
+    """Develops gallery DNGs with dng_develop.py, one process per job.
+
+    Results are cached in `cache_dir`, keyed by a hash of the DNG contents, so each
+    file is developed once per output type. Jobs run as separate processes rather
+    than a multiprocessing pool, since a spawned worker would re-import app.py and
+    try to open the cameras. Previews run one per core. A full-size demosaic needs
+    several full-frame float planes, so full-size jobs have their own pool of as
+    many workers as the available memory allows. The least recently used results
+    are evicted once the cache grows past `max_bytes`.
+    """
+    PREVIEW_SIZE = 1280
+    FULL_SIZE_JOB_BYTES = 600 * 1024 * 1024  # Peak memory of a full-size demosaic of a 12 MP DNG, roughly
+    FORMATS = {"jpeg": ("JPEG", ".jpg", "image/jpeg"), "tiff": ("TIFF", ".tif", "image/tiff")}
+    SCRIPT = os.path.join(current_dir, 'dng_develop.py')
+
+    def __init__(self, upload_folder, cache_dir, workers=None, full_size_jobs=None, max_bytes=500 * 1024 * 1024):
+        self.upload_folder = upload_folder
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        workers = workers or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dng-develop")
+        self.full_size_jobs = full_size_jobs or self.full_size_job_limit(workers)
+        self.full_size_pool = ThreadPoolExecutor(max_workers=self.full_size_jobs, thread_name_prefix="dng-develop-full")
+        self.hashes = {}   # dng path -> ((mtime, size), sha1)
+        self.pending = {}  # output path -> Future, so concurrent requests share one job
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Least recently used first: output name -> size in bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        existing = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(tuple(extension for _, extension, _ in self.FORMATS.values())) and entry.is_file():
+                    stat = entry.stat()
+                    existing.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(existing):
+            self.entries[name] = size
+            self.total_bytes += size
+        self.evict()
+
+    @classmethod
+    def full_size_job_limit(cls, workers):
+        # As many full-size jobs as fit in the memory available now, at least one and at most one per worker
+        try:
+            with open('/proc/meminfo', 'r') as f:
+                available = next(int(line.split()[1]) * 1024 for line in f if line.startswith('MemAvailable:'))
+        except (OSError, StopIteration, ValueError, IndexError):
+            return 1
+        return max(1, min(workers, available // cls.FULL_SIZE_JOB_BYTES))
+
+    def file_hash(self, path):
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self.hashes.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        self.hashes[path] = (key, digest.hexdigest())
+        return self.hashes[path][1]
+
+    def run_job(self, dng_path, output_path, full_size, pil_format):
+        command = [sys.executable, self.SCRIPT, dng_path, output_path, '--format', pil_format]
+        command += ['--full'] if full_size else ['--max-size', str(self.PREVIEW_SIZE)]
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "DNG development failed")
+        name = os.path.basename(output_path)
+        size = os.path.getsize(output_path)
+        with self.lock:
+            self.total_bytes += size - self.entries.pop(name, 0)
+            self.entries[name] = size
+        self.evict()
+        return output_path
+
+    def evict(self):
+        # The newest result is never evicted, it is about to be served
+        while True:
+            with self.lock:
+                if self.total_bytes <= self.max_bytes or len(self.entries) <= 1:
+                    return
+                name, size = self.entries.popitem(last=False)
+                self.total_bytes -= size
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def develop(self, dng_file, full_size=False, image_format="jpeg"):
+        """Return a Future that resolves to the path of the developed image."""
+        if image_format not in self.FORMATS:
+            raise ValueError(f"Unsupported format: {image_format}")
+        dng_path = os.path.join(self.upload_folder, dng_file)
+        pil_format, extension, _ = self.FORMATS[image_format]
+        variant = "full" if full_size else "preview"
+        output_path = os.path.join(self.cache_dir, f"{self.file_hash(dng_path)}_{variant}{extension}")
+        with self.lock:
+            future = self.pending.get(output_path)
+            if future is not None:
+                return future
+            if os.path.exists(output_path):
+                if os.path.basename(output_path) in self.entries:
+                    self.entries.move_to_end(os.path.basename(output_path))
+                future = Future()
+                future.set_result(output_path)
+                return future
+            pool = self.full_size_pool if full_size else self.pool
+            future = pool.submit(self.run_job, dng_path, output_path, full_size, pil_format)
+            self.pending[output_path] = future
+        future.add_done_callback(lambda _: self.pending.pop(output_path, None))
+        return future
+
+####################
+# Storage retention
+####################
+
+class RetentionEngine:
+    """Deletes old captures according to the retention policy.
+
+    Works from the gallery index, so no pass rescans the folder. Each pass deletes
+    at most `max_deletes_per_pass` files, pausing between deletes and while a camera
+    is capturing, so retention never competes with captures or streaming.
+    """
+    DEFAULT_POLICY = {
+        "enabled": False,
+        "max_bytes": None,        # Total gallery size to stay under
+        "max_age_days": None,     # Delete captures older than this
+        "keep_per_camera": None,  # Only keep the newest N captures of each camera
+        "dedupe_distance": None,  # Delete frames within this Hamming distance of the first frame of their run
+        "dng_first": True,        # Free space by dropping DNGs before any JPEG
+        "interval": 600,          # Seconds between passes
+        "max_deletes_per_pass": 200,
+        "delete_pause": 0.05,     # Seconds to sleep after each delete
+    }
+    # setting -> (type, minimum, maximum, may be None), bounds are inclusive
+    POLICY_SCHEMA = {
+        "enabled": (bool, None, None, False),
+        "max_bytes": (int, 0, None, True),
+        "max_age_days": (float, 0, None, True),
+        "keep_per_camera": (int, 0, None, True),
+        "dedupe_distance": (int, 0, 64, True),
+        "dng_first": (bool, None, None, False),
+        "interval": (float, 10, 7 * 86400, False),
+        "max_deletes_per_pass": (int, 1, None, False),
+        "delete_pause": (float, 0, 60, False),
+    }
+
+    def __init__(self, gallery, is_busy=lambda: False, policy=None, policy_path=None):
+        self.gallery = gallery
+        self.is_busy = is_busy
+        self.policy_path = policy_path  # Where the policy is saved, so it survives a restart
+        self.policy = dict(self.DEFAULT_POLICY, **(policy or {}))
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.last_report = None
+        if policy_path:
+            try:
+                with open(policy_path, 'r') as f:
+                    self.policy.update(self.validate_policy(json.load(f)))
+            except FileNotFoundError:
+                pass
+            except (ValueError, OSError) as e:
+                log.error("error loading retention policy", extra=log_fields(path=policy_path, error=str(e)))
+
+    @classmethod
+    def validate_policy(cls, changes):
+        """Return `changes` with numbers normalised, raises ValueError for unknown settings or bad values."""
+        if not isinstance(changes, dict):
+            raise ValueError("The retention policy must be a JSON object")
+        unknown = set(changes) - set(cls.DEFAULT_POLICY)
+        if unknown:
+            raise ValueError(f"Unknown retention settings: {', '.join(sorted(unknown))}")
+        validated = {}
+        for key, value in changes.items():
+            kind, minimum, maximum, nullable = cls.POLICY_SCHEMA[key]
+            if value is None and nullable:
+                validated[key] = None
+                continue
+            if kind is bool:
+                if not isinstance(value, bool):
+                    raise ValueError(f"{key} must be true or false")
+            else:
+                # bool is an int too, but "max_bytes": true is a mistake
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                    raise ValueError(f"{key} must be a number" + (" or null" if nullable else ""))
+                if kind is int:
+                    if value != int(value):
+                        raise ValueError(f"{key} must be a whole number")
+                    value = int(value)
+                if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+                    bounds = f"at least {minimum}" if maximum is None else f"between {minimum} and {maximum}"
+                    raise ValueError(f"{key} must be {bounds}")
+            validated[key] = value
+        return validated
+
+    def update_policy(self, changes):
+        changes = self.validate_policy(changes)
+        with self.lock:
+            self.policy.update(changes)
+            if self.policy_path:
+                write_json_atomic(self.policy_path, self.policy)
+        self.wake.set()  # Apply the new policy straight away
+        return self.get_policy()
+
+    def get_policy(self):
+        with self.lock:
+            return dict(self.policy)
+
+    def plan(self, policy=None):
+        """Work out what the policy would delete. Returns a report, nothing is deleted."""
+        policy = policy or self.get_policy()
+        rows = self.gallery.index.retention_rows()
+        total_before = sum(row["size"] + row["dng_size"] for row in rows)
+        actions = []
+        deleted = set()
+
+        def delete_image(row, reason):
+            deleted.add(row["filename"])
+            actions.append({"action": "delete_image", "filename": row["filename"], "bytes": row["size"] + row["dng_size"], "reason": reason})
+
+        if policy.get("max_age_days") is not None:
+            cutoff = time.time() - float(policy["max_age_days"]) * 86400
+            for row in rows:
+                if row["timestamp"] < cutoff:
+                    delete_image(row, "max_age_days")
+        if policy.get("dedupe_distance") is not None:
+            # Per camera, keep the first frame of each run of near-identical frames
+            for camera_num in {row["camera_num"] for row in rows}:
+                remaining = [row for row in rows if row["camera_num"] == camera_num and row["filename"] not in deleted]
+                for _, duplicates in collapse_runs(remaining, int(policy["dedupe_distance"])):
+                    for row in duplicates:
+                        delete_image(row, "duplicate")
+        if policy.get("keep_per_camera") is not None:
+            per_camera = {}
+            for row in reversed(rows):  # Newest first
+                if row["filename"] in deleted:
+                    continue
+                kept = per_camera.get(row["camera_num"], 0)
+                if kept >= int(policy["keep_per_camera"]):
+                    delete_image(row, "keep_per_camera")
+                else:
+                    per_camera[row["camera_num"]] = kept + 1
+        if policy.get("max_bytes") is not None:
+            remaining = total_before - sum(action["bytes"] for action in actions)
+            if policy.get("dng_first", True):
+                for row in rows:
+                    if remaining <= policy["max_bytes"]:
+                        break
+                    if row["dng_size"] and row["filename"] not in deleted:
+                        actions.append({"action": "delete_dng", "filename": row["filename"], "bytes": row["dng_size"], "reason": "max_bytes"})
+                        remaining -= row["dng_size"]
+                        deleted.add(row["filename"] + ".dng")
+            for row in rows:
+                if remaining <= policy["max_bytes"]:
+                    break
+                if row["filename"] in deleted:
+                    continue
+                dng_already_planned = row["filename"] + ".dng" in deleted
+                freed = row["size"] + (0 if dng_already_planned else row["dng_size"])
+                deleted.add(row["filename"])
+                actions.append({"action": "delete_image", "filename": row["filename"], "bytes": freed, "reason": "max_bytes"})
+                remaining -= freed
+        bytes_freed = sum(action["bytes"] for action in actions)
+        return {
+            "generated_at": time.time(),
+            "policy": policy,
+            "images": len(rows),
+            "total_bytes_before": total_before,
+            "total_bytes_after": total_before - bytes_freed,
+            "bytes_freed": bytes_freed,
+            "actions": actions,
+        }
+
+    def run_once(self, dry_run=False):
+        policy = self.get_policy()
+        report = self.plan(policy)
+        if dry_run:
+            return report
+        executed = 0
+        for action in report["actions"][:int(policy["max_deletes_per_pass"])]:
+            while self.is_busy():
+                time.sleep(0.5)  # Never delete while a capture is in progress
+            if action["action"] == "delete_dng":
+                self.gallery.delete_dng(action["filename"])
+            else:
+                self.gallery.delete_image(action["filename"])
+            executed += 1
+            time.sleep(float(policy["delete_pause"]))
+        report["executed"] = executed
+        report["pending"] = len(report["actions"]) - executed
+        if executed:
+            log.info("retention pass", extra=log_fields(deleted=executed, freed_bytes=sum(a['bytes'] for a in report['actions'][:executed]), pending=report['pending']))
+        self.last_report = report
+        return report
+
+    def start(self):
+        def run():
+            while True:
+                policy = self.get_policy()
+                if policy["enabled"]:
+                    try:
+                        report = self.run_once()
+                    except Exception as e:
+                        log.error("error applying retention policy", extra=log_fields(error=str(e)))
+                        report = None
+                    # Keep going without waiting for the interval while deletions are pending
+                    if report and report["pending"] and report["executed"]:
+                        continue
+                self.wake.wait(timeout=float(policy["interval"]))
+                self.wake.clear()
+        threading.Thread(target=run, name="retention", daemon=True).start()
+
+####################
+# Storage offload
+####################
+
+class BandwidthLimiter:
+    """Token bucket shared by every upload of one sink, `rate` is bytes per second."""
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.lock = threading.Lock()
+        self.allowance = self.rate
+        self.last = time.monotonic()
+
+    def consume(self, size):
+        with self.lock:
+            now = time.monotonic()
+            self.allowance = min(self.rate, self.allowance + (now - self.last) * self.rate)
+            self.last = now
+            self.allowance -= size
+            wait = -self.allowance / self.rate if self.allowance < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+class StorageSink:
+    """A place captures are copied to after they are saved to the gallery folder.
+
+    `layout` is a str.format() template for where a file goes within the sink, it
+    gets filename, camera (number) and the year, month, day and hour it was taken.
+    store() raises an exception when a copy fails, the job is then retried later.
+    """
+    kind = None
+    DEFAULT_LAYOUT = "{filename}"
+    CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, name, options):
+        self.name = name
+        self.options = options
+        self.layout = options.get("layout") or self.DEFAULT_LAYOUT
+        self.concurrency = max(int(options.get("concurrency") or 1), 1)
+        rate = options.get("max_bytes_per_second")
+        self.limiter = BandwidthLimiter(rate) if rate else None
+
+    def key_for(self, filename):
+        parsed = GalleryIndex.parse_filename(filename)
+        camera_num, unix_timestamp = parsed if parsed else (None, int(time.time()))
+        taken = datetime.fromtimestamp(unix_timestamp, timezone.utc)
+        return self.layout.format(filename=filename, camera=camera_num if camera_num is not None else "unknown",
+                                  year=f"{taken.year:04d}", month=f"{taken.month:02d}", day=f"{taken.day:02d}", hour=f"{taken.hour:02d}")
+
+    def read_chunks(self, path):
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b''):
+                if self.limiter:
+                    self.limiter.consume(len(chunk))
+                yield chunk
+
+    def store(self, path, filename):
+        raise NotImplementedError
+
+class LocalSink(StorageSink):
+    """Copies captures into another folder, e.g. a USB drive or a network mount."""
+    kind = "local"
+
+    def __init__(self, name, options):
+        super().__init__(name, options)
+        if not options.get("root"):
+            raise ValueError(f"Storage sink '{name}' needs a root folder")
+        self.root = options["root"]
+
+    def store(self, path, filename):
+        target = os.path.join(self.root, self.key_for(filename))
+        if os.path.commonpath([os.path.abspath(target), os.path.abspath(self.root)]) != os.path.abspath(self.root):
+            raise ValueError(f"Layout puts {filename} outside of {self.root}")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix=".tmp_")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in self.read_chunks(path):
+                    f.write(chunk)
+            os.replace(tmp_path, target)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+class DateCameraSink(LocalSink):
+    """A local sink that sorts captures into year/month/day/camera folders."""
+    kind = "date_camera"
+    DEFAULT_LAYOUT = "{year}/{month}/{day}/camera_{camera}/{filename}"
+
+class HttpSink(StorageSink):
+    """Uploads each file with an HTTP PUT (or POST) to `url` + the file's key."""
+    kind = "http"
+    TIMEOUT = 60
+
+    def __init__(self, name, options):
+        super().__init__(name, options)
+        self.url = options.get("url")
+        if not self.url:
+            raise ValueError(f"Storage sink '{name}' needs a url")
+        self.method = options.get("method", "PUT").upper()
+        self.headers = dict(options.get("headers") or {})
+
+    def request_target(self, filename):
+        """Return (url, extra headers) for an upload."""
+        return f"{self.url.rstrip('/')}/{urllib.parse.quote(self.key_for(filename))}", {}
+
+    def store(self, path, filename):
+        url, headers = self.request_target(filename)
+        parts = urllib.parse.urlsplit(url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        connection = connection_class(parts.netloc, timeout=self.TIMEOUT)
+        try:
+            connection.putrequest(self.method, parts.path + (f"?{parts.query}" if parts.query else ""))
+            headers = {**self.headers, **headers,
+                       "Content-Length": str(os.path.getsize(path)),
+                       "Content-Type": mimetypes.guess_type(filename)[0] or "application/octet-stream"}
+            for header, value in headers.items():
+                connection.putheader(header, value)
+            connection.endheaders()
+            # Sent chunk by chunk so the bandwidth cap applies
+            for chunk in self.read_chunks(path):
+                connection.send(chunk)
+            response = connection.getresponse()
+            body = response.read(200)
+            if not 200 <= response.status < 300:
+                raise OSError(f"HTTP {response.status} from {parts.netloc}: {body.decode(errors='replace')}")
+        finally:
+            connection.close()
+
+class S3Sink(HttpSink):
+    """Uploads to an S3-compatible bucket (AWS, MinIO, ...) with path-style URLs and SigV4."""
+    kind = "s3"
+
+    def __init__(self, name, options):
+        for key in ("endpoint", "bucket", "access_key", "secret_key"):
+            if not options.get(key):
+                raise ValueError(f"Storage sink '{name}' needs {key}")
+        super().__init__(name, dict(options, url=options["endpoint"], method="PUT"))
+        self.bucket = options["bucket"]
+        self.region = options.get("region", "us-east-1")
+
+    def request_target(self, filename, now=None):
+        parts = urllib.parse.urlsplit(self.url)
+        path = f"{parts.path.rstrip('/')}/{self.bucket}/{urllib.parse.quote(self.key_for(filename), safe='/-_.~')}"
+        now = now or datetime.now(timezone.utc)
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        scope = f"{now.strftime('%Y%m%d')}/{self.region}/s3/aws4_request"
+        # The body is streamed and throttled, so it isn't part of the signature
+        headers = {"host": parts.netloc, "x-amz-content-sha256": "UNSIGNED-PAYLOAD", "x-amz-date": amz_date}
+        signed_headers = ";".join(sorted(headers))
+        canonical_request = "\n".join(["PUT", path, "", *(f"{key}:{headers[key]}" for key in sorted(headers)), "", signed_headers, "UNSIGNED-PAYLOAD"])
+        string_to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest()])
+        key = f"AWS4{self.options['secret_key']}".encode()
+        for part in (now.strftime('%Y%m%d'), self.region, "s3", "aws4_request"):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+        headers["Authorization"] = f"AWS4-HMAC-SHA256 Credential={self.options['access_key']}/{scope}, SignedHeaders={signed_headers}, Signature={signature}"
+        del headers["host"]  # http.client sends it
+        return f"{parts.scheme}://{parts.netloc}{path}", headers
+
+storage_sink_types = {sink.kind: sink for sink in (LocalSink, DateCameraSink, HttpSink, S3Sink)}
+
+class StorageOffload:
+    """Copies new gallery files to the configured storage sinks in the background.
+
+    Captures are always saved to the gallery folder first, so capture latency never
+    depends on a sink. Each (sink, file) pair is a job in a SQLite queue that
+    survives restarts. Failed jobs are retried with exponential backoff, and each
+    sink has its own concurrency limit and optional bandwidth cap.
+    """
+    MAX_BACKOFF = 3600
+    MASK = "********"
+
+    def __init__(self, upload_folder, config_path, db_path, workers=4):
+        self.upload_folder = upload_folder
+        self.config_path = config_path
+        self.workers = workers
+        self.condition = threading.Condition()
+        self.sinks = {}
+        self.in_flight = {}  # sink name -> running jobs
+        self.config = {"sinks": []}
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                sink TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL,
+                last_error TEXT,
+                running INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (sink, filename)
+            )""")
+        self.db.commit()
+        try:
+            with open(config_path, 'r') as f:
+                self.configure(json.load(f), save=False)
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError) as e:
+            log.error("error loading storage sinks", extra=log_fields(path=config_path, error=str(e)))
+
+    def configure(self, config, save=True):
+        """Replace the sink configuration, {"sinks": [{"name", "type", ...options}]}. Raises ValueError."""
+        sinks = {}
+        previous = {options["name"]: options for options in self.config["sinks"]}
+        for options in config.get("sinks", []):
+            name = options.get("name")
+            if name in previous:
+                # Settings read back from get_config() keep the stored secrets
+                if options.get("secret_key") == self.MASK:
+                    options["secret_key"] = previous[name].get("secret_key")
+                if isinstance(options.get("headers"), dict):
+                    stored = previous[name].get("headers") or {}
+                    options["headers"] = {header: (stored.get(header) if value == self.MASK else value)
+                                          for header, value in options["headers"].items()}
+            sink_type = storage_sink_types.get(options.get("type"))
+            if not name or sink_type is None:
+                raise ValueError(f"Storage sinks need a name and a type out of {', '.join(storage_sink_types)}")
+            if name in sinks:
+                raise ValueError(f"Duplicate storage sink name: {name}")
+            if options.get("enabled", True):
+                sinks[name] = sink_type(name, options)
+        with self.condition:
+            self.sinks = sinks
+            self.config = {"sinks": list(config.get("sinks", []))}
+            # Jobs of a disabled sink wait for it to come back, jobs of a removed one are dropped
+            names = [options["name"] for options in self.config["sinks"]]
+            self.db.execute(f"DELETE FROM jobs WHERE sink NOT IN ({', '.join('?' * len(names))})", names)
+            self.db.commit()
+            self.condition.notify_all()
+        if save:
+            write_json_atomic(self.config_path, self.config)
+
+    def get_config(self):
+        # Secrets stay on the Pi, header values often carry tokens (Authorization, X-Api-Key, ...) so they are masked too
+        with self.condition:
+            return {"sinks": [{key: self.masked(key, value) for key, value in sink.items()} for sink in self.config["sinks"]]}
+
+    @classmethod
+    def masked(cls, key, value):
+        if key == "secret_key":
+            return cls.MASK
+        if key == "headers" and isinstance(value, dict):
+            return {header: cls.MASK for header in value}
+        return value
+
+    def enqueue(self, filenames):
+        """Queue gallery files for every enabled sink."""
+        with self.condition:
+            if not self.sinks:
+                return
+            now = time.time()
+            # A file that is rewritten before its upload ran just keeps its place in the queue
+            self.db.executemany("INSERT OR IGNORE INTO jobs (sink, filename, next_attempt) VALUES (?, ?, ?)",
+                                [(sink, filename, now) for sink in self.sinks for filename in filenames])
+            self.db.commit()
+            self.condition.notify_all()
+
+    def claim(self):
+        # Caller must hold self.condition. Returns (job, sink, wait), job is None if nothing is due.
+        available = [name for name, sink in self.sinks.items() if self.in_flight.get(name, 0) < sink.concurrency]
+        if not available:
+            return None, None, None
+        job = self.db.execute(f"SELECT * FROM jobs WHERE running = 0 AND sink IN ({', '.join('?' * len(available))}) ORDER BY next_attempt LIMIT 1", available).fetchone()
+        if job is None:
+            return None, None, None
+        if job["next_attempt"] > time.time():
+            return None, None, job["next_attempt"] - time.time()
+        self.db.execute("UPDATE jobs SET running = 1 WHERE id = ?", (job["id"],))
+        self.db.commit()
+        sink = self.sinks[job["sink"]]
+        self.in_flight[sink.name] = self.in_flight.get(sink.name, 0) + 1
+        return job, sink, None
+
+    def run_job(self, job, sink):
+        path = os.path.join(self.upload_folder, job["filename"])
+        start = time.perf_counter()
+        try:
+            if not os.path.isfile(path):
+                log.info("dropping upload, the file is gone", extra=log_fields(sink=sink.name, file=job["filename"]))
+            else:
+                sink.store(path, job["filename"])
+                log.info("file stored", extra=log_fields(sink=sink.name, file=job["filename"], seconds=round(time.perf_counter() - start, 2)))
+            error = None
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+            log.error("error storing file", extra=log_fields(sink=sink.name, file=job["filename"], attempt=job["attempts"] + 1, error=error))
+        with self.condition:
+            self.in_flight[sink.name] -= 1
+            if error is None:
+                self.db.execute("DELETE FROM jobs WHERE id = ?", (job["id"],))
+            else:
+                backoff = min(self.MAX_BACKOFF, 5 * 2 ** job["attempts"])
+                self.db.execute("UPDATE jobs SET running = 0, attempts = attempts + 1, next_attempt = ?, last_error = ? WHERE id = ?",
+                                (time.time() + backoff, error, job["id"]))
+            self.db.commit()
+            self.condition.notify_all()
+
+    def start(self):
+        # Jobs that were running when the app last stopped start over
+        with self.condition:
+            self.db.execute("UPDATE jobs SET running = 0")
+            self.db.commit()
+
+        def run():
+            while True:
+                with self.condition:
+                    job, sink, wait = self.claim()
+                    if job is None:
+                        self.condition.wait(timeout=min(wait, 60) if wait is not None else 60)
+                        continue
+                self.run_job(job, sink)
+        for number in range(self.workers):
+            threading.Thread(target=run, name=f"storage-offload-{number}", daemon=True).start()
+
+    def retry_now(self):
+        """Make every queued job due straight away."""
+        with self.condition:
+            self.db.execute("UPDATE jobs SET next_attempt = ? WHERE running = 0", (time.time(),))
+            self.db.commit()
+            self.condition.notify_all()
+
+    def status(self):
+        with self.condition:
+            queued = {row["sink"]: {"queued": row["queued"], "failing": row["failing"]}
+                      for row in self.db.execute("SELECT sink, COUNT(*) AS queued, SUM(attempts > 0) AS failing FROM jobs GROUP BY sink")}
+            errors = [dict(row) for row in self.db.execute("SELECT sink, filename, attempts, next_attempt, last_error FROM jobs WHERE attempts > 0 ORDER BY next_attempt LIMIT 20")]
+            return {
+                "sinks": {name: dict(queued.get(name, {"queued": 0, "failing": 0}), running=self.in_flight.get(name, 0)) for name in self.sinks},
+                "failing_jobs": errors,
+            }
+
+####################
+# Streaming ZIP export
+####################
+
+class ZipStreamSink(io.RawIOBase):
+    """Write-only file object that collects what zipfile writes until it is drained."""
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def stream_zip(entries, chunk_size=1024 * 1024):
+    """Yield a ZIP archive of (arcname, path) entries as it is built.
+
+    Memory use is bounded by `chunk_size` and nothing is written to disk. JPEGs are
+    already compressed so they are STOREd, everything else (e.g. DNGs) is deflated.
+    """
+    sink = ZipStreamSink()
+    with zipfile.ZipFile(sink, mode='w', allowZip64=True) as archive:
+        for arcname, path in entries:
+            try:
+                zinfo = zipfile.ZipInfo.from_file(path, arcname)
+            except FileNotFoundError:
+                continue  # Deleted since it was selected
+            zinfo.compress_type = zipfile.ZIP_STORED if arcname.lower().endswith(('.jpg', '.jpeg')) else zipfile.ZIP_DEFLATED
+            with open(path, 'rb') as source, archive.open(zinfo, mode='w', force_zip64=True) as target:
+                while True:
+                    chunk = source.read(chunk_size)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
+
 ####################
 # Cycle through Cameras to create connected camera config
 ####################
@@ -1062,10 +3667,10 @@ for connected_camera in global_cameras:
         None
     )
     if matching_module and matching_module.get("is_pi_cam", False) is True:
-        print(f"Connected camera model '{connected_camera['Model']}' is found in the camera-module-info.json and is a Pi Camera.\n")
+        log.info("connected camera is a known Pi camera", extra=log_fields(model=connected_camera['Model']))
         is_pi_cam = True
     else:
-        print(f"Connected camera model '{connected_camera['Model']}' is either NOT in the camera-module-info.json or is NOT a Pi Camera.\n")
+        log.info("connected camera is not in camera-module-info.json or not a Pi camera", extra=log_fields(model=connected_camera['Model']))
         is_pi_cam = False
     # Build usable Connected Camera Information variable
     camera_info = {'Num':connected_camera['Num'], 'Model':connected_camera['Model'], 'Is_Pi_Cam': is_pi_cam, 'Has_Config': False, 'Config_Location': f"default_{connected_camera['Model']}.json"}
@@ -1083,25 +3688,23 @@ for new_cam in currently_connected_cameras["cameras"]:
         old_cam = existing_cameras_lookup[cam_num]  
         # If the camera model has changed, update it
         if old_cam["Model"] != new_cam["Model"]:
-            print(f"Updating camera {new_cam['Model']}: Model or Pi Cam status changed.")
+            log.info("camera model changed, updating config", extra=log_fields(camera=cam_num, model=new_cam['Model']))
             updated_cameras.append(new_cam)
         else:
             # Keep existing config if nothing changed
             updated_cameras.append(old_cam)
     else:
         # If it's a new camera, add it to the list
-        print(f"New camera added to config: {new_cam}")
+        log.info("new camera added to config", extra=log_fields(camera=new_cam['Num'], model=new_cam['Model']))
         updated_cameras.append(new_cam)
 
 # Save the updated configuration
-new_config = {"cameras": updated_cameras}
-with open(os.path.join(current_dir, 'camera-last-config.json'), "w") as file:
-    json.dump(new_config, file, indent=4)
+config_store.set_cameras(updated_cameras)
 
 # Make sure currently_connected_cameras is the definitively list of connected cameras
 currently_connected_cameras = updated_cameras
 
-print(f"\n\n{currently_connected_cameras}\n\n ")
+log.debug("connected cameras", extra=log_fields(cameras=currently_connected_cameras))
 
 
 
@@ -1109,21 +3712,153 @@ print(f"\n\n{currently_connected_cameras}\n\n ")
 # Cycle through connected cameras and generate camera object
 ####################
 
+# Cameras are initialized concurrently in worker threads so the web server can start
+# straight away. A camera only appears in `cameras` once it is ready; until then its
+# progress ("initializing", "ready" or "failed") is tracked in `camera_states`.
 cameras = {}
+camera_states = {}
+
+def initialize_camera(connected_camera):
+    camera_num = connected_camera['Num']
+    start = time.perf_counter()
+    try:
+        camera_obj = CameraObject(connected_camera)
+    except Exception as e:
+        camera_states[camera_num] = {"state": "failed", "error": str(e), "seconds": round(time.perf_counter() - start, 3)}
+        log.error("camera failed to initialize", extra=log_fields(camera=camera_num, model=connected_camera['Model'], error=str(e)))
+        return
+    cameras[camera_num] = camera_obj
+    camera_states[camera_num] = {"state": "ready", "seconds": round(time.perf_counter() - start, 3), "timings": camera_obj.init_timings}
+    log.info("camera ready", extra=log_fields(camera=camera_num, model=connected_camera['Model'], seconds=camera_states[camera_num]['seconds'], timings=camera_obj.init_timings))
 
 for connected_camera in currently_connected_cameras:
-    camera_obj = CameraObject(connected_camera)
-    cameras[connected_camera['Num']] = camera_obj
-    print(f"\n\n{cameras}\n\n ")
+    camera_states[connected_camera['Num']] = {"state": "initializing"}
+    threading.Thread(target=initialize_camera, args=(connected_camera,), name=f"camera-init-{connected_camera['Num']}", daemon=True).start()
+
+def camera_unavailable_message(camera_num):
+    state = camera_states.get(camera_num)
+    if state is None:
+        return "Error: Camera not found"
+    if state["state"] == "initializing":
+        return f"Camera {camera_num} is still initializing, please refresh in a moment."
+    return f"Camera {camera_num} failed to initialize: {state.get('error')}"
 
-for key, camera in cameras.items():
-    print(f"Key: {key}, Camera: {camera.camera_info}")
+def camera_unavailable_page(camera_num):
+    # 503 with Retry-After while the camera is still coming up, 404 when there is no such camera
+    page = render_template('error.html', error=camera_unavailable_message(camera_num))
+    if camera_states.get(camera_num, {}).get("state") == "initializing":
+        return page, 503, {"Retry-After": "2"}
+    return page, 404
 
 
+####################
+# Static asset pipeline
+####################
+
+class AssetPipeline:
+    """Fingerprinted, precompressed copies of the static CSS/JS/image assets.
+
+    build() hashes every asset so templates can link to /assets/<name>.<hash>.<ext>,
+    which is cached as immutable. gzip and (if the brotli module is installed) brotli
+    variants are generated once in the background and kept in `cache_dir`, so
+    requests never pay for compression.
+    """
+    COMPRESSIBLE = ('.css', '.js', '.svg', '.json')
+
+    def __init__(self, static_folder, cache_dir, folders=('css', 'js', 'img')):
+        self.static_folder = static_folder
+        self.cache_dir = cache_dir
+        self.folders = folders
+        self.by_source = {}       # "css/bootstrap.min.css" -> record
+        self.by_fingerprint = {}  # "css/bootstrap.min.<hash>.css" -> record
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def build(self):
+        start = time.perf_counter()
+        for folder in self.folders:
+            for root, _, files in os.walk(os.path.join(self.static_folder, folder)):
+                for name in files:
+                    if name.endswith('.map'):
+                        continue
+                    path = os.path.join(root, name)
+                    source = os.path.relpath(path, self.static_folder).replace(os.sep, '/')
+                    with open(path, 'rb') as f:
+                        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+                    stem, ext = os.path.splitext(source)
+                    record = {
+                        "source": source,
+                        "path": path,
+                        "hash": digest,
+                        "ext": ext,
+                        "fingerprint": f"{stem}.{digest}{ext}",
+                        "mimetype": mimetypes.guess_type(name)[0] or 'application/octet-stream',
+                        "variants": {},
+                    }
+                    self.by_source[source] = record
+                    self.by_fingerprint[record["fingerprint"]] = record
+        log.info("static assets fingerprinted", extra=log_fields(assets=len(self.by_source), seconds=round(time.perf_counter() - start, 2)))
+        threading.Thread(target=self.compress_all, name="asset-compress", daemon=True).start()
+
+    def compress_all(self):
+        encoders = [("gzip", ".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            encoders.insert(0, ("br", ".br", lambda data: brotli.compress(data, quality=11)))
+        for record in list(self.by_source.values()):
+            if record["ext"] not in self.COMPRESSIBLE:
+                continue
+            data = None
+            for encoding, suffix, compress in encoders:
+                variant_path = os.path.join(self.cache_dir, f"{record['hash']}{record['ext']}{suffix}")
+                if not os.path.exists(variant_path):
+                    if data is None:
+                        with open(record["path"], 'rb') as f:
+                            data = f.read()
+                    compressed = compress(data)
+                    if len(compressed) >= len(data):
+                        continue
+                    fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp-")
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(compressed)
+                    os.replace(tmp_path, variant_path)
+                record["variants"][encoding] = variant_path
+
+    def url(self, source):
+        record = self.by_source.get(source)
+        if record is None:
+            return url_for('static', filename=source)
+        return url_for('asset', filename=record["fingerprint"])
+
+    def lookup(self, fingerprint):
+        return self.by_fingerprint.get(fingerprint)
+
+    def select_variant(self, record, accept_encoding):
+        """Return (path, content_encoding) for the best variant the client accepts."""
+        accepted = {}
+        for part in accept_encoding.split(','):
+            token, _, params = part.strip().partition(';')
+            q = 1.0
+            if params.strip().startswith('q='):
+                try:
+                    q = float(params.strip()[2:])
+                except ValueError:
+                    q = 0.0
+            accepted[token.strip().lower()] = q
+        for encoding in ("br", "gzip"):
+            if encoding in record["variants"] and accepted.get(encoding, 0) > 0:
+                return record["variants"][encoding], encoding
+        return record["path"], None
+
+asset_pipeline = AssetPipeline(app.static_folder, os.path.join(cache_folder, 'assets'))
+asset_pipeline.build()
+
 ####################
 # WebUI routes 
 ####################
 
+@app.context_processor
+def inject_asset_url():
+    return dict(asset_url=asset_pipeline.url)
+
 @app.context_processor
 def inject_theme():
     theme = session.get('theme', 'light')  # Default to 'light'
@@ -1132,7 +3867,7 @@ def inject_theme():
 @app.context_processor
 def inject_camera_list():
     camera_list = [(camera.camera_info, get_camera_info(camera.camera_info['Model'], camera_module_info)) 
-                   for key, camera in cameras.items()]
+                   for key, camera in list(cameras.items())]
     return dict(camera_list=camera_list, navbar=True)
 
 @app.route('/set_theme/<theme>')
@@ -1143,9 +3878,15 @@ def set_theme(theme):
 # Define 'home' route
 @app.route('/')
 def home():
-    camera_list = [(camera.camera_info, get_camera_info(camera.camera_info['Model'], camera_module_info)) for key, camera in cameras.items()]
+    camera_list = [(camera.camera_info, get_camera_info(camera.camera_info['Model'], camera_module_info)) for key, camera in list(cameras.items())]
     return render_template('home.html', active_page='home')
 
+@app.route('/camera_status')
+def camera_status():
+    # Initialization state and per-phase startup timings for every detected camera, plus the watchdog's view of ready ones
+    return jsonify({str(num): dict(state, watchdog=cameras[num].watchdog.status()) if num in cameras else state
+                    for num, state in camera_states.items()})
+
 @app.route('/camera_info_<int:camera_num>')
 def camera_info(camera_num):
     # Check if the camera number exists
@@ -1164,7 +3905,6 @@ def about():
 @app.route('/system_settings')
 def system_settings():
     # Load camera module info
-    print(camera_module_info)
     return render_template('system_settings.html', firmware_control=firmware_control, camera_modules=camera_module_info.get("camera_modules", []))
 
 @app.route('/set_camera_config', methods=['POST'])
@@ -1298,10 +4038,9 @@ def camera_mobile(camera_num):
     try:
         camera = cameras.get(camera_num)
         if not camera:
-            return render_template('camera_not_found.html', camera_num=camera_num)
+            return camera_unavailable_page(camera_num)
         # Get camera settings
         live_controls = camera.live_controls
-        print(live_controls)
         sensor_modes = camera.sensor_modes
         active_mode_index = camera.get_sensor_mode()
         # Find the last image taken by this specific camera
@@ -1309,7 +4048,7 @@ def camera_mobile(camera_num):
         last_image = image_gallery_manager.find_last_image_taken()
         return render_template('camera_mobile.html', camera=camera.camera_info, settings=live_controls, sensor_modes=sensor_modes, active_mode_index=active_mode_index, last_image=last_image, profiles=list_profiles(),navbar=False, theme='dark', mode="mobile") 
     except Exception as e:
-        logging.error(f"Error loading camera view: {e}")
+        log.error("error loading camera view", extra=log_fields(camera=camera_num, error=str(e)))
         return render_template('error.html', error=str(e))
 
 @app.route("/camera_<int:camera_num>")
@@ -1317,7 +4056,7 @@ def camera(camera_num):
     try:
         camera = cameras.get(camera_num)
         if not camera:
-            return render_template('camera_not_found.html', camera_num=camera_num)
+            return camera_unavailable_page(camera_num)
         # Get camera settings
         live_controls = camera.live_controls
         sensor_modes = camera.sensor_modes
@@ -1327,7 +4066,7 @@ def camera(camera_num):
         last_image = image_gallery_manager.find_last_image_taken()
         return render_template('camera.html', camera=camera.camera_info, settings=live_controls, sensor_modes=sensor_modes, active_mode_index=active_mode_index, last_image=last_image, profiles=list_profiles(), mode="desktop")
     except Exception as e:
-        logging.error(f"Error loading camera view: {e}")
+        log.error("error loading camera view", extra=log_fields(camera=camera_num, error=str(e)))
         return render_template('error.html', error=str(e))
 
 # Dictionary to track the last capture time per camera
@@ -1338,17 +4077,17 @@ def capture_still(camera_num):
     global last_capture_time
 
     try:
-        logging.debug(f"📸 Received capture request for camera {camera_num}")
+        log.debug("capture requested", extra=log_fields(camera=camera_num))
 
         camera = cameras.get(camera_num)
         if not camera:
-            logging.warning(f"❌ Camera {camera_num} not found.")
+            log.warning("camera not found", extra=log_fields(camera=camera_num))
             return jsonify(success=False, message="Camera not found"), 404
 
         # Rate limit: Prevent captures happening too quickly (2 seconds per camera)
         current_time = time.time()
         #if camera_num in last_capture_time and (current_time - last_capture_time[camera_num]) < 2:
-        #   logging.warning(f"⚠️ Capture request too fast for camera {camera_num}. Ignoring request.")
+        #   log.warning("capture request too fast, ignored", extra=log_fields(camera=camera_num))
         #   return jsonify(success=False, message="Capture request too fast"), 429  # Too Many Requests
 
         # Update the last capture time for this camera
@@ -1357,7 +4096,7 @@ def capture_still(camera_num):
         # Generate the new filename
         timestamp = int(time.time())  # Current Unix timestamp
         image_filename = f"pimage_camera_{camera_num}_{timestamp}"
-        logging.debug(f"📁 New image filename: {image_filename}")
+        log.debug("new image filename", extra=log_fields(camera=camera_num, image=image_filename))
 
         # Capture and save the new image
         image_path = camera.take_still(camera_num, image_filename)
@@ -1366,14 +4105,14 @@ def capture_still(camera_num):
         time.sleep(0.5)
 
         if image_path:
-            logging.info(f"✅ Image captured successfully: {image_filename}")
+            log.info("image captured", extra=log_fields(camera=camera_num, image=image_filename))
             return jsonify(success=True, message="Image captured successfully", image=image_filename)
         else:
-            logging.error(f"❌ Failed to capture image for camera {camera_num}")
+            log.error("failed to capture image", extra=log_fields(camera=camera_num, image=image_filename))
             return jsonify(success=False, message="Failed to capture image")
 
     except Exception as e:
-        logging.error(f"🔥 Error capturing still image: {e}")
+        log.error("error capturing still image", extra=log_fields(camera=camera_num, error=str(e)))
         return jsonify(success=False, message=str(e)), 500
     
 @app.route('/snapshot_<int:camera_num>')
@@ -1393,7 +4132,10 @@ def snapshot(camera_num):
 def video_feed(camera_num):
     camera = cameras.get(camera_num)
     if camera:
-        return Response(camera.generate_stream(), mimetype='multipart/x-mixed-replace; boundary=frame')
+        refused = stream_limiter.acquire(request.remote_addr, (camera_num, "video"))
+        if refused:
+            return Response(refused[1], status=refused[0], headers={"Retry-After": "5"})
+        return Response(LimitedStream(camera.generate_stream(), request.remote_addr, (camera_num, "video")), mimetype='multipart/x-mixed-replace; boundary=frame')
     else:
         abort(404)
 
@@ -1409,6 +4151,7 @@ def toggle_video_feed():
     camera_num = int(camera_num)
 
     if camera_num in cameras:
+        cameras[camera_num].feed_enabled = bool(enable)
         if enable:
             cameras[camera_num].start_streaming()
         else:
@@ -1435,8 +4178,7 @@ def update_setting():
         camera_num = data.get("camera_num")  # New field for camera selection
         setting_id = data.get("id")
         new_value = data.get("value")
-        # Debugging: Print the received values
-        print(f"Received update for Camera {camera_num}: {setting_id} -> {new_value}")
+        log.debug("setting update received", extra=log_fields(camera=camera_num, setting=setting_id, value=new_value))
         camera = cameras.get(camera_num)
         camera.update_settings(setting_id, new_value)
         # ✅ At this stage, we're just verifying the data. No changes to the camera yet.
@@ -1467,10 +4209,10 @@ def set_sensor_mode():
         camera.set_sensor_mode(sensor_mode)  # Blocks until done
         camera.camera_profile["sensor_mode"] = sensor_mode
 
-        print(f"✅ Sensor mode {sensor_mode} applied")
+        log.info("sensor mode applied", extra=log_fields(camera=camera_num, sensor_mode=sensor_mode))
         return jsonify({"status": "done", "new_mode": sensor_mode})  
     except ValueError as e:
-        print(f"⚠️ Error: {e}")
+        log.error("error applying sensor mode", extra=log_fields(camera=camera_num, sensor_mode=sensor_mode, error=str(e)))
         return jsonify({
             "status": "error", 
             "message": str(e), 
@@ -1517,9 +4259,37 @@ def fetch_metadata(camera_num):
     if camera_num not in cameras:
         return jsonify({"error": "Invalid camera number"}), 400
     camera = cameras[camera_num]
-    metadata = camera.capture_metadata()  # Get metadata for the selected camera
-    print(f"Camera {camera_num} Metadata: {metadata}")  # Log metadata
-    return jsonify(metadata)  # Return as JSON
+    # Served from the metadata sampler unless the last sample is too old
+    metadata = camera.capture_metadata(max_age=app.config['metadata_max_age'])
+    response = jsonify(metadata)
+    response.headers["X-Metadata-Timestamp"] = str(camera.metadata_sampler.latest()[1])
+    return response
+
+def parse_metadata_interval(value):
+    """Metadata stream interval from a query value, clamped to the configured range.
+
+    Raises ValueError for anything that is not a finite number.
+    """
+    if value is None:
+        return app.config['metadata_stream_interval']
+    interval = float(value)
+    if not math.isfinite(interval):
+        raise ValueError(f"interval must be a finite number, got {value!r}")
+    return min(max(interval, app.config['metadata_min_interval']), app.config['metadata_max_interval'])
+
+@app.route("/metadata_stream_<int:camera_num>")
+def metadata_stream(camera_num):
+    if camera_num not in cameras:
+        return jsonify({"error": "Invalid camera number"}), 400
+    camera = cameras[camera_num]
+    try:
+        interval = parse_metadata_interval(request.args.get("interval"))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid interval: {e}"}), 400
+    refused = stream_limiter.acquire(request.remote_addr, (camera_num, "metadata"))
+    if refused:
+        return Response(refused[1], status=refused[0], headers={"Retry-After": "5"})
+    return Response(LimitedStream(camera.generate_metadata_events(interval), request.remote_addr, (camera_num, "metadata")), mimetype='text/event-stream', headers={"X-Accel-Buffering": "no"})
 
 @app.route("/load_profile", methods=["POST"])
 def load_profile():
@@ -1543,7 +4313,9 @@ def load_profile():
     
 @app.route("/get_profiles")
 def get_profiles():
-    return list_profiles()
+    # Optional ?model=<sensor_model> to only list profiles saved for that camera model
+    model = request.args.get("model")
+    return jsonify(list_profiles(model))
 
 ####################
 # GPIO routes 
@@ -1554,8 +4326,6 @@ gpio = GPIO()
 
 @app.route("/gpio_setup")
 def gpio_setup():
-    gpio_pins = gpio.get_gpio_pins()
-    print(gpio_pins)
     return render_template("gpio_setup.html", gpio_pins = gpio.get_gpio_pins())
 
 ####################
@@ -1563,49 +4333,214 @@ def gpio_setup():
 ####################
 
 # Initialize the gallery with the upload folder
-image_gallery_manager = ImageGallery(upload_folder)
+# Copies of new captures to other storage, sinks are configured through /storage_sinks
+storage_offload = StorageOffload(upload_folder, os.path.join(current_dir, 'storage-sinks.json'), os.path.join(cache_folder, 'storage_queue.sqlite3'))
+storage_offload.start()
+image_gallery_manager = ImageGallery(upload_folder, offload=storage_offload)
+
+# Storage retention, policies are configured through /retention
+retention_engine = RetentionEngine(image_gallery_manager, is_busy=lambda: any(camera.capturing_still for camera in list(cameras.values())),
+                                   policy_path=os.path.join(current_dir, 'retention-policy.json'))
+retention_engine.start()
+
+@app.route('/retention', methods=['GET', 'POST'])
+def retention():
+    if request.method == 'POST':
+        try:
+            policy = retention_engine.update_policy(request.get_json(silent=True) or {})
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        return jsonify({"success": True, "policy": policy})
+    return jsonify({"policy": retention_engine.get_policy(), "last_report": retention_engine.last_report})
+
+@app.route('/retention/dry_run', methods=['GET', 'POST'])
+def retention_dry_run():
+    # Report what the current policy, or a policy posted as JSON, would delete
+    policy = retention_engine.get_policy()
+    if request.method == 'POST':
+        try:
+            policy.update(RetentionEngine.validate_policy(request.get_json(silent=True) or {}))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    return jsonify(retention_engine.plan(policy))
+
+@app.route('/storage_sinks', methods=['GET', 'POST'])
+def storage_sinks():
+    # POST {"sinks": [{"name", "type": local|date_camera|http|s3, "concurrency", "max_bytes_per_second", "layout", ...}]}
+    if request.method == 'POST':
+        try:
+            storage_offload.configure(request.get_json(silent=True) or {})
+        except (ValueError, TypeError, KeyError) as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        return jsonify({"success": True, **storage_offload.get_config()})
+    return jsonify(storage_offload.get_config())
+
+@app.route('/storage_queue', methods=['GET', 'POST'])
+def storage_queue():
+    # POST retries every queued upload now instead of waiting for its backoff
+    if request.method == 'POST':
+        storage_offload.retry_now()
+    return jsonify(storage_offload.status())
 
 @app.route('/image_gallery')
 def image_gallery():
-    page = request.args.get('page', 1, type=int)
-    images, total_pages = image_gallery_manager.paginate_images(page)
-    cameras_data = [(camera_num, camera) for camera_num, camera in cameras.items()]
-    if not images:
+    # Newest first, the page fetches further pages from /get_image_for_page by cursor, so
+    # every page costs the same however deep into the gallery it is
+    # ?collapse=1 lists runs of near-identical frames once, &distance= sets how near
+    cursor = request.args.get('cursor')
+    try:
+        collapse = parse_collapse(request.args)
+        images, next_cursor = image_gallery_manager.query_images(cursor=cursor, collapse=collapse)
+    except ValueError as e:
+        return render_template('error.html', error=str(e)), 400
+    cameras_data = [(camera_num, camera) for camera_num, camera in list(cameras.items())]
+    if not images and not cursor:
         return render_template('no_files.html')
-    # Define pagination bounds
-    start_page = max(1, page - 2)  # Show previous 2 pages
-    end_page = min(total_pages, page + 2)  # Show next 2 pages
     return render_template(
         'image_gallery.html',
         image_files=images,
-        page=page,
-        total_pages=total_pages,
-        start_page=start_page,
-        end_page=end_page,
+        next_cursor=next_cursor,
+        collapse_query=collapse_query(collapse),
         cameras_data=cameras_data,
         active_page='image_gallery'
     )
 
 @app.route('/get_image_for_page')
 def get_image_for_page():
-    page = request.args.get('page', 1, type=int)
-    images, total_pages = image_gallery_manager.paginate_images(page)
-    cameras_data = [(camera_num, camera) for camera_num, camera in cameras.items()]
-    if not images:
-        return render_template('no_files.html')
-    # Define pagination bounds
-    start_page = max(1, page - 2)  # Show previous 2 pages
-    end_page = min(total_pages, page + 2)  # Show next 2 pages
-    response = {
-        
-        'image_files': images,
-        'page': page,
-        'total_pages': total_pages,
-        'start_page': start_page,
-        'end_page': end_page
+    # The page after ?cursor= (the first page without one), next_cursor is None on the last page
+    try:
+        images, next_cursor = image_gallery_manager.query_images(cursor=request.args.get('cursor'),
+                                                                 collapse=parse_collapse(request.args))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({'image_files': images, 'next_cursor': next_cursor})
+
+def parse_gallery_time(value):
+    # Unix seconds or an ISO 8601 date/time (UTC unless it has an offset)
+    if value is None:
+        return None
+    if value.lstrip('-').isdigit():
+        return int(value)
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+def parse_gallery_filters(args):
+    """Build GalleryIndex.query_page() filters from request args, raises ValueError on bad input."""
+    filters = {
+        "camera_num": args.get("camera", type=int),
+        "since": parse_gallery_time(args.get("since")),
+        "until": parse_gallery_time(args.get("until")),
+        "min_width": args.get("min_width", type=int),
+        "min_height": args.get("min_height", type=int),
     }
-    return jsonify(response)
-    
+    has_dng = args.get("has_dng")
+    if has_dng is not None:
+        filters["has_dng"] = has_dng.lower() in ("1", "true", "yes")
+    resolution = args.get("resolution")
+    if resolution:
+        width, height = resolution.lower().split("x")
+        filters["width"], filters["height"] = int(width), int(height)
+    filters["profile"] = args.get("profile")
+    filters["sensor_mode"] = args.get("sensor_mode")
+    for field in capture_metadata_fields:
+        for bound in ("min", "max"):
+            value = args.get(f"{bound}_{field}")
+            if value is not None:
+                filters[f"{bound}_{field}"] = parse_exposure_time(value) if field == "exposure_time" else float(value)
+    return filters
+
+def parse_collapse(args):
+    # ?collapse=1/true/yes (or empty) turns collapsing on, &distance= is the Hamming distance
+    # (SimilarityIndex.DEFAULT_DISTANCE without one). Returns the distance, None when off.
+    value = args.get("collapse")
+    if value is None or value.lower() in ("0", "false", "no"):
+        return None
+    if value.lower() not in ("", "1", "true", "yes"):
+        raise ValueError(f"Invalid collapse: {value} (use collapse=1&distance=<n> for a distance)")
+    distance = args.get("distance")
+    if distance is None:
+        return SimilarityIndex.DEFAULT_DISTANCE
+    if not distance.isdigit():
+        raise ValueError(f"Invalid distance: {distance}")
+    return int(distance)
+
+def collapse_query(distance):
+    # The query string parse_collapse() turns back into `distance`
+    if distance is None:
+        return ""
+    return "collapse=1" if distance == SimilarityIndex.DEFAULT_DISTANCE else f"collapse=1&distance={distance}"
+
+def parse_exposure_time(value):
+    # Microseconds, or a shutter speed in seconds such as 1/30
+    if "/" in value:
+        numerator, denominator = value.split("/")
+        if float(denominator) == 0:
+            raise ValueError(f"Invalid shutter speed: {value}")
+        return float(numerator) / float(denominator) * 1_000_000
+    return float(value)
+
+@app.route('/api/gallery')
+def gallery_query():
+    # ?camera=&since=&until=&has_dng=&resolution=WxH&min_width=&min_height=&limit=&cursor=
+    #  &profile=&sensor_mode=&min_<field>=&max_<field>= for each capture metadata field
+    #  (max_exposure_time=1/30 takes a shutter speed), &sort=<field>&order=asc|desc
+    #  &collapse=1 lists runs of near-identical frames once, &distance= sets how near
+    try:
+        filters = parse_gallery_filters(request.args)
+        limit = min(max(request.args.get("limit", items_per_page, type=int), 1), 500)
+        order = request.args.get("order", "desc").lower()
+        if order not in ("asc", "desc"):
+            raise ValueError(f"Invalid order: {order}")
+        images, next_cursor = image_gallery_manager.query_images(filters, request.args.get("cursor"), limit,
+                                                                 request.args.get("sort", "timestamp"), order == "desc",
+                                                                 parse_collapse(request.args))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"images": images, "next_cursor": next_cursor})
+
+@app.route('/api/similar/<filename>')
+def similar_images(filename):
+    # Images that look like `filename`, ?distance= is the maximum Hamming distance
+    matches = image_gallery_manager.similarity.similar(filename, request.args.get("distance", type=int))
+    if matches is None:
+        return jsonify({"error": f"{filename} has not been hashed (yet)"}), 404
+    return jsonify({"filename": filename, "similar": [{"filename": name, "distance": distance} for distance, name in matches]})
+
+@app.route('/download_zip', methods=['GET', 'POST'])
+def download_zip():
+    # POST {"filenames": [...], "include_dng": bool} for a selection, or GET with the
+    # /api/gallery filters plus include_dng=1 to export everything matching a query
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            filenames = data.get("filenames")
+            if not isinstance(filenames, list) or not filenames:
+                return jsonify({"error": "filenames must be a non-empty list"}), 400
+            entries = image_gallery_manager.iter_export_entries(filenames=filenames, include_dng=bool(data.get("include_dng")))
+        else:
+            filters = parse_gallery_filters(request.args)
+            include_dng = request.args.get("include_dng", "0").lower() in ("1", "true", "yes")
+            entries = image_gallery_manager.iter_export_entries(filters=filters, include_dng=include_dng)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    download_name = f"camui_gallery_{int(time.time())}.zip"
+    return Response(stream_zip(entries), mimetype='application/zip',
+                    headers={"Content-Disposition": f"attachment; filename={download_name}"})
+
+@app.route('/thumb/<filename>')
+def thumbnail(filename):
+    if os.path.basename(filename) != filename or not filename.endswith('.jpg'):
+        abort(404)
+    width = request.args.get('w', 480, type=int)
+    try:
+        thumb_path = image_gallery_manager.thumbnails.get(filename, width)
+    except FileNotFoundError:
+        abort(404)
+    # Cache-Control comes from cache_policy(), send_file() adds the validators
+    return send_file(thumb_path, mimetype='image/jpeg')
+
 @app.route('/view_image/<filename>')
 def view_image(filename):
     return render_template('view_image.html', filename=filename)
@@ -1623,36 +4558,117 @@ def delete_image(filename):
 def edit_image(filename):
     return render_template('image_edit.html', filename=filename)
 
+edit_keys = ("brightness", "contrast", "gamma", "black_point", "white_point", "wb_red", "wb_green", "wb_blue", "rotation")
+
+def edits_from_args(args):
+    return {key: args[key] for key in edit_keys if key in args}
+
+@app.route('/edit_session', methods=['POST'])
+def edit_session():
+    filename = (request.get_json(silent=True) or {}).get('filename')
+    if not filename or os.path.basename(filename) != filename:
+        return jsonify({"success": False, "message": "Invalid filename"}), 400
+    try:
+        session_id, (width, height) = image_gallery_manager.edit_sessions.open(filename)
+    except FileNotFoundError:
+        return jsonify({"success": False, "message": "Image not found"}), 404
+    return jsonify({"success": True, "session_id": session_id, "width": width, "height": height})
+
+@app.route('/edit_preview/<session_id>')
+def edit_preview(session_id):
+    # ?brightness=&contrast=&rotation= rendered on the session's downscaled proxy
+    try:
+        preview = image_gallery_manager.edit_sessions.preview(session_id, edits_from_args(request.args))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    if preview is None:
+        return jsonify({"success": False, "message": "Edit session expired"}), 404
+    return Response(preview, mimetype='image/jpeg')
+
 @app.route("/apply_filters", methods=["POST"])
 def apply_filters():
+    # Preview of the edits on a downscaled proxy, the full-size render happens in /save_edit
     filename = request.form["filename"]
-    brightness = float(request.form["brightness"])
-    contrast = float(request.form["contrast"])
-    rotation = float(request.form["rotation"])
-
-    img_path = os.path.join(app.config['upload_folder'], filename)
-    img = Image.open(img_path)
-
-    # Apply transformations
-    img = img.rotate(-rotation, expand=True)
-    enhancer = ImageEnhance.Brightness(img)
-    img = enhancer.enhance(brightness)
-    enhancer = ImageEnhance.Contrast(img)
-    img = enhancer.enhance(contrast)
+    if os.path.basename(filename) != filename:
+        abort(400)
+    edits = {
+        # Form values are factors (1.0 = unchanged), the editor works in 0-200
+        "brightness": float(request.form["brightness"]) * 100,
+        "contrast": float(request.form["contrast"]) * 100,
+        "rotation": float(request.form["rotation"]),
+    }
+    try:
+        session_id = image_gallery_manager.edit_sessions.session_for_file(filename)
+    except FileNotFoundError:
+        abort(404)
+    return Response(image_gallery_manager.edit_sessions.preview(session_id, edits), mimetype='image/jpeg')
 
-    edited_filename = f"edited_{filename}"
-    edited_path = os.path.join(app.config['upload_folder'], edited_filename)
-    img.save(edited_path)
+def dng_file_for(filename):
+    # Accept either the DNG itself or the JPEG it was captured with
+    dng_file = os.path.splitext(filename)[0] + '.dng'
+    if os.path.basename(dng_file) != dng_file or not os.path.exists(os.path.join(app.config['upload_folder'], dng_file)):
+        abort(404)
+    return dng_file
 
-    return send_from_directory(app.config['upload_folder'], edited_filename)
+@app.route('/dng_preview/<filename>')
+def dng_preview(filename):
+    future = image_gallery_manager.dng_developer.develop(dng_file_for(filename))
+    try:
+        path = future.result(timeout=app.config['dng_develop_timeout'])
+    except Exception as e:
+        log.error("error developing DNG", extra=log_fields(file=filename, error=str(e)))
+        return jsonify({"success": False, "message": str(e)}), 500
+    return send_file(path, mimetype='image/jpeg')
+
+@app.route('/dng_develop/<filename>')
+def dng_develop_file(filename):
+    # Full-size development, ?format=jpeg|tiff
+    image_format = request.args.get('format', 'jpeg')
+    if image_format not in DngDeveloper.FORMATS:
+        return jsonify({"success": False, "message": f"Unsupported format: {image_format}"}), 400
+    dng_file = dng_file_for(filename)
+    future = image_gallery_manager.dng_developer.develop(dng_file, full_size=True, image_format=image_format)
+    try:
+        path = future.result(timeout=app.config['dng_develop_timeout'])
+    except Exception as e:
+        log.error("error developing DNG", extra=log_fields(file=filename, error=str(e)))
+        return jsonify({"success": False, "message": str(e)}), 500
+    _, extension, mimetype = DngDeveloper.FORMATS[image_format]
+    return send_file(path, mimetype=mimetype, as_attachment=True, download_name=os.path.splitext(dng_file)[0] + extension)
+
+@app.route('/dng_develop', methods=['POST'])
+def dng_develop_batch():
+    # Queue development of several DNGs, {"filenames": [...], "full_size": bool, "format": "jpeg"}
+    data = request.get_json(silent=True) or {}
+    filenames = data.get("filenames") or []
+    queued = []
+    for filename in filenames:
+        dng_file = os.path.splitext(filename)[0] + '.dng'
+        if os.path.basename(dng_file) != dng_file or not os.path.exists(os.path.join(app.config['upload_folder'], dng_file)):
+            continue
+        try:
+            image_gallery_manager.dng_developer.develop(dng_file, full_size=bool(data.get("full_size")), image_format=data.get("format", "jpeg"))
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        queued.append(dng_file)
+    return jsonify({"success": True, "queued": queued})
+
+@app.route('/edit_job/<job_id>')
+def edit_job(job_id):
+    job = image_gallery_manager.edit_sessions.job_status(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Job not found"}), 404
+    return jsonify({"success": True, **job})
 
 @app.route('/download_image/<filename>', methods=['GET'])
 def download_image(filename):
     try:
-        image_path = os.path.join(app.config['upload_folder'], filename)
-        return send_file(image_path, as_attachment=True)
+        # Conditional response: ETag / Last-Modified with 304s, and Range requests for large DNGs
+        return send_from_directory(app.config['upload_folder'], filename, as_attachment=True, conditional=True)
+    except NotFound:
+        abort(404)
     except Exception as e:
-        print(f"\nError downloading image:\n{e}\n")
+        log.error("error downloading image", extra=log_fields(file=filename, error=str(e)))
         abort(500)
 
 @app.route('/save_edit', methods=['POST'])
@@ -1664,12 +4680,17 @@ def save_edit():
         save_option = data.get('saveOption')
         new_filename = data.get('newFilename')
 
-        success, message = image_gallery_manager.save_edit(filename, edits, save_option, new_filename)
+        if not filename or not os.path.exists(os.path.join(app.config['upload_folder'], filename)):
+            return jsonify({'success': False, 'message': 'Original image not found.'})
+        if image_gallery_manager.resolve_save_path(filename, save_option, new_filename) is None:
+            return jsonify({'success': False, 'message': 'Invalid save option.'})
 
-        return jsonify({'success': success, 'message': message})
+        # The full-resolution render runs in the background, poll /edit_job/<job_id> for the result
+        job_id = image_gallery_manager.edit_sessions.submit_render(filename, edits, save_option, new_filename)
+        return jsonify({'success': True, 'message': 'Saving image in the background.', 'job_id': job_id})
 
     except Exception as e:
-        logging.error(f"Error in save_edit route: {e}")
+        log.error("error saving edit", extra=log_fields(error=str(e)))
         return jsonify({'success': False, 'message': 'Error saving edit'}), 500
 
 
@@ -1677,17 +4698,434 @@ def save_edit():
 # Misc Routes
 ####################
 
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    record = asset_pipeline.lookup(filename)
+    if record is None:
+        # Files referenced relatively from fingerprinted CSS, e.g. the icon fonts
+        return send_from_directory(app.static_folder, filename)
+    path, encoding = asset_pipeline.select_variant(record, request.headers.get('Accept-Encoding', ''))
+    response = send_file(path, mimetype=record["mimetype"], conditional=True, etag=f"{record['hash']}-{encoding or 'identity'}")
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
 @app.route('/beta')
 def beta():
     return render_template('beta.html')
 
+@app.route('/logging', methods=['GET', 'POST'])
+def logging_config():
+    # Change log levels, format and debug sampling without a restart, e.g. {"level": "debug", "debug_sample_every": 50}
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({"success": False, "error": "Expected a JSON object"}), 400
+        unknown = set(data) - {"level", "format", "picamera2_level", "debug_sample_every", "loggers"}
+        if unknown:
+            return jsonify({"success": False, "error": f"Unknown logging settings: {', '.join(sorted(unknown))}"}), 400
+        try:
+            settings = configure_logging(data.get("level"), data.get("format"), data.get("picamera2_level"),
+                                         data.get("debug_sample_every"), data.get("loggers"))
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        return jsonify({"success": True, "settings": settings})
+    return jsonify(logging_settings())
+
+@app.route('/traces')
+def traces():
+    # Most recent spans first, optionally only those named ?span=
+    name = request.args.get('span')
+    limit = request.args.get('limit', 50, type=int)
+    rings = [recent_spans.get(name, ())] if name is not None else list(recent_spans.values())
+    spans = sorted((entry for ring in rings for entry in list(ring)), key=lambda entry: entry[0], reverse=True)
+    return jsonify([record for _, record in spans[:limit]])
+
+# Static folders whose files change in place, these are always revalidated
+mutable_static_prefixes = ('gallery/', 'camera_profiles/')
+static_versions = {}
+
+@app.url_defaults
+def add_static_version(endpoint, values):
+    # Version static asset URLs by file mtime so they can be cached as immutable
+    if endpoint != 'static' or 'v' in values:
+        return
+    filename = values.get('filename', '')
+    if filename.startswith(mutable_static_prefixes):
+        return
+    if filename not in static_versions:
+        try:
+            static_versions[filename] = int(os.path.getmtime(os.path.join(app.static_folder, filename)))
+        except OSError:
+            return
+    values['v'] = static_versions[filename]
+
+def static_cache_policy(filename):
+    # Files served straight from the static folder, only a ?v= version makes them immutable
+    if filename.startswith(mutable_static_prefixes):
+        return "no-cache"  # Revalidate with ETag / Last-Modified
+    if request.args.get('v'):
+        return "public, max-age=31536000, immutable"
+    return "public, max-age=86400"
+
+def cache_policy():
+    """Cache-Control for the current request, None for live and dynamic endpoints."""
+    if request.endpoint in ('static', 'asset'):
+        # /assets falls back to the static folder for files referenced relatively from fingerprinted CSS
+        return static_cache_policy((request.view_args or {}).get('filename', ''))
+    if request.endpoint == 'thumbnail' and request.args.get('v'):
+        # Versioned thumbnail URLs (?v= is the source file version) never change in place
+        return "public, max-age=31536000, immutable"
+    if request.endpoint in ('download_image', 'thumbnail'):
+        return "private, no-cache"
+    return None
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def observe_request_time(response):
+    if "request_start" in g:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        request_seconds.labels(route, request.method, response.status_code).observe(time.perf_counter() - g.request_start)
+    return response
+
+@app.errorhandler(CameraCommandTimeout)
+def camera_busy(e):
+    return jsonify({"success": False, "error": str(e)}), 503
+
 @app.after_request
 def add_header(response):
+    if "immutable" in response.headers.get("Cache-Control", ""):
+        return response
+    policy = cache_policy()
+    if policy:
+        response.headers["Cache-Control"] = policy
+        return response
     response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
     response.headers["Pragma"] = "no-cache"
     response.headers["Expires"] = "0"
     return response
 
+####################
+# Metrics endpoint
+####################
+
+# Gauges worked out when /metrics is scraped
+metrics.gauge("picamera_stream_viewers", "Open video and metadata streams", ("camera", "kind"),
+              collect=lambda: stream_limiter.stream_counts())
+metrics.gauge("picamera_command_queue_depth", "Camera commands waiting or running", ("camera",),
+              collect=lambda: {(num,): camera.commands.depth() for num, camera in list(cameras.items()) if getattr(camera, "commands", None)})
+metrics.gauge("picamera_stream_frame_age_seconds", "Seconds since the encoder last produced a frame", ("camera",),
+              collect=lambda: {(num,): time.monotonic() - camera.last_frame_time for num, camera in list(cameras.items())})
+metrics.gauge("picamera_gallery_images", "Images in the gallery index",
+              collect=lambda: {(): image_gallery_manager.index.count()})
+metrics.gauge("picamera_disk_free_bytes", "Free space on the gallery filesystem", ("path",),
+              collect=lambda: {(upload_folder,): shutil.disk_usage(upload_folder).free})
+metrics.gauge("picamera_disk_total_bytes", "Size of the gallery filesystem", ("path",),
+              collect=lambda: {(upload_folder,): shutil.disk_usage(upload_folder).total})
+metrics.gauge("picamera_storage_queue_jobs", "Uploads waiting per storage sink", ("sink",),
+              collect=lambda: {(name,): status["queued"] for name, status in storage_offload.status()["sinks"].items()})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+####################
+# Production server
+####################
+
+class StreamLimiter:
+    """Caps the number of open MJPEG and metadata streams, in total and per client IP."""
+    def __init__(self, max_streams=None, max_per_ip=None):
+        self.max_streams = max_streams
+        self.max_per_ip = max_per_ip
+        self.lock = threading.Lock()
+        self.per_ip = {}
+        self.per_stream = {}  # (camera number, "video" or "metadata") -> open streams
+
+    def acquire(self, ip, stream):
+        """Reserve a slot for `stream` from `ip`. Returns None, or (status, message) when refused."""
+        with self.lock:
+            if self.max_streams is not None and sum(self.per_ip.values()) >= self.max_streams:
+                return 503, "Too many open streams"
+            if self.max_per_ip is not None and self.per_ip.get(ip, 0) >= self.max_per_ip:
+                return 429, "Too many open streams from this address"
+            self.per_ip[ip] = self.per_ip.get(ip, 0) + 1
+            self.per_stream[stream] = self.per_stream.get(stream, 0) + 1
+            return None
+
+    def release(self, ip, stream):
+        with self.lock:
+            self.per_ip[ip] -= 1
+            if not self.per_ip[ip]:
+                del self.per_ip[ip]
+            self.per_stream[stream] -= 1
+
+    def open_streams(self):
+        with self.lock:
+            return sum(self.per_ip.values())
+
+    def stream_counts(self):
+        with self.lock:
+            return dict(self.per_stream)
+
+stream_limiter = StreamLimiter()
+
+class LimitedStream:
+    """Response body of a stream that holds a StreamLimiter slot.
+
+    The server closes the response when the client goes away, close() then frees the
+    slot. A generator's finally would not run if the response is closed before its
+    first frame, so the slot is released here instead.
+    """
+    def __init__(self, generator, ip, stream):
+        self.generator = generator
+        self.ip = ip
+        self.stream = stream
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.generator)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.generator.close()
+        finally:
+            stream_limiter.release(self.ip, self.stream)
+
+def shutdown_cameras():
+    """Stop the encoders and close every camera, so the pipeline is released cleanly."""
+    for camera_num, camera in list(cameras.items()):
+        camera.watchdog.stop()
+        try:
+            camera.stop_streaming()
+            camera.picam2.stop()
+            camera.picam2.close()
+            log.info("camera stopped", extra=log_fields(camera=camera_num))
+        except Exception as e:
+            log.error("error stopping camera", extra=log_fields(camera=camera_num, error=str(e)))
+    config_store.flush()
+
+class FrameHub:
+    """Hands the newest MJPEG frame of one camera to every async stream client.
+
+    The encoder thread calls publish(), which schedules a single callback on the
+    event loop per frame however many clients are watching. Clients always get the
+    newest frame, so a slow client skips frames instead of building a backlog.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.frame = None
+        self.event = asyncio.Event()
+        self.clients = 0
+
+    def publish(self, frame):
+        self.loop.call_soon_threadsafe(self.deliver, frame)
+
+    def deliver(self, frame):
+        self.frame = frame
+        event, self.event = self.event, asyncio.Event()
+        event.set()
+
+    async def next_frame(self):
+        await self.event.wait()
+        return self.frame
+
+class AsyncFrontend:
+    """ASGI application for --server async.
+
+    Video and metadata streams are served natively as coroutines, so an open stream
+    costs no thread. Every other request goes to the Flask app on a thread pool
+    through a2wsgi.
+    """
+    STREAM_ROUTES = (
+        (re.compile(r'^/video_feed_(\d+)$'), "video"),
+        (re.compile(r'^/metadata_stream_(\d+)$'), "metadata"),
+    )
+
+    def __init__(self, wsgi_app, threads=32):
+        self.wsgi = WSGIMiddleware(self.stop_on_disconnect(wsgi_app), workers=threads)
+        self.hubs = {}
+        self.streams = set()  # Tasks of open streams, cancelled on shutdown
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] != "http":
+            return
+        for pattern, kind in self.STREAM_ROUTES:
+            match = pattern.match(scope["path"])
+            if match and int(match.group(1)) in cameras and scope["method"] == "GET":
+                return await self.stream(kind, cameras[int(match.group(1))], scope, receive, send)
+        await self.call_wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await asyncio.get_running_loop().run_in_executor(None, shutdown_cameras)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def close_streams(self):
+        for task in list(self.streams):
+            task.cancel()
+
+    async def stream(self, kind, camera, scope, receive, send):
+        ip = (scope.get("client") or ("unknown",))[0]
+        stream_key = (camera.camera_info['Num'], kind)
+        if kind == "metadata":
+            query = urllib.parse.parse_qs(scope["query_string"].decode("latin-1"))
+            try:
+                interval = parse_metadata_interval(query.get("interval", [None])[0])
+            except ValueError as e:
+                body = json.dumps({"error": f"Invalid interval: {e}"}).encode()
+                await send({"type": "http.response.start", "status": 400, "headers": [(b"content-type", b"application/json")]})
+                await send({"type": "http.response.body", "body": body})
+                return
+        refused = stream_limiter.acquire(ip, stream_key)
+        if refused:
+            status, message = refused
+            await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"text/plain"), (b"retry-after", b"5")]})
+            await send({"type": "http.response.body", "body": message.encode()})
+            return
+        task = asyncio.current_task()
+        self.streams.add(task)
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            task.cancel()
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            if kind == "video":
+                await self.video_stream(camera, send)
+            else:
+                await self.metadata_stream(camera, interval, send)
+        except asyncio.CancelledError:
+            # Client went away or the server is shutting down, end the response cleanly
+            try:
+                await send({"type": "http.response.body", "body": b""})
+            except Exception:
+                pass
+        finally:
+            watcher.cancel()
+            self.streams.discard(task)
+            stream_limiter.release(ip, stream_key)
+
+    async def video_stream(self, camera, send):
+        camera_num = camera.camera_info['Num']
+        hub = self.hubs.get(camera_num)
+        if hub is None:
+            hub = self.hubs[camera_num] = FrameHub(asyncio.get_running_loop())
+            camera.frame_listeners.add(hub.publish)
+        hub.clients += 1
+        try:
+            await send({"type": "http.response.start", "status": 200, "headers": [
+                (b"content-type", b"multipart/x-mixed-replace; boundary=frame"),
+                (b"cache-control", b"no-store, no-cache, must-revalidate, max-age=0")]})
+            while True:
+                if camera.capturing_still:
+                    frame = camera.placeholder_frame
+                    await asyncio.sleep(0.1)
+                else:
+                    try:
+                        frame = await asyncio.wait_for(hub.next_frame(), camera.frame_wait_timeout())
+                    except asyncio.TimeoutError:
+                        frame = camera.placeholder_frame  # Stalled pipeline, the watchdog is on it
+                await send({"type": "http.response.body", "more_body": True,
+                            "body": b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + frame + b'\r\n'})
+        finally:
+            hub.clients -= 1
+            if not hub.clients:
+                camera.frame_listeners.discard(hub.publish)
+                del self.hubs[camera_num]
+
+    async def metadata_stream(self, camera, interval, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", b"text/event-stream"), (b"x-accel-buffering", b"no"), (b"cache-control", b"no-store")]})
+        last_timestamp = 0.0
+        last_sent = time.time()
+        while True:
+            metadata, timestamp = camera.metadata_sampler.latest()
+            if timestamp > last_timestamp:
+                last_timestamp = last_sent = timestamp
+                payload = json.dumps({"timestamp": timestamp, "metadata": metadata}, default=str)
+                await send({"type": "http.response.body", "body": f"data: {payload}\n\n".encode(), "more_body": True})
+            elif time.time() - last_sent > 15:
+                last_sent = time.time()
+                await send({"type": "http.response.body", "body": b": keepalive\n\n", "more_body": True})
+            await asyncio.sleep(interval)
+
+    @staticmethod
+    def stop_on_disconnect(wsgi_app):
+        # Stop generating once the client is gone, e.g. a ZIP export nobody is downloading anymore
+        def application(environ, start_response):
+            disconnected = environ["asgi.scope"]["camui.disconnected"]
+            iterable = wsgi_app(environ, start_response)
+            try:
+                for chunk in iterable:
+                    if disconnected.is_set():
+                        return
+                    yield chunk
+            finally:
+                if hasattr(iterable, "close"):
+                    iterable.close()
+        return application
+
+    async def call_wsgi(self, scope, receive, send):
+        # The request body is read first, after that receive() is only watched for a disconnect
+        body = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body.append(message)
+            if not message.get("more_body"):
+                break
+        disconnected = threading.Event()
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        async def replay_body():
+            return body.pop(0) if body else {"type": "http.request", "body": b""}
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            await self.wsgi(dict(scope, **{"camui.disconnected": disconnected}), replay_body, send)
+        finally:
+            watcher.cancel()
+
+def run_async_server(args):
+    """Serve the app with uvicorn and AsyncFrontend until SIGINT/SIGTERM."""
+    if uvicorn is None:
+        raise SystemExit("--server async needs uvicorn and a2wsgi: pip install uvicorn a2wsgi")
+    frontend = AsyncFrontend(app, threads=args.threads)
+
+    class GracefulServer(uvicorn.Server):
+        async def shutdown(self, sockets=None):
+            # Streams never finish by themselves, end them so shutdown doesn't wait out the timeout
+            frontend.close_streams()
+            await super().shutdown(sockets)
+
+    config = uvicorn.Config(frontend, host=args.ip, port=args.port, lifespan="on", log_level="info",
+                            limit_concurrency=args.max_connections, timeout_graceful_shutdown=args.shutdown_timeout)
+    GracefulServer(config).run()
+
 ####################
 # Start Flask 
 ####################
@@ -1697,6 +5135,31 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='PiCamera2 WebUI')
     parser.add_argument('--port', type=int, default=8080, help='Port number to run the web server on')
     parser.add_argument('--ip', type=str, default='0.0.0.0', help='IP to which the web server is bound to')
+    parser.add_argument('--server', choices=['flask', 'async'], default='flask',
+                        help='flask: the Flask development server, async: uvicorn with streams served as coroutines')
+    parser.add_argument('--max-connections', type=int, default=None, help='Open connections allowed at once (async server only)')
+    parser.add_argument('--max-streams', type=int, default=None, help='Open video/metadata streams allowed at once')
+    parser.add_argument('--max-streams-per-ip', type=int, default=None, help='Open video/metadata streams allowed per client IP')
+    parser.add_argument('--threads', type=int, default=32, help='Threads for non-stream requests (async server only)')
+    parser.add_argument('--shutdown-timeout', type=int, default=10, help='Seconds to wait for requests to finish on shutdown')
+    parser.add_argument('--log-level', type=str, default=None, help='Log level for the app, overrides CAMUI_LOG_LEVEL (default INFO)')
+    parser.add_argument('--log-format', choices=['logfmt', 'json'], default=None, help='Log line format, overrides CAMUI_LOG_FORMAT')
+    parser.add_argument('--picamera2-log-level', type=str, default=None,
+                        help='Log level for picamera2 once started, set PICAMERA2_LOG_LEVEL to cover camera start-up too')
+    parser.add_argument('--debug-sample-every', type=int, default=None, help='Log one DEBUG message in N per call site')
+    parser.add_argument('--camera-backend', choices=['picamera2', 'sim'], default=camera_backend,
+                        help='sim runs simulated cameras (sim_camera.py) so the app works without camera hardware')
+    parser.add_argument('--sim-cameras', default=None, help='Comma separated sensor models to simulate, e.g. imx708,imx477')
+    parser.add_argument('--sim-fps', type=float, default=None, help='Frame rate limit for the simulated cameras')
     args = parser.parse_args()
+    configure_logging(args.log_level, args.log_format, args.picamera2_log_level, args.debug_sample_every)
+    stream_limiter.max_streams = args.max_streams
+    stream_limiter.max_per_ip = args.max_streams_per_ip
     # If there are no arguments the port will be 8080 and ip 0.0.0.0 
-    app.run(host=args.ip, port=args.port)
\ No newline at end of file
+    if args.server == 'async':
+        run_async_server(args)
+    else:
+        try:
+            app.run(host=args.ip, port=args.port, threaded=True)
+        finally:
+            shutdown_cameras()
\ No newline at end of file
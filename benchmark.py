@@ -0,0 +1,429 @@
+"""
+End-to-end benchmarks for CamUI, run against the simulated camera backend.
+
+    python benchmark.py                                     # everything, results in benchmark-results.json
+    python benchmark.py --only stream,settings --clients 1,8
+    python benchmark.py --baseline benchmark-baseline.json  # compare, exit 1 on a regression
+    python benchmark.py --save-baseline benchmark-baseline.json
+
+Each run copies the app to a temporary directory and starts it there with
+--camera-backend sim (see sim_camera.py), so the real gallery, profiles and
+config are never touched. The app is driven over HTTP like a browser would:
+
+    stream    N concurrent MJPEG clients, the frame rate each one gets
+    gallery   page latency with 1k, 10k and 100k images in the gallery
+    settings  /update_setting throughput and latency
+    profile   time to load a saved profile
+
+Every metric records whether higher or lower is better, so a run can be
+compared against a stored baseline with a tolerance.
+"""
+import argparse
+import base64
+import http.client
+import io
+import json
+import os
+import platform
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+
+from PIL import Image
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+SUITES = ("stream", "gallery", "settings", "profile")
+
+# Left behind by a real install, never copied into the benchmark app directory
+IGNORED_PATHS = shutil.ignore_patterns(".git", "__pycache__", "cache", "tests", "storage-sinks.json", "retention-policy.json", "benchmark-*.json")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+class Results:
+    """Metrics of one run: name -> {"value", "unit", "better"}."""
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, name, value, unit, better):
+        if value is None:
+            return
+        self.metrics[name] = {"value": round(value, 3), "unit": unit, "better": better}
+        print(f"  {name:<45} {value:>12.3f} {unit}")
+
+    def add_latencies(self, name, latencies):
+        """p50 and p95 of a list of latencies in seconds, in milliseconds."""
+        self.add(f"{name}.p50_ms", percentile(latencies, 0.5) * 1000, "ms", "lower")
+        self.add(f"{name}.p95_ms", percentile(latencies, 0.95) * 1000, "ms", "lower")
+
+
+class AppUnderTest:
+    """The app running from a private copy of the repository."""
+    def __init__(self, workdir, port, server, sim_cameras, startup_timeout=60):
+        self.workdir = workdir
+        self.port = port
+        self.server = server
+        self.sim_cameras = sim_cameras
+        self.startup_timeout = startup_timeout
+        self.process = None
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.port}{path}"
+
+    def start(self):
+        env = dict(os.environ, CAMUI_LOG_LEVEL="warning", PYTHONUNBUFFERED="1")
+        self.log = open(os.path.join(self.workdir, "benchmark-app.log"), "ab")
+        self.process = subprocess.Popen(
+            [sys.executable, "app.py", "--camera-backend", "sim", "--sim-cameras", self.sim_cameras,
+             "--ip", "127.0.0.1", "--port", str(self.port), "--server", self.server],
+            cwd=self.workdir, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+        started = time.perf_counter()
+        deadline = started + self.startup_timeout
+        while time.perf_counter() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"The app exited during startup, see {self.log.name}")
+            try:
+                states = self.get_json("/camera_status", timeout=2)
+                if states and all(state.get("state") == "ready" for state in states.values()):
+                    return time.perf_counter() - started
+                if any(state.get("state") == "failed" for state in states.values()):
+                    raise RuntimeError(f"A simulated camera failed to start: {states}")
+            except (OSError, http.client.HTTPException, ValueError):
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"The app was not ready within {self.startup_timeout}s, see {self.log.name}")
+
+    def stop(self):
+        if self.process is None:
+            return
+        # SIGINT lets the app release the cameras the way Ctrl+C would
+        self.process.send_signal(signal.SIGINT)
+        try:
+            self.process.wait(timeout=20)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+        self.log.close()
+
+    def request(self, path, data=None, timeout=30):
+        body = json.dumps(data).encode() if data is not None else None
+        req = urllib.request.Request(self.url(path), data=body, headers={"Content-Type": "application/json"} if body else {})
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return response.read()
+
+    def get_json(self, path, data=None, timeout=30):
+        return json.loads(self.request(path, data, timeout))
+
+    def timed(self, path, data=None):
+        start = time.perf_counter()
+        body = self.request(path, data)
+        return time.perf_counter() - start, body
+
+    def metric(self, name, labels=""):
+        """Sum of the /metrics samples of `name` whose labels contain `labels`."""
+        total = 0.0
+        for line in self.request("/metrics").decode().splitlines():
+            if line.startswith(name) and labels in line and not line.startswith(name + "_"):
+                total += float(line.rsplit(" ", 1)[1])
+        return total
+
+
+def read_stream(app, camera_num, warmup, duration, counts, index, connected):
+    """Count the frames one MJPEG client receives in `duration` seconds, after `warmup` seconds.
+
+    The client reads all the time, so frames never pile up in the socket buffers and
+    get counted late.
+    """
+    connection = http.client.HTTPConnection("127.0.0.1", app.port, timeout=10)
+    try:
+        connection.request("GET", f"/video_feed_{camera_num}")
+        response = connection.getresponse()
+        connected.release()
+        if response.status != 200:
+            return
+        frames = 0
+        tail = b""
+        start = time.perf_counter() + warmup
+        deadline = start + duration
+        while True:
+            chunk = response.read1(65536)
+            now = time.perf_counter()
+            if not chunk or now >= deadline:
+                break
+            if now < start:
+                continue
+            data = tail + chunk
+            frames += data.count(b"--frame\r\n")
+            tail = data[-8:]  # Too short to hold a whole boundary, so none is counted twice
+        counts[index] = frames
+    except OSError:
+        connected.release()
+    finally:
+        connection.close()
+
+
+def bench_stream(app, results, clients_list, duration, camera_num=0, warmup=2.0):
+    print("stream")
+    for clients in clients_list:
+        counts = [None] * clients
+        connected = threading.Semaphore(0)
+        threads = [threading.Thread(target=read_stream, args=(app, camera_num, warmup, duration, counts, i, connected), daemon=True)
+                   for i in range(clients)]
+        for thread in threads:
+            thread.start()
+        for _ in threads:
+            connected.acquire(timeout=30)
+        # The first viewer restarts the pipeline, the encoder rate is measured once that has settled
+        time.sleep(warmup)
+        frames_before = app.metric("picamera_encoder_frames_total", f'camera="{camera_num}"')
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join(timeout=duration + warmup + 30)
+        source_fps = (app.metric("picamera_encoder_frames_total", f'camera="{camera_num}"') - frames_before) / (time.perf_counter() - start)
+        rates = [count / duration for count in counts if count is not None]
+        results.add(f"stream.{clients}_clients.source_fps", source_fps, "fps", "higher")
+        results.add(f"stream.{clients}_clients.failed", clients - len(rates), "clients", "lower")
+        if rates:
+            results.add(f"stream.{clients}_clients.fps_min", min(rates), "fps", "higher")
+            results.add(f"stream.{clients}_clients.fps_mean", sum(rates) / len(rates), "fps", "higher")
+        time.sleep(1.0)  # Let the server notice the closed connections
+
+
+def tiny_jpeg():
+    buffer = io.BytesIO()
+    Image.new("RGB", (160, 120), (90, 120, 150)).save(buffer, format="JPEG", quality=70)
+    return buffer.getvalue()
+
+
+def gallery_image(i):
+    """(timestamp, filename) of the i-th oldest image populate_gallery() writes."""
+    timestamp = 1_600_000_000 + i * 7
+    return timestamp, f"pimage_camera_0_{timestamp}.jpg"
+
+
+def gallery_cursor(timestamp, filename):
+    # Same encoding as GalleryIndex.encode_cursor()
+    return base64.urlsafe_b64encode(json.dumps([timestamp, filename]).encode()).decode().rstrip("=")
+
+
+def populate_gallery(gallery_folder, total):
+    """Fill the gallery with `total` small captures, keeping the ones already there."""
+    data = tiny_jpeg()
+    existing = len([name for name in os.listdir(gallery_folder) if name.startswith("pimage_camera_0_")])
+    for i in range(existing, total):
+        with open(os.path.join(gallery_folder, gallery_image(i)[1]), "wb") as f:
+            f.write(data)
+
+
+def wait_for_index(app, total, timeout):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if app.metric("picamera_gallery_images") >= total:
+            return time.perf_counter() - start
+        time.sleep(0.25)
+    raise RuntimeError(f"The gallery index did not reach {total} images within {timeout}s")
+
+
+def bench_gallery(app_factory, results, sizes, samples):
+    print("gallery")
+    for size in sizes:
+        app = app_factory()
+        populate_gallery(os.path.join(app.workdir, "static", "gallery"), size)
+        app.start()
+        try:
+            results.add(f"gallery.{size}.index_seconds", wait_for_index(app, size, timeout=max(60, size / 500)), "s", "lower")
+            latencies = [app.timed("/get_image_for_page")[0] for _ in range(samples)]
+            results.add_latencies(f"gallery.{size}.first_page", latencies)
+            # The cursor of the 13th oldest image, so the page after it is the last one
+            cursor = gallery_cursor(*gallery_image(12))
+            latencies = [app.timed(f"/get_image_for_page?cursor={cursor}")[0] for _ in range(samples)]
+            results.add_latencies(f"gallery.{size}.last_page", latencies)
+            latencies = [app.timed("/image_gallery")[0] for _ in range(samples)]
+            results.add_latencies(f"gallery.{size}.html_page", latencies)
+            # Walk the cursor API as far as `samples` pages go
+            latencies = []
+            cursor = None
+            for _ in range(samples):
+                elapsed, body = app.timed("/api/gallery?limit=50" + (f"&cursor={cursor}" if cursor else ""))
+                latencies.append(elapsed)
+                cursor = json.loads(body).get("next_cursor")
+                if not cursor:
+                    break
+            results.add_latencies(f"gallery.{size}.cursor_page", latencies)
+        finally:
+            app.stop()
+
+
+def bench_settings(app, results, total, concurrency, camera_num=0):
+    print("settings")
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            value = round((i % 21) / 10 - 1.0, 1)
+            try:
+                elapsed, _ = app.timed("/update_setting", {"camera_num": camera_num, "id": "Brightness", "value": value})
+            except (OSError, urllib.error.HTTPError):
+                with lock:
+                    errors[0] += 1
+                continue
+            with lock:
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    results.add("settings.update_setting.requests_per_second", len(latencies) / elapsed, "req/s", "higher")
+    results.add_latencies("settings.update_setting", latencies)
+    results.add("settings.update_setting.errors", errors[0], "requests", "lower")
+
+
+def bench_profile(app, results, samples, camera_num=0):
+    print("profile")
+    app.request(f"/save_profile_{camera_num}", {"filename": "benchmark_profile"})
+    latencies = []
+    for _ in range(samples):
+        elapsed, body = app.timed("/load_profile", {"profile_name": "benchmark_profile.json", "camera_num": camera_num})
+        if json.loads(body).get("success"):
+            latencies.append(elapsed)
+    if latencies:
+        results.add_latencies("profile.load", latencies)
+
+
+def compare(metrics, baseline, tolerance):
+    """Compare with a baseline run, returns (comparison, regressions)."""
+    comparison = {}
+    regressions = []
+    for name, metric in metrics.items():
+        base = baseline.get("metrics", {}).get(name)
+        if base is None:
+            continue
+        value, base_value = metric["value"], base["value"]
+        change = (value - base_value) / abs(base_value) if base_value else (0.0 if value == base_value else float("inf"))
+        worse = change < -tolerance if metric["better"] == "higher" else change > tolerance
+        # Counters of failures regress as soon as they go up from zero
+        if base_value == 0 and metric["better"] == "lower":
+            worse = value > 0
+        comparison[name] = {"baseline": base_value, "value": value, "change": round(change, 4) if change != float("inf") else None,
+                            "regression": worse}
+        if worse:
+            regressions.append(name)
+    return comparison, regressions
+
+
+def make_workdir(root):
+    workdir = os.path.join(root, f"app-{len(os.listdir(root))}")
+    shutil.copytree(current_dir, workdir, ignore=IGNORED_PATHS)
+    # Start from an empty gallery
+    gallery = os.path.join(workdir, "static", "gallery")
+    shutil.rmtree(gallery, ignore_errors=True)
+    os.makedirs(gallery)
+    return workdir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CamUI end-to-end benchmarks against simulated cameras")
+    parser.add_argument("--only", default=",".join(SUITES), help=f"Comma separated suites to run: {', '.join(SUITES)}")
+    parser.add_argument("--server", choices=["flask", "async"], default="flask", help="Server mode of the app under test")
+    parser.add_argument("--sim-cameras", default="imx708", help="Simulated camera models, see sim_camera.py")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--clients", default="1,4,16", help="Concurrent MJPEG clients to test")
+    parser.add_argument("--stream-seconds", type=float, default=5.0, help="How long each client reads the stream")
+    parser.add_argument("--gallery-sizes", default="1000,10000,100000", help="Gallery sizes to test")
+    parser.add_argument("--samples", type=int, default=20, help="Requests per latency measurement")
+    parser.add_argument("--settings-requests", type=int, default=500)
+    parser.add_argument("--settings-concurrency", type=int, default=8)
+    parser.add_argument("--output", default="benchmark-results.json", help="Where to write the results")
+    parser.add_argument("--baseline", default=None, help="Results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Relative change allowed before a metric counts as a regression")
+    parser.add_argument("--save-baseline", default=None, help="Also write the results here, to compare later runs with")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary app directories (with the app logs)")
+    args = parser.parse_args()
+
+    suites = [suite.strip() for suite in args.only.split(",") if suite.strip()]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"Unknown suites: {', '.join(sorted(unknown))}")
+
+    results = Results()
+    root = tempfile.mkdtemp(prefix="camui-benchmark-")
+
+    def app_factory():
+        return AppUnderTest(make_workdir(root), args.port, args.server, args.sim_cameras)
+
+    try:
+        if any(suite in suites for suite in ("stream", "settings", "profile")):
+            app = app_factory()
+            startup = app.start()
+            try:
+                results.add("startup.seconds", startup, "s", "lower")
+                if "stream" in suites:
+                    bench_stream(app, results, [int(n) for n in args.clients.split(",")], args.stream_seconds)
+                if "settings" in suites:
+                    bench_settings(app, results, args.settings_requests, args.settings_concurrency)
+                if "profile" in suites:
+                    bench_profile(app, results, max(args.samples // 4, 3))
+            finally:
+                app.stop()
+        if "gallery" in suites:
+            bench_gallery(app_factory, results, [int(n) for n in args.gallery_sizes.split(",")], args.samples)
+    finally:
+        if args.keep:
+            print(f"App directories kept in {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        "version": 1,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "server": args.server, "sim_cameras": args.sim_cameras, "suites": suites,
+        },
+        "metrics": results.metrics,
+    }
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["baseline"] = {"path": args.baseline, "created": baseline.get("created"), "tolerance": args.tolerance}
+        report["comparison"], regressions = compare(results.metrics, baseline, args.tolerance)
+        for name in regressions:
+            entry = report["comparison"][name]
+            print(f"REGRESSION {name}: {entry['baseline']} -> {entry['value']}")
+        print(f"{len(report['comparison'])} metrics compared with {args.baseline}, {len(regressions)} regressions")
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {path}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,8 @@
 from picamera2 import Picamera2
-import json
+import json, os
 
-# Set debug level to Warning
-Picamera2.set_logging(Picamera2.DEBUG)
+# picamera2 log level, WARNING unless PICAMERA2_LOG_LEVEL is set (e.g. DEBUG when chasing a camera problem)
+Picamera2.set_logging(os.environ.get("PICAMERA2_LOG_LEVEL", "WARNING").upper())
 # Ask picamera2 for what cameras are connected
 global_cameras = Picamera2.global_camera_info()
 
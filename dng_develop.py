@@ -0,0 +1,255 @@
+"""
+Development of the DNG files picamera2 writes when saveRAW is enabled.
+
+This module only depends on NumPy and PIL (no picamera2 or Flask) so app.py can
+run it as a separate process per job, using every core without the GIL. develop_dng() reads the Bayer data straight out of the
+DNG, demosaics it, applies the as-shot white balance and a tone curve, and writes
+a JPEG or TIFF.
+
+Only uncompressed CFA data is supported (in strips or tiles), which is what
+picamera2 writes through PiDNG.
+"""
+import math
+import os
+import struct
+
+import numpy as np
+from PIL import Image
+
+# TIFF field types: struct format and size in bytes
+TIFF_TYPES = {
+    1: ('B', 1), 2: ('c', 1), 3: ('H', 2), 4: ('I', 4), 5: ('II', 8), 6: ('b', 1), 7: ('B', 1),
+    8: ('h', 2), 9: ('i', 4), 10: ('ii', 8), 11: ('f', 4), 12: ('d', 8), 13: ('I', 4), 16: ('Q', 8),
+}
+
+TAG_NEW_SUBFILE_TYPE = 254
+TAG_WIDTH = 256
+TAG_HEIGHT = 257
+TAG_BITS_PER_SAMPLE = 258
+TAG_COMPRESSION = 259
+TAG_PHOTOMETRIC = 262
+TAG_STRIP_OFFSETS = 273
+TAG_STRIP_BYTE_COUNTS = 279
+TAG_TILE_WIDTH = 322
+TAG_TILE_LENGTH = 323
+TAG_TILE_OFFSETS = 324
+TAG_TILE_BYTE_COUNTS = 325
+TAG_SUB_IFDS = 330
+TAG_CFA_REPEAT_PATTERN_DIM = 33421
+TAG_CFA_PATTERN = 33422
+TAG_BLACK_LEVEL = 50714
+TAG_WHITE_LEVEL = 50717
+TAG_AS_SHOT_NEUTRAL = 50728
+
+PHOTOMETRIC_CFA = 32803
+
+# sRGB encoding with a gentle S-curve on top, as a 4096 entry table
+TONE_CURVE_SIZE = 4096
+
+
+def read_ifd(data, offset, endian):
+    """Return ({tag: [values]}, next_ifd_offset) for the IFD at `offset`."""
+    (count,) = struct.unpack_from(endian + 'H', data, offset)
+    tags = {}
+    for i in range(count):
+        entry = offset + 2 + i * 12
+        tag, field_type, value_count = struct.unpack_from(endian + 'HHI', data, entry)
+        if field_type not in TIFF_TYPES:
+            continue
+        fmt, size = TIFF_TYPES[field_type]
+        total = size * value_count
+        value_offset = entry + 8 if total <= 4 else struct.unpack_from(endian + 'I', data, entry + 8)[0]
+        if field_type == 2:
+            tags[tag] = [data[value_offset:value_offset + value_count].rstrip(b'\0').decode('ascii', 'replace')]
+            continue
+        values = struct.unpack_from(endian + fmt * value_count, data, value_offset)
+        if field_type in (5, 10):
+            # Rationals come as numerator/denominator pairs
+            values = [values[j] / values[j + 1] if values[j + 1] else 0.0 for j in range(0, len(values), 2)]
+        tags[tag] = list(values)
+    (next_offset,) = struct.unpack_from(endian + 'I', data, offset + 2 + count * 12)
+    return tags, next_offset
+
+
+def find_raw_ifd(data):
+    """Return (tags of the CFA image IFD, tags of IFD0, endian)."""
+    byte_order = data[:2]
+    if byte_order == b'II':
+        endian = '<'
+    elif byte_order == b'MM':
+        endian = '>'
+    else:
+        raise ValueError("Not a TIFF/DNG file")
+    (offset,) = struct.unpack_from(endian + 'I', data, 4)
+    ifd0 = None
+    pending = []
+    seen = set()
+    while offset and offset not in seen:
+        seen.add(offset)
+        tags, offset = read_ifd(data, offset, endian)
+        ifd0 = ifd0 or tags
+        pending.append(tags)
+    while pending:
+        tags = pending.pop(0)
+        if tags.get(TAG_PHOTOMETRIC, [None])[0] == PHOTOMETRIC_CFA and tags.get(TAG_NEW_SUBFILE_TYPE, [0])[0] == 0:
+            return tags, ifd0, endian
+        for sub_offset in tags.get(TAG_SUB_IFDS, []):
+            if sub_offset not in seen:
+                seen.add(sub_offset)
+                pending.append(read_ifd(data, sub_offset, endian)[0])
+    raise ValueError("No raw CFA image found in DNG")
+
+
+def unpack_rows(packed, width, bits):
+    """Unpack MSB-first bit packed rows (TIFF order) into a uint16 array."""
+    if bits == 12 and width % 2 == 0:
+        groups = packed[:, :width * 3 // 2].reshape(packed.shape[0], width // 2, 3).astype(np.uint16)
+        out = np.empty((packed.shape[0], width), dtype=np.uint16)
+        out[:, 0::2] = (groups[:, :, 0] << 4) | (groups[:, :, 1] >> 4)
+        out[:, 1::2] = ((groups[:, :, 1] & 0x0F) << 8) | groups[:, :, 2]
+        return out
+    # Generic path, a few rows at a time to bound the size of the bit array
+    out = np.empty((packed.shape[0], width), dtype=np.uint16)
+    weights = (1 << np.arange(bits - 1, -1, -1)).astype(np.uint32)
+    for start in range(0, packed.shape[0], 64):
+        chunk = np.unpackbits(packed[start:start + 64], axis=1)[:, :width * bits]
+        out[start:start + 64] = chunk.reshape(chunk.shape[0], width, bits).astype(np.uint32) @ weights
+    return out
+
+
+def decode_block(block, width, height, bits, endian):
+    """Decode one strip set or tile of uncompressed samples into a (height, width) uint16 array."""
+    if bits == 16:
+        return np.frombuffer(block, dtype=endian + 'u2', count=width * height).reshape(height, width).astype(np.uint16)
+    if bits == 8:
+        return np.frombuffer(block, dtype=np.uint8, count=width * height).reshape(height, width).astype(np.uint16)
+    # Every row starts on a byte boundary
+    row_bytes = math.ceil(width * bits / 8)
+    packed = np.frombuffer(block, dtype=np.uint8, count=row_bytes * height).reshape(height, row_bytes)
+    return unpack_rows(packed, width, bits)
+
+
+def read_raw(path):
+    """Read a DNG and return (bayer uint16 array, cfa 2x2 array of 0/1/2, black, white, neutral)."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    tags, ifd0, endian = find_raw_ifd(data)
+    if tags.get(TAG_COMPRESSION, [1])[0] != 1:
+        raise ValueError("Compressed DNG data is not supported")
+    width = tags[TAG_WIDTH][0]
+    height = tags[TAG_HEIGHT][0]
+    bits = tags[TAG_BITS_PER_SAMPLE][0]
+
+    if TAG_TILE_OFFSETS in tags:
+        tile_width = tags[TAG_TILE_WIDTH][0]
+        tile_height = tags[TAG_TILE_LENGTH][0]
+        tiles_across = math.ceil(width / tile_width)
+        bayer = np.empty((math.ceil(height / tile_height) * tile_height, tiles_across * tile_width), dtype=np.uint16)
+        for index, (offset, count) in enumerate(zip(tags[TAG_TILE_OFFSETS], tags[TAG_TILE_BYTE_COUNTS])):
+            y, x = divmod(index, tiles_across)
+            tile = decode_block(data[offset:offset + count], tile_width, tile_height, bits, endian)
+            bayer[y * tile_height:(y + 1) * tile_height, x * tile_width:(x + 1) * tile_width] = tile
+        bayer = bayer[:height, :width]
+    elif TAG_STRIP_OFFSETS in tags:
+        raw_bytes = b''.join(data[offset:offset + count] for offset, count in zip(tags[TAG_STRIP_OFFSETS], tags[TAG_STRIP_BYTE_COUNTS]))
+        bayer = decode_block(raw_bytes, width, height, bits, endian)
+    else:
+        raise ValueError("No image data found in DNG")
+
+    if tags.get(TAG_CFA_REPEAT_PATTERN_DIM, [2, 2])[:2] != [2, 2]:
+        raise ValueError("Only 2x2 CFA patterns are supported")
+    cfa = np.array(tags.get(TAG_CFA_PATTERN, [0, 1, 1, 2])[:4]).reshape(2, 2)
+    black = tags.get(TAG_BLACK_LEVEL) or ifd0.get(TAG_BLACK_LEVEL) or [0]
+    white = tags.get(TAG_WHITE_LEVEL) or ifd0.get(TAG_WHITE_LEVEL) or [(1 << bits) - 1]
+    neutral = tags.get(TAG_AS_SHOT_NEUTRAL) or ifd0.get(TAG_AS_SHOT_NEUTRAL) or [1.0, 1.0, 1.0]
+    return bayer, cfa, float(np.mean(black)), float(white[0]), neutral[:3]
+
+
+def demosaic_superpixel(bayer, cfa):
+    """Half resolution demosaic, every 2x2 block becomes one RGB pixel."""
+    height, width = (bayer.shape[0] // 2) * 2, (bayer.shape[1] // 2) * 2
+    rgb = np.zeros((height // 2, width // 2, 3), dtype=np.float32)
+    counts = [0, 0, 0]
+    for y in range(2):
+        for x in range(2):
+            channel = cfa[y, x]
+            rgb[:, :, channel] += bayer[y:height:2, x:width:2]
+            counts[channel] += 1
+    for channel in range(3):
+        rgb[:, :, channel] /= max(counts[channel], 1)
+    return rgb
+
+
+def demosaic_bilinear(bayer, cfa):
+    """Full resolution bilinear demosaic."""
+    height, width = bayer.shape
+    rgb = np.empty((height, width, 3), dtype=np.float32)
+    for channel in range(3):
+        mask = np.zeros((height, width), dtype=np.float32)
+        for y in range(2):
+            for x in range(2):
+                if cfa[y, x] == channel:
+                    mask[y::2, x::2] = 1.0
+        plane = bayer.astype(np.float32) * mask
+        # Weighted average of the known samples in each 3x3 neighbourhood
+        kernel = np.array([[1, 2, 1], [2, 4, 2], [1, 2, 1]], dtype=np.float32)
+        padded_plane = np.pad(plane, 1, mode='reflect')
+        padded_mask = np.pad(mask, 1, mode='reflect')
+        total = np.zeros((height, width), dtype=np.float32)
+        weight = np.zeros((height, width), dtype=np.float32)
+        for dy in range(3):
+            for dx in range(3):
+                total += kernel[dy, dx] * padded_plane[dy:dy + height, dx:dx + width]
+                weight += kernel[dy, dx] * padded_mask[dy:dy + height, dx:dx + width]
+        rgb[:, :, channel] = np.where(mask > 0, plane, total / np.maximum(weight, 1e-6))
+    return rgb
+
+
+def tone_curve():
+    x = np.linspace(0.0, 1.0, TONE_CURVE_SIZE, dtype=np.float32)
+    srgb = np.where(x <= 0.0031308, 12.92 * x, 1.055 * np.power(x, 1 / 2.4) - 0.055)
+    s_curve = srgb * srgb * (3 - 2 * srgb)
+    return np.clip(0.8 * srgb + 0.2 * s_curve, 0.0, 1.0)
+
+
+def develop(path, full_size=False):
+    """Develop a DNG into an 8 bit RGB PIL image."""
+    bayer, cfa, black, white, neutral = read_raw(path)
+    rgb = demosaic_bilinear(bayer, cfa) if full_size else demosaic_superpixel(bayer, cfa)
+    rgb -= black
+    rgb /= max(white - black, 1.0)
+    # As-shot white balance, neutral is the camera response to grey so the gain is its inverse
+    gains = np.array([neutral[1] / max(n, 1e-6) for n in neutral], dtype=np.float32)
+    rgb *= gains
+    np.clip(rgb, 0.0, 1.0, out=rgb)
+    curve = tone_curve()
+    indices = (rgb * (TONE_CURVE_SIZE - 1)).astype(np.uint16)
+    return Image.fromarray((curve[indices] * 255.0 + 0.5).astype(np.uint8), 'RGB')
+
+
+def develop_dng(path, output_path, full_size=False, max_size=None, image_format='JPEG'):
+    """Develop `path` and save it to `output_path`."""
+    img = develop(path, full_size=full_size)
+    if max_size:
+        img.thumbnail((max_size, max_size), Image.LANCZOS)
+    # Write next to the target and rename, so a cached file is never half written
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    if image_format == 'JPEG':
+        img.save(tmp_path, format='JPEG', quality=92)
+    else:
+        img.save(tmp_path, format=image_format)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+if __name__ == '__main__':
+    # app.py runs each job as `python dng_develop.py <dng> <output> [--full] [--max-size N] [--format F]`
+    import argparse
+    parser = argparse.ArgumentParser(description='Develop a picamera2 DNG into a JPEG or TIFF')
+    parser.add_argument('path')
+    parser.add_argument('output_path')
+    parser.add_argument('--full', action='store_true', help='Full resolution bilinear demosaic')
+    parser.add_argument('--max-size', type=int, default=None)
+    parser.add_argument('--format', default='JPEG')
+    args = parser.parse_args()
+    develop_dng(args.path, args.output_path, full_size=args.full, max_size=args.max_size, image_format=args.format)
@@ -0,0 +1,739 @@
+"""
+Simulated picamera2 backend, for running CamUI without a Raspberry Pi camera.
+
+Provides stand-ins for the parts of picamera2 and libcamera that app.py uses
+(Picamera2, MJPEGEncoder, JpegEncoder, FileOutput, Transform and controls), so
+the whole web app, streaming and capture included, runs and can be load tested
+on any Linux machine. app.py imports this module in place of picamera2 when
+started with --camera-backend sim or CAMUI_CAMERA_BACKEND=sim.
+
+Each simulated camera runs its own frame loop at the rate the sensor mode and
+FrameDurationLimits allow. It produces metadata from a simple auto exposure and
+white balance model, calls post_callback for every request and MJPEG-encodes
+synthetic frames for the recording output. Sensor modes, control ranges and
+capture timing follow the real sensors. Stills come back as BGR888 buffers and
+raw Bayer data that save_dng() writes as an uncompressed DNG dng_develop.py can
+read.
+
+Settings, also taken from the environment:
+    CAMUI_SIM_CAMERAS  comma separated sensor models, default "imx708"
+    CAMUI_SIM_FPS      upper limit for the frame rate of every camera
+    CAMUI_SIM_TIMING   scale for the simulated hardware delays (0 makes
+                       mode switches and captures instant), default 1
+
+Only depends on NumPy and PIL.
+"""
+import io
+import math
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+# Sensor models with their modes: (width, height, fps, bit depth). Control limits and the Bayer order
+# follow what picamera2 reports for each sensor.
+SENSORS = {
+    "ov5647": {"modes": [(640, 480, 58.92, 10), (1296, 972, 43.25, 10), (1920, 1080, 30.62, 10), (2592, 1944, 15.63, 10)],
+               "bayer": "GBRG", "max_gain": 63.9375, "max_exposure": 0.97, "autofocus": False, "unit_cell": (1400, 1400)},
+    "imx219": {"modes": [(640, 480, 103.33, 10), (1640, 1232, 41.85, 10), (1920, 1080, 47.57, 10), (3280, 2464, 21.19, 10)],
+               "bayer": "BGGR", "max_gain": 10.666, "max_exposure": 11.76, "autofocus": False, "unit_cell": (1120, 1120)},
+    "imx708": {"modes": [(1536, 864, 120.13, 10), (2304, 1296, 56.03, 10), (4608, 2592, 14.35, 10)],
+               "bayer": "BGGR", "max_gain": 16.0, "max_exposure": 112.0, "autofocus": True, "unit_cell": (1400, 1400)},
+    "imx477": {"modes": [(1332, 990, 120.05, 10), (2028, 1080, 50.03, 12), (2028, 1520, 40.01, 12), (4056, 3040, 10.0, 12)],
+               "bayer": "BGGR", "max_gain": 22.2608, "max_exposure": 670.74, "autofocus": False, "unit_cell": (1550, 1550)},
+    "imx296": {"modes": [(1456, 1088, 60.38, 10)],
+               "bayer": "RGGB", "max_gain": 251.188, "max_exposure": 15.5, "autofocus": False, "unit_cell": (3450, 3450)},
+    "imx500": {"modes": [(2028, 1520, 30.02, 10), (4056, 3040, 10.0, 10)],
+               "bayer": "RGGB", "max_gain": 22.2608, "max_exposure": 112.0, "autofocus": False, "unit_cell": (1550, 1550)},
+}
+
+# Bayer order -> CFA colour (0 red, 1 green, 2 blue) of each pixel in the 2x2 tile
+CFA_PATTERNS = {"RGGB": (0, 1, 1, 2), "GRBG": (1, 0, 2, 1), "GBRG": (1, 2, 0, 1), "BGGR": (2, 1, 1, 0)}
+
+# Controls every simulated sensor advertises: (min, max, default)
+COMMON_CONTROLS = {
+    "AeEnable": (False, True, None),
+    "AeMeteringMode": (0, 3, 0),
+    "AeConstraintMode": (0, 3, 0),
+    "AeExposureMode": (0, 3, 0),
+    "AeFlickerMode": (0, 1, 0),
+    "AeFlickerPeriod": (100, 1000000, None),
+    "ExposureValue": (-8.0, 8.0, 0.0),
+    "AwbEnable": (False, True, None),
+    "AwbMode": (0, 7, 0),
+    "ColourGains": (0.0, 32.0, None),
+    "ColourTemperature": (100, 100000, None),
+    "Brightness": (-1.0, 1.0, 0.0),
+    "Contrast": (0.0, 32.0, 1.0),
+    "Saturation": (0.0, 32.0, 1.0),
+    "Sharpness": (0.0, 16.0, 1.0),
+    "NoiseReductionMode": (0, 4, 0),
+    "StatsOutputEnable": (False, True, False),
+}
+
+AUTOFOCUS_CONTROLS = {
+    "AfMode": (0, 2, 0),
+    "AfRange": (0, 2, 0),
+    "AfSpeed": (0, 1, 0),
+    "AfMetering": (0, 1, 0),
+    "AfTrigger": (0, 1, 0),
+    "AfPause": (0, 2, 0),
+    "LensPosition": (0.0, 15.0, 1.0),
+}
+
+# Synthetic stream frames are rendered at most this wide, larger streams are upscaled by
+# nobody and would only cost the simulator CPU time
+MAX_STREAM_WIDTH = 1920
+
+settings = {
+    "cameras": os.environ.get("CAMUI_SIM_CAMERAS", "imx708"),
+    "fps": float(os.environ["CAMUI_SIM_FPS"]) if os.environ.get("CAMUI_SIM_FPS") else None,
+    "timing": float(os.environ.get("CAMUI_SIM_TIMING", 1.0)),
+}
+
+
+def configure(cameras=None, fps=None, timing=None):
+    """Override the environment settings, before any camera is opened."""
+    if cameras is not None:
+        settings["cameras"] = cameras
+    if fps is not None:
+        settings["fps"] = fps
+    if timing is not None:
+        settings["timing"] = timing
+
+
+def hardware_delay(seconds):
+    """Sleep for a simulated hardware operation, scaled by the timing setting."""
+    if seconds > 0 and settings["timing"] > 0:
+        time.sleep(seconds * settings["timing"])
+
+
+def sensor_for(model):
+    """Sensor description for a model, variants such as imx708_wide_noir use their base sensor."""
+    for name in sorted(SENSORS, key=len, reverse=True):
+        if model.startswith(name):
+            return SENSORS[name]
+    raise ValueError(f"Unknown simulated sensor model: {model}")
+
+
+def camera_models():
+    return [model.strip() for model in settings["cameras"].split(",") if model.strip()]
+
+
+def global_camera_info():
+    """Connected cameras in the format Picamera2.global_camera_info() returns."""
+    cameras = []
+    for num, model in enumerate(camera_models()):
+        sensor_for(model)  # Fail early on a typo
+        cameras.append({"Model": model, "Location": 2, "Rotation": 180 if model.startswith("imx708") else 0,
+                        "Id": f"/base/axi/pcie@120000/rp1/i2c@{88000 + num * 32768:x}/{model}@1a", "Num": num})
+    return cameras
+
+
+class Transform:
+    """Stand-in for libcamera.Transform."""
+    def __init__(self, hflip=False, vflip=False, transpose=False):
+        self.hflip = bool(hflip)
+        self.vflip = bool(vflip)
+        self.transpose = bool(transpose)
+
+    def __repr__(self):
+        return f"<libcamera.Transform '{'h' if self.hflip else ''}{'v' if self.vflip else ''}{'t' if self.transpose else ''}' (simulated)>"
+
+
+class controls:
+    """Stand-in for the libcamera.controls enums."""
+    class AfModeEnum:
+        Manual, Auto, Continuous = 0, 1, 2
+
+    class AfRangeEnum:
+        Normal, Macro, Full = 0, 1, 2
+
+    class AfSpeedEnum:
+        Normal, Fast = 0, 1
+
+    class AwbModeEnum:
+        Auto, Incandescent, Tungsten, Fluorescent, Indoor, Daylight, Cloudy, Custom = range(8)
+
+    class AeExposureModeEnum:
+        Normal, Short, Long, Custom = range(4)
+
+    class draft:
+        class NoiseReductionModeEnum:
+            Off, Fast, HighQuality, Minimal, ZSL = range(5)
+
+
+class JpegEncoder:
+    def __init__(self, num_threads=4, q=None, colour_space=None, colour_subsampling='420'):
+        self.q = q or 85
+
+
+class MJPEGEncoder:
+    def __init__(self, bitrate=None):
+        self.bitrate = bitrate
+        # Roughly the quality the hardware encoder gives at its default bitrate
+        self.q = 80
+
+
+class FileOutput:
+    """Stand-in for picamera2.outputs.FileOutput, writes each encoded frame to `file`."""
+    def __init__(self, file=None, pts=None, split=None):
+        self.file = file
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        if self.file is not None:
+            self.file.write(frame)
+
+
+class SceneRenderer:
+    """Synthetic test scene: colour bars over a gradient with a marker that moves with time.
+
+    The static part is rendered once per size. Each frame copies it, draws the moving
+    marker and a caption, and applies the configured flips.
+    """
+    BARS = [(192, 192, 192), (192, 192, 0), (0, 192, 192), (0, 192, 0), (192, 0, 192), (192, 0, 0), (0, 0, 192)]
+
+    def __init__(self, caption):
+        self.caption = caption
+        self.backgrounds = {}
+
+    def background(self, size):
+        image = self.backgrounds.get(size)
+        if image is None:
+            width, height = size
+            ramp = np.linspace(16, 235, width, dtype=np.float32)
+            rows = np.linspace(0.6, 1.0, height, dtype=np.float32)[:, None]
+            grey = (ramp[None, :] * rows).astype(np.uint8)
+            array = np.repeat(grey[:, :, None], 3, axis=2)
+            bar_height = height * 2 // 3
+            bar_width = max(width // len(self.BARS), 1)
+            for i, colour in enumerate(self.BARS):
+                array[:bar_height, i * bar_width:(i + 1) * bar_width] = colour
+            image = Image.fromarray(array, "RGB")
+            self.backgrounds = {size: image}  # Only the current size is worth keeping
+        return image
+
+    def render(self, size, t, frame_number, transform=None):
+        image = self.background(size).copy()
+        width, height = size
+        draw = ImageDraw.Draw(image)
+        radius = max(min(width, height) // 12, 2)
+        x = int((math.sin(t * 0.8) * 0.4 + 0.5) * width)
+        y = int(height * 5 // 6)
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=(240, 240, 240))
+        draw.text((8, 8), f"{self.caption}  #{frame_number}  {datetime.now().strftime('%H:%M:%S.%f')[:-3]}", fill=(255, 255, 255))
+        if transform is not None:
+            if transform.hflip:
+                image = image.transpose(Image.FLIP_LEFT_RIGHT)
+            if transform.vflip:
+                image = image.transpose(Image.FLIP_TOP_BOTTOM)
+        return image
+
+
+class Helpers:
+    """Stand-in for Picamera2.helpers."""
+    def __init__(self, picam2):
+        self.picam2 = picam2
+
+    def make_array(self, buffer, config):
+        return buffer
+
+    def make_image(self, buffer, config, width=None, height=None):
+        # BGR888 buffers hold the pixels in B, G, R order
+        return Image.fromarray(np.ascontiguousarray(buffer[:, :, ::-1]), "RGB")
+
+    def save(self, img, metadata, file_output, format=None, exif_data=None):
+        exif = Image.Exif()
+        exif[0x010F] = "Raspberry Pi"
+        exif[0x0110] = self.picam2.camera_properties["Model"]
+        exif[0x0132] = datetime.now().strftime("%Y:%m:%d %H:%M:%S")
+        img.save(file_output, format=format, quality=90, exif=exif)
+
+    def save_dng(self, buffer, metadata, config, filename):
+        write_dng(filename, buffer, config, metadata, self.picam2.camera_properties["Model"])
+
+
+def write_dng(path, bayer, raw_config, metadata, model):
+    """Write a uint16 Bayer array as a single IFD, uncompressed, 16 bit DNG."""
+    height, width = bayer.shape
+    # Raw formats are named like SBGGR10_CSI2P
+    bayer_order = raw_config["format"][1:5]
+    bit_depth = int(raw_config["format"][5:].split("_")[0])
+    black = metadata.get("SensorBlackLevels", (4096,))[0] >> (16 - bit_depth)
+    red_gain, blue_gain = metadata.get("ColourGains", (1.0, 1.0))
+    model_bytes = model.encode("ascii") + b"\0"
+    data = bayer.astype("<u2").tobytes()
+
+    # (tag, type, values); types: 1 BYTE, 2 ASCII, 3 SHORT, 4 LONG, 5 RATIONAL
+    entries = [
+        (254, 4, [0]), (256, 4, [width]), (257, 4, [height]), (258, 3, [16]), (259, 3, [1]),
+        (262, 3, [32803]), (273, 4, [0]), (277, 3, [1]), (278, 4, [height]), (279, 4, [len(data)]),
+        (284, 3, [1]), (33421, 3, [2, 2]), (33422, 1, list(CFA_PATTERNS[bayer_order])),
+        (50706, 1, [1, 4, 0, 0]), (50708, 2, model_bytes), (50714, 4, [black]),
+        (50717, 4, [(1 << bit_depth) - 1]),
+        (50728, 5, [(10000, round(10000 * red_gain)), (10000, 10000), (10000, round(10000 * blue_gain))]),
+    ]
+    formats = {1: "B", 2: "s", 3: "H", 4: "I"}
+    ifd_offset = 8
+    extra_offset = ifd_offset + 2 + len(entries) * 12 + 4
+    # Values that don't fit in the entry go after the IFD, then the image data
+    extra = b""
+    packed_entries = []
+    for tag, field_type, values in entries:
+        if field_type == 5:
+            payload = b"".join(struct.pack("<II", n, d) for n, d in values)
+            count = len(values)
+        elif field_type == 2:
+            payload = values
+            count = len(values)
+        else:
+            payload = struct.pack("<" + formats[field_type] * len(values), *values)
+            count = len(values)
+        packed_entries.append([tag, field_type, count, payload])
+    for entry in packed_entries:
+        payload = entry[3]
+        if len(payload) > 4:
+            entry[3] = struct.pack("<I", extra_offset + len(extra))
+            extra += payload + (b"\0" if len(payload) % 2 else b"")
+        else:
+            entry[3] = payload.ljust(4, b"\0")
+    data_offset = extra_offset + len(extra)
+    with open(path, "wb") as f:
+        f.write(b"II" + struct.pack("<HI", 42, ifd_offset))
+        f.write(struct.pack("<H", len(packed_entries)))
+        for tag, field_type, count, value in packed_entries:
+            if tag == 273:
+                value = struct.pack("<I", data_offset)
+            f.write(struct.pack("<HHI", tag, field_type, count) + value)
+        f.write(struct.pack("<I", 0))
+        f.write(extra)
+        f.write(data)
+
+
+class CompletedRequest:
+    """Stand-in for picamera2's CompletedRequest. Images are rendered on demand."""
+    def __init__(self, picam2, metadata, frame_number, t):
+        self.picam2 = picam2
+        self.metadata = metadata
+        self.frame_number = frame_number
+        self.t = t
+        self.config = picam2.camera_config
+
+    def get_metadata(self):
+        return dict(self.metadata)
+
+    def make_array(self, name="main"):
+        size = self.config[name]["size"]
+        image = self.picam2.renderer.render(size, self.t, self.frame_number, self.config.get("transform"))
+        return np.asarray(image)[:, :, ::-1]
+
+    def make_image(self, name="main", width=None, height=None):
+        return self.picam2.helpers.make_image(self.make_array(name), self.config[name])
+
+    def save(self, name, file_output, format=None, exif_data=None):
+        self.picam2.helpers.save(self.make_image(name), self.metadata, file_output, format=format)
+
+    def release(self):
+        pass
+
+
+class Picamera2:
+    """Simulated Picamera2 with the subset of the API CamUI uses."""
+
+    @staticmethod
+    def global_camera_info():
+        return global_camera_info()
+
+    @staticmethod
+    def set_logging(level=None, output=None, msg=None):
+        pass
+
+    def __init__(self, camera_num=0):
+        info = global_camera_info()[camera_num]
+        hardware_delay(0.15)
+        self.camera_num = camera_num
+        self.sensor = sensor_for(info["Model"])
+        largest = max(self.sensor["modes"], key=lambda mode: mode[0] * mode[1])
+        self.sensor_resolution = largest[:2]
+        self.camera_properties = {
+            "Model": info["Model"], "Location": info["Location"], "Rotation": info["Rotation"],
+            "PixelArraySize": self.sensor_resolution, "PixelArrayActiveAreas": [(0, 0, *self.sensor_resolution)],
+            "UnitCellSize": self.sensor["unit_cell"], "ColorFilterArrangement": list(CFA_PATTERNS).index(self.sensor["bayer"]),
+            "SystemDevices": (20749, 20737, 20738, 20739), "ScalerCropMaximum": (0, 0, *self.sensor_resolution),
+        }
+        self.sensor_modes = [self.make_sensor_mode(*mode) for mode in self.sensor["modes"]]
+        self.camera_controls = self.make_camera_controls()
+        # Control values set through set_controls or a configuration
+        self.controls = {}
+        self.helpers = Helpers(self)
+        self.renderer = SceneRenderer(f"CamUI simulated {info['Model']} (camera {camera_num})")
+        self.post_callback = None
+        self.camera_config = None
+        self.mode = None
+        self.started = False
+        self.closed = False
+        self.encoder = None
+        self.output = None
+        self.frame_number = 0
+        self.request_condition = threading.Condition()
+        self.latest_request = None
+        self.stop_event = threading.Event()
+        self.frame_thread = None
+        # Injected fault, see inject_fault()
+        self.fault = None
+        self.fault_sticky = False
+        self.closed_event = threading.Event()  # Releases calls blocked by a "hang" fault
+        # State of the simulated auto exposure and white balance
+        self.scene_start = time.monotonic()
+
+    def make_sensor_mode(self, width, height, fps, bit_depth):
+        full_width, full_height = self.sensor_resolution
+        # Binned modes cover the whole sensor, smaller modes are a centred crop of it
+        scale = min(full_width // width, full_height // height) or 1
+        crop = (width * scale, height * scale)
+        crop_limits = ((full_width - crop[0]) // 2, (full_height - crop[1]) // 2, *crop)
+        return {
+            "format": f"S{self.sensor['bayer']}{bit_depth}_CSI2P", "unpacked": f"S{self.sensor['bayer']}{bit_depth}",
+            "bit_depth": bit_depth, "size": (width, height), "fps": fps, "crop_limits": crop_limits,
+            "exposure_limits": (max(int(4e6 / fps / height), 1), int(self.sensor["max_exposure"] * 1e6), None),
+        }
+
+    def make_camera_controls(self):
+        fastest = max(mode["fps"] for mode in self.sensor_modes)
+        max_exposure = int(self.sensor["max_exposure"] * 1e6)
+        camera_controls = dict(COMMON_CONTROLS)
+        camera_controls.update({
+            "ExposureTime": (min(mode["exposure_limits"][0] for mode in self.sensor_modes), max_exposure, 20000),
+            "AnalogueGain": (1.0, self.sensor["max_gain"], None),
+            "FrameDurationLimits": (int(1e6 / fastest), max_exposure + 10000, 33333),
+            "ScalerCrop": ((0, 0, 64, 64), (0, 0, *self.sensor_resolution), (0, 0, *self.sensor_resolution)),
+        })
+        if self.sensor["autofocus"]:
+            camera_controls.update(AUTOFOCUS_CONTROLS)
+        return camera_controls
+
+    #-----
+    # Configuration
+    #-----
+
+    def pick_mode(self, config):
+        """The sensor mode a configuration runs in, like picamera2 picks it."""
+        sensor = config.get("sensor") or {}
+        if sensor.get("output_size"):
+            for mode in self.sensor_modes:
+                if tuple(mode["size"]) == tuple(sensor["output_size"]) and mode["bit_depth"] == sensor.get("bit_depth", mode["bit_depth"]):
+                    return mode
+        width, height = (config.get("raw") or {}).get("size") or config["main"]["size"]
+        # The smallest mode at least as large as requested, or else the largest one
+        fitting = [mode for mode in self.sensor_modes if mode["size"][0] >= width and mode["size"][1] >= height]
+        if fitting:
+            return min(fitting, key=lambda mode: mode["size"][0] * mode["size"][1])
+        return max(self.sensor_modes, key=lambda mode: mode["size"][0] * mode["size"][1])
+
+    def make_configuration(self, use_case, main, raw, sensor, transform, buffer_count, controls_override, default_size, default_controls):
+        main = {"format": "BGR888" if use_case == "still" else "XBGR8888", "size": default_size, **(main or {})}
+        config = {
+            "use_case": use_case, "transform": transform or Transform(), "colour_space": "sYCC" if use_case == "still" else "Rec709",
+            "buffer_count": buffer_count, "queue": True, "main": main, "lores": None,
+            "raw": dict(raw or {}), "controls": {**default_controls, **(controls_override or {})},
+            "sensor": dict(sensor or {}), "display": None if use_case == "still" else "main",
+            "encode": None if use_case == "still" else "main",
+        }
+        mode = self.pick_mode(config)
+        config["raw"] = {"format": mode["format"], "size": mode["size"], **config["raw"]}
+        return config
+
+    def create_still_configuration(self, main={}, lores=None, raw={}, transform=None, colour_space=None,
+                                   buffer_count=1, controls={}, display=None, encode=None, queue=True, sensor={}):
+        return self.make_configuration("still", main, raw, sensor, transform, buffer_count, controls, self.sensor_resolution,
+                                       {"NoiseReductionMode": 2, "FrameDurationLimits": (100, 1000000000)})
+
+    def create_video_configuration(self, main={}, lores=None, raw={}, transform=None, colour_space=None,
+                                   buffer_count=6, controls={}, display="main", encode="main", queue=True, sensor={}):
+        return self.make_configuration("video", main, raw, sensor, transform, buffer_count, controls, (1280, 720),
+                                       {"NoiseReductionMode": 1, "FrameDurationLimits": (33333, 33333)})
+
+    def create_preview_configuration(self, main={}, **kwargs):
+        return self.create_video_configuration(main={"size": (640, 480), **(main or {})}, **kwargs)
+
+    def configure(self, camera_config=None):
+        if self.started:
+            raise RuntimeError("Camera must be stopped before configuring")
+        if camera_config is None:
+            camera_config = self.create_preview_configuration()
+        if isinstance(camera_config, str):
+            camera_config = getattr(self, f"create_{camera_config}_configuration")()
+        self.mode = self.pick_mode(camera_config)
+        camera_config["sensor"] = {"output_size": self.mode["size"], "bit_depth": self.mode["bit_depth"]}
+        camera_config["raw"] = {**camera_config.get("raw", {}), "format": self.mode["format"], "size": self.mode["size"]}
+        hardware_delay(0.05)
+        self.camera_config = camera_config
+        self.controls.update(camera_config.get("controls") or {})
+
+    def camera_configuration(self):
+        return self.camera_config
+
+    def stream_configuration(self, name="main"):
+        if self.camera_config is None:
+            return None
+        return self.camera_config.get(name)
+
+    #-----
+    # Controls and metadata
+    #-----
+
+    def set_controls(self, new_controls):
+        for name in new_controls:
+            if name not in self.camera_controls:
+                raise RuntimeError(f"Control {name} is not advertised by libcamera")
+        self.controls.update(new_controls)
+
+    def frame_duration(self):
+        """Seconds per frame in the current mode and FrameDurationLimits."""
+        minimum = 1.0 / self.mode["fps"]
+        limits = self.controls.get("FrameDurationLimits")
+        if limits:
+            minimum = max(minimum, limits[0] / 1e6)
+        if settings["fps"]:
+            minimum = max(minimum, 1.0 / settings["fps"])
+        exposure = self.controls.get("ExposureTime") if self.manual_exposure() else None
+        return max(minimum, (exposure or 0) / 1e6)
+
+    def manual_exposure(self):
+        # As with libcamera, a fixed ExposureTime takes the exposure out of the AE loop
+        return self.controls.get("AeEnable") is False or bool(self.controls.get("ExposureTime"))
+
+    def make_metadata(self, t, duration):
+        """Per frame metadata. Scene brightness drifts slowly, auto exposure and white balance follow it."""
+        elapsed = t - self.scene_start
+        lux = 400.0 * (1.0 + 0.5 * math.sin(elapsed / 20.0))
+        ev = self.controls.get("ExposureValue", 0.0)
+        # Target exposure x gain ~ 8e6 / lux, exposure first, capped by the frame duration
+        target = 8e6 / lux * (2.0 ** ev)
+        if self.manual_exposure():
+            exposure = int(self.controls.get("ExposureTime") or 20000)
+        else:
+            exposure = int(min(target, duration * 1e6 * 0.95))
+        if self.controls.get("AnalogueGain"):
+            gain = float(self.controls["AnalogueGain"])
+        else:
+            gain = min(max(target / max(exposure, 1), 1.0), self.sensor["max_gain"])
+        if self.controls.get("AwbEnable", True) is False and self.controls.get("ColourGains"):
+            red_gain, blue_gain = self.controls["ColourGains"]
+            colour_temperature = int(self.controls.get("ColourTemperature") or 5000)
+        else:
+            colour_temperature = int(5000 + 600 * math.sin(elapsed / 33.0))
+            red_gain = 1.2 + colour_temperature / 5000.0 * 0.8
+            blue_gain = 3.4 - colour_temperature / 5000.0 * 1.2
+        metadata = {
+            "SensorTimestamp": int(t * 1e9),
+            "ExposureTime": exposure,
+            "AnalogueGain": round(gain, 4),
+            "DigitalGain": 1.0,
+            "ColourGains": (round(red_gain, 4), round(blue_gain, 4)),
+            "ColourTemperature": colour_temperature,
+            "Lux": round(lux, 2),
+            "FrameDuration": int(duration * 1e6),
+            "SensorBlackLevels": (4096, 4096, 4096, 4096),
+            "SensorTemperature": 38.0 + 4.0 * min(elapsed / 600.0, 1.0),
+            "AeLocked": True,
+            "FocusFoM": 1200 + int(200 * math.sin(elapsed)),
+            "ScalerCrop": self.mode["crop_limits"],
+            "ColourCorrectionMatrix": (1.7, -0.5, -0.2, -0.4, 1.8, -0.4, -0.1, -0.6, 1.7),
+            "NoiseReductionMode": self.controls.get("NoiseReductionMode", 0),
+        }
+        for name in ("Brightness", "Contrast", "Saturation", "Sharpness", "ExposureValue", "AeExposureMode",
+                     "AeMeteringMode", "AeConstraintMode", "AwbMode"):
+            if name in self.controls:
+                metadata[name] = self.controls[name]
+        if self.sensor["autofocus"]:
+            metadata["LensPosition"] = float(self.controls.get("LensPosition", 1.0))
+            metadata["AfState"] = 2 if self.controls.get("AfMode", 0) else 0
+            metadata["AfPauseState"] = 0
+        return metadata
+
+    def wait_request(self, timeout=5.0):
+        """The next completed request, like waiting for a frame from the camera."""
+        if not self.started:
+            raise RuntimeError("Camera is not running")
+        with self.request_condition:
+            previous = self.latest_request
+            if not self.request_condition.wait_for(lambda: self.latest_request is not previous or not self.started, timeout=timeout):
+                raise TimeoutError("Timed out waiting for a frame from the simulated camera")
+            if not self.started:
+                raise RuntimeError("Camera stopped while waiting for a frame")
+            return self.latest_request
+
+    def capture_metadata(self, wait=None):
+        return self.wait_request().get_metadata()
+
+    def capture_request(self, wait=None, flush=None):
+        return self.wait_request()
+
+    def capture_array(self, name="main", wait=None):
+        return self.wait_request().make_array(name)
+
+    #-----
+    # Running the camera
+    #-----
+
+    def frame_loop(self):
+        next_frame = time.monotonic()
+        while not self.stop_event.is_set():
+            duration = self.frame_duration()
+            next_frame += duration
+            delay = next_frame - time.monotonic()
+            if delay > 0:
+                if self.stop_event.wait(delay):
+                    break
+            else:
+                # Running late (slow JPEG encoding or an overloaded machine), drop frames like the camera would
+                next_frame = time.monotonic()
+            if self.fault == "stall":
+                continue
+            t = time.monotonic()
+            self.frame_number += 1
+            request = CompletedRequest(self, self.make_metadata(t, duration), self.frame_number, t)
+            if self.post_callback is not None:
+                try:
+                    self.post_callback(request)
+                except Exception:
+                    pass  # picamera2 would log this and carry on
+            with self.request_condition:
+                self.latest_request = request
+                self.request_condition.notify_all()
+            encoder, output = self.encoder, self.output
+            if encoder is not None and output is not None and self.fault != "encoder":
+                output.outputframe(self.encode_frame(request, encoder), keyframe=True, timestamp=int(t * 1e6))
+
+    def encode_frame(self, request, encoder):
+        width, height = request.config["main"]["size"]
+        if width > MAX_STREAM_WIDTH:
+            width, height = MAX_STREAM_WIDTH, max(int(height * MAX_STREAM_WIDTH / width), 1)
+        image = self.renderer.render((width, height), request.t, request.frame_number, request.config.get("transform"))
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=encoder.q)
+        return buffer.getvalue()
+
+    def start(self, config=None, show_preview=False):
+        if config is not None:
+            self.configure(config)
+        if self.started:
+            return
+        if self.camera_config is None:
+            self.configure(self.create_preview_configuration())
+        hardware_delay(0.03)
+        if not self.fault_sticky:
+            self.fault = None
+        self.started = True
+        self.stop_event.clear()
+        self.frame_thread = threading.Thread(target=self.frame_loop, name=f"sim-camera-{self.camera_num}", daemon=True)
+        self.frame_thread.start()
+
+    def stop(self):
+        if not self.started:
+            return
+        self.stop_event.set()
+        if self.frame_thread is not None and self.frame_thread is not threading.current_thread():
+            self.frame_thread.join()
+        self.frame_thread = None
+        with self.request_condition:
+            self.started = False
+            self.request_condition.notify_all()
+        hardware_delay(0.02)
+
+    def start_recording(self, encoder, output, pts=None, config=None, quality=None, name=None):
+        if config is not None:
+            self.configure(config)
+        self.encoder = encoder
+        self.output = output
+        self.start()
+
+    def stop_recording(self):
+        self.hang_if_faulted()
+        self.stop()
+        self.encoder = None
+        self.output = None
+
+    def close(self):
+        self.stop()
+        self.closed = True
+        self.closed_event.set()
+
+    def inject_fault(self, kind, sticky=False):
+        """Break the running pipeline the way real cameras occasionally do, to exercise CamUI's watchdog.
+
+        "stall" stops requests arriving, "encoder" keeps requests coming but stops the
+        MJPEG frames and None clears the fault. A fault lasts until the camera is started
+        again, or with `sticky` until it is closed and opened again. "hang" makes the next
+        still capture or stop_recording() block like a wedged libcamera call, until the
+        camera is closed.
+        """
+        if kind not in (None, "stall", "encoder", "hang"):
+            raise ValueError(f"Unknown fault {kind!r}")
+        self.fault = kind
+        self.fault_sticky = sticky and kind is not None
+
+    #-----
+    # Still capture
+    #-----
+
+    def hang_if_faulted(self):
+        if self.fault != "hang":
+            return
+        self.fault = None  # Only the call that hit the fault hangs
+        self.closed_event.wait()
+        raise RuntimeError("Camera closed while a request was pending")
+
+    def capture_raw_bayer(self, request):
+        """Mosaic the rendered scene into linear sensor values at the raw size."""
+        raw = self.camera_config["raw"]
+        width, height = raw["size"]
+        image = self.renderer.render((width, height), request.t, request.frame_number, self.camera_config.get("transform"))
+        linear = (np.asarray(image, dtype=np.float32) / 255.0) ** 2.2
+        bit_depth = self.mode["bit_depth"]
+        black = 4096 >> (16 - bit_depth)
+        white = (1 << bit_depth) - 1
+        red_gain, blue_gain = request.metadata["ColourGains"]
+        linear[:, :, 0] /= red_gain
+        linear[:, :, 2] /= blue_gain
+        pattern = CFA_PATTERNS[self.sensor["bayer"]]
+        bayer = np.empty((height, width), dtype=np.uint16)
+        for index, channel in enumerate(pattern):
+            y, x = divmod(index, 2)
+            bayer[y::2, x::2] = (black + linear[y::2, x::2, channel] * (white - black)).astype(np.uint16)
+        return bayer
+
+    def switch_mode_and_capture_buffers(self, camera_config, names=["main"], wait=None, signal_function=None, delay=0):
+        """Switch to `camera_config`, capture one request and switch back, leaving the camera running."""
+        self.hang_if_faulted()
+        previous_config = self.camera_config
+        self.stop()
+        self.configure(camera_config)
+        self.start()
+        # The pipeline needs a few frames to settle in the new mode before the capture
+        for _ in range(3 + delay):
+            request = self.wait_request(timeout=5.0 + self.frame_duration() * 2)
+        # Processing the full resolution frame
+        hardware_delay(0.05 * camera_config["main"]["size"][0] * camera_config["main"]["size"][1] / 12e6)
+        buffers = []
+        for name in names:
+            if name == "raw":
+                buffers.append(self.capture_raw_bayer(request))
+            else:
+                buffers.append(request.make_array(name))
+        metadata = request.get_metadata()
+        self.stop()
+        if previous_config is not None:
+            self.configure(previous_config)
+        self.start()
+        return buffers, metadata
+
+    def switch_mode_and_capture_file(self, camera_config, file_output, name="main", format=None, wait=None, signal_function=None, delay=0, exif_data=None):
+        (buffer,), metadata = self.switch_mode_and_capture_buffers(camera_config, [name], delay=delay)
+        self.helpers.save(self.helpers.make_image(buffer, camera_config[name]), metadata, file_output, format=format)
+        return metadata
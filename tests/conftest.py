@@ -0,0 +1,38 @@
+import importlib
+import os
+import shutil
+import sys
+import time
+
+import pytest
+
+current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IGNORED_PATHS = shutil.ignore_patterns(".git", "__pycache__", "cache", "tests", "storage-sinks.json", "retention-policy.json", "benchmark-*.json")
+
+
+@pytest.fixture(scope="session")
+def camui(tmp_path_factory):
+    """The app module, imported from a copy of the repo with the simulated cameras.
+
+    Importing app.py probes the cameras and rewrites camera-last-config.json, so like
+    benchmark.py it runs in a temporary directory and the real config is never touched.
+    """
+    workdir = str(tmp_path_factory.mktemp("camui") / "app")
+    shutil.copytree(current_dir, workdir, ignore=IGNORED_PATHS)
+    os.environ["CAMUI_CAMERA_BACKEND"] = "sim"
+    os.environ.setdefault("CAMUI_LOG_LEVEL", "warning")
+    sys.path.insert(0, workdir)
+    try:
+        return importlib.import_module("app")
+    finally:
+        sys.path.remove(workdir)
+
+
+@pytest.fixture
+def camera(camui):
+    """The first simulated camera, once its background initialization has finished."""
+    deadline = time.monotonic() + 30
+    while not camui.cameras:
+        assert time.monotonic() < deadline, camui.camera_states
+        time.sleep(0.1)
+    return camui.cameras[min(camui.cameras)]
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("a2wsgi")
+
+
+def http_scope(path, method="GET", query=b""):
+    return {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+            "path": path, "raw_path": path.encode(), "root_path": "", "query_string": query, "headers": [],
+            "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 8080)}
+
+
+def run(frontend, scope, messages, stop_after=None):
+    """Call the frontend with `messages` as the request, returns what it sent.
+
+    With `stop_after` the client disconnects once that many body chunks arrived.
+    """
+    sent = []
+
+    async def main():
+        gone = asyncio.Event()
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await gone.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+            if stop_after is not None and sum(m["type"] == "http.response.body" for m in sent) >= stop_after:
+                gone.set()
+        await asyncio.wait_for(frontend(scope, receive, send), 10)
+    asyncio.run(main())
+    return sent
+
+
+def test_request_and_response_bodies_are_streamed(camui):
+    def echo(environ, start_response):
+        body = environ["wsgi.input"].read()
+        start_response("201 Created", [("Content-Type", "text/plain"), ("X-Length", str(len(body)))])
+        yield b"got "
+        yield body
+        yield b"!"
+
+    sent = run(camui.AsyncFrontend(echo), http_scope("/upload", "POST"), [
+        {"type": "http.request", "body": b"hello ", "more_body": True},
+        {"type": "http.request", "body": b"world", "more_body": False},
+    ])
+    assert sent[0]["type"] == "http.response.start" and sent[0]["status"] == 201
+    assert (b"x-length", b"11") in sent[0]["headers"]
+    assert b"".join(message.get("body", b"") for message in sent[1:]) == b"got hello world!"
+    assert sent[-1].get("more_body", False) is False
+
+
+def test_generating_stops_when_the_client_disconnects(camui):
+    produced = []
+    closed = threading.Event()
+
+    def endless(environ, start_response):
+        start_response("200 OK", [("Content-Type", "application/zip")])
+        try:
+            while True:
+                produced.append(len(produced))
+                yield b"x" * 1024
+        finally:
+            closed.set()
+
+    run(camui.AsyncFrontend(endless), http_scope("/download_zip"), [{"type": "http.request", "body": b""}], stop_after=3)
+    assert closed.wait(5)
+    # The send queue lets the generator run a few chunks ahead, but not on forever
+    assert len(produced) < 100
+
+
+def test_lifespan_shutdown_stops_the_cameras(camui, monkeypatch):
+    stopped = []
+    monkeypatch.setattr(camui, "shutdown_cameras", lambda: stopped.append(threading.current_thread().name))
+    sent = run(camui.AsyncFrontend(camui.app), {"type": "lifespan"},
+               [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+    assert [message["type"] for message in sent] == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+    assert len(stopped) == 1
+
+
+def test_flask_route_through_the_frontend(camui):
+    sent = run(camui.AsyncFrontend(camui.app), http_scope("/metrics"), [{"type": "http.request", "body": b""}])
+    assert sent[0]["status"] == 200
+    assert b"picamera_" in b"".join(message.get("body", b"") for message in sent[1:])
+
+
+def test_stream_slot_is_freed_when_closed_before_the_first_frame(camui):
+    limiter = camui.stream_limiter
+    key = (99, "video")
+    assert limiter.acquire("10.0.0.1", key) is None
+    started = []
+
+    def frames():
+        started.append(True)
+        yield b"frame"
+    stream = camui.LimitedStream(frames(), "10.0.0.1", key)
+    stream.close()
+    stream.close()
+    assert not started
+    assert limiter.stream_counts()[key] == 0
+    assert "10.0.0.1" not in limiter.per_ip
+
+
+@pytest.mark.parametrize("interval", [b"nan", b"inf", b"-inf", b"fast"])
+def test_bad_metadata_interval_is_rejected_before_streaming(camui, camera, interval):
+    camera_num = camera.camera_info["Num"]
+    before = camui.stream_limiter.stream_counts().get((camera_num, "metadata"), 0)
+    sent = run(camui.AsyncFrontend(camui.app), http_scope(f"/metadata_stream_{camera_num}", query=b"interval=" + interval),
+               [{"type": "http.request", "body": b""}])
+    assert sent[0]["status"] == 400
+    assert b"Invalid interval" in sent[1]["body"]
+    assert camui.stream_limiter.stream_counts().get((camera_num, "metadata"), 0) == before
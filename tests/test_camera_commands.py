@@ -0,0 +1,97 @@
+import threading
+
+
+def blocked_queue(camui):
+    """A command queue whose worker is busy until the returned event is set."""
+    commands = camui.CameraCommandQueue("test-commands")
+    release = threading.Event()
+    commands.submit(release.wait)
+    return commands, release
+
+
+def test_commands_with_the_same_key_but_another_function_do_not_merge(camui):
+    commands, release = blocked_queue(camui)
+    ran = []
+
+    def start_streaming():
+        ran.append("start")
+
+    def stop_streaming():
+        ran.append("stop")
+    futures = [commands.submit(stop_streaming, key="streaming"), commands.submit(start_streaming, key="streaming")]
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+    assert ran == ["stop", "start"]
+
+
+def test_a_merged_command_moves_to_the_back_of_the_queue(camui):
+    commands, release = blocked_queue(camui)
+    ran = []
+
+    def apply(value):
+        ran.append(value)
+        return value
+    first = commands.submit(apply, 1, key="setting")
+    other = commands.submit(ran.append, "other")
+    second = commands.submit(apply, 2, key="setting")
+    release.set()
+    assert first.result(timeout=5) == second.result(timeout=5) == 2
+    other.result(timeout=5)
+    assert ran == ["other", 2]
+
+
+def test_stop_start_stop_ends_stopped(camui):
+    commands, release = blocked_queue(camui)
+    state = []
+
+    def start_streaming():
+        state.append("started")
+
+    def stop_streaming():
+        state.append("stopped")
+    futures = [commands.submit(stop_streaming, key="streaming"), commands.submit(start_streaming, key="streaming"),
+               commands.submit(stop_streaming, key="streaming")]
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+    # Each toggle runs in the order it was made, a later stop never jumps ahead of the start
+    assert state in (["stopped", "stopped"], ["stopped", "started", "stopped"])
+
+
+def test_repeated_commands_with_nothing_in_between_merge(camui):
+    commands, release = blocked_queue(camui)
+    ran = []
+
+    def stop_streaming():
+        ran.append("stop")
+    futures = [commands.submit(stop_streaming, key="streaming") for _ in range(3)]
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+    assert ran == ["stop"]
+
+
+def test_abandoned_command_fails_its_callers_and_the_queue_carries_on(camui):
+    commands = camui.CameraCommandQueue("test-commands")
+    stuck = threading.Event()
+    release = threading.Event()
+
+    def capture():
+        stuck.set()
+        release.wait()
+        return "late"
+    hung = commands.submit(capture, timeout=1)
+    assert stuck.wait(5)
+    queued = commands.submit(lambda: "next")
+    name, seconds, timeout = commands.running()
+    assert (name, timeout) == ("capture", 1)
+
+    assert commands.abandon()
+    assert isinstance(hung.exception(timeout=5), camui.CameraCommandTimeout)
+    assert queued.result(timeout=5) == "next"
+    # The stuck thread finishing later doesn't touch the queue or the failed callers
+    release.set()
+    assert commands.submit(lambda: "after").result(timeout=5) == "after"
+    assert commands.running() is None
+    assert not commands.abandon()
@@ -0,0 +1,14 @@
+def test_initializing_camera_is_503_with_retry_after(camui, monkeypatch):
+    monkeypatch.setitem(camui.camera_states, 42, {"state": "initializing"})
+    client = camui.app.test_client()
+    for page in ("/camera_42", "/camera_mobile_42"):
+        response = client.get(page)
+        assert response.status_code == 503
+        assert response.headers["Retry-After"]
+        assert b"still initializing" in response.data
+
+
+def test_unknown_camera_is_404(camui):
+    response = camui.app.test_client().get("/camera_43")
+    assert response.status_code == 404
+    assert "Retry-After" not in response.headers
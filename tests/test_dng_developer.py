@@ -0,0 +1,37 @@
+import threading
+import time
+
+
+def test_previews_run_in_parallel_and_full_size_jobs_are_limited(camui, tmp_path, monkeypatch):
+    gallery = tmp_path / "gallery"
+    gallery.mkdir()
+    for i in range(4):
+        (gallery / f"pimage_camera_0_{i}.dng").write_bytes(f"dng {i}".encode())
+    running = {"preview": 0, "full": 0}
+    peak = {"preview": 0, "full": 0}
+    lock = threading.Lock()
+
+    def run_job(self, dng_path, output_path, full_size, pil_format):
+        kind = "full" if full_size else "preview"
+        with lock:
+            running[kind] += 1
+            peak[kind] = max(peak[kind], running[kind])
+        time.sleep(0.2)
+        with lock:
+            running[kind] -= 1
+        return output_path
+    monkeypatch.setattr(camui.DngDeveloper, "run_job", run_job)
+    developer = camui.DngDeveloper(str(gallery), str(tmp_path / "dng"), workers=4, full_size_jobs=1)
+
+    futures = [developer.develop(f"pimage_camera_0_{i}.dng") for i in range(4)]
+    futures += [developer.develop(f"pimage_camera_0_{i}.dng", full_size=True) for i in range(4)]
+    for future in futures:
+        future.result(timeout=10)
+    assert peak == {"preview": 4, "full": 1}
+
+
+def test_full_size_jobs_follow_available_memory(camui, tmp_path, monkeypatch):
+    monkeypatch.setattr(camui.DngDeveloper, "FULL_SIZE_JOB_BYTES", 1)
+    assert camui.DngDeveloper(str(tmp_path), str(tmp_path / "a"), workers=3).full_size_jobs == 3
+    monkeypatch.setattr(camui.DngDeveloper, "FULL_SIZE_JOB_BYTES", 1 << 60)
+    assert camui.DngDeveloper(str(tmp_path), str(tmp_path / "b"), workers=3).full_size_jobs == 1
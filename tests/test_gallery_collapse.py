@@ -0,0 +1,81 @@
+import types
+
+import pytest
+
+
+@pytest.fixture
+def gallery(camui, tmp_path):
+    """Just enough of an ImageGallery to list an index filled with made up rows."""
+    index = camui.GalleryIndex(str(tmp_path), str(tmp_path / "index.sqlite3"))
+
+    def add(rows):
+        with index.lock:
+            index.upsert([{"filename": f"pimage_camera_0_{timestamp}.jpg", "camera_num": 0, "timestamp": timestamp,
+                           "width": 640, "height": 480, "has_dng": 0, "dng_size": 0, "size": 1, "mtime": 0, "phash": phash}
+                          for timestamp, phash in rows])
+            index.db.commit()
+    gallery = types.SimpleNamespace(index=index, items_per_page=12, add=add)
+    gallery.query = lambda *args, **kwargs: camui.ImageGallery.query_images(gallery, *args, **kwargs)
+    return gallery
+
+
+def read_all(gallery, **kwargs):
+    pages = []
+    cursor = None
+    while True:
+        images, cursor = gallery.query(cursor=cursor, **kwargs)
+        pages.append([(image["filename"], image["duplicates"]) for image in images])
+        if cursor is None:
+            return pages
+
+
+def test_runs_of_identical_frames_are_listed_once(gallery):
+    # Newest first: 3 distinct frames, a run of 5 and one more distinct frame
+    gallery.add([(1000 + i, phash) for i, phash in enumerate([0x0F0F, *[0xFFFF0000] * 5, 0x00FF00FF00, 0x1234567890, 0x7777777777777])])
+    pages = read_all(gallery, collapse=0, limit=2)
+    assert pages == [
+        [("pimage_camera_0_1008.jpg", 0), ("pimage_camera_0_1007.jpg", 0)],
+        [("pimage_camera_0_1006.jpg", 0), ("pimage_camera_0_1005.jpg", 4)],
+        [("pimage_camera_0_1000.jpg", 0)],
+    ]
+
+
+def test_a_long_run_is_cut_at_the_scan_limit(camui, gallery, monkeypatch):
+    monkeypatch.setitem(camui.app.config, "gallery_collapse_scan_rows", 50)
+    gallery.add([(1000 + i, 0xFFFF0000) for i in range(120)] + [(900, 0x1234)])
+    reads = []
+    query_page = gallery.index.query_page
+    monkeypatch.setattr(gallery.index, "query_page", lambda *args: reads.append(args[2]) or query_page(*args))
+
+    images, cursor = gallery.query(collapse=0)
+    assert [(image["filename"], image["duplicates"]) for image in images] == [("pimage_camera_0_1119.jpg", 49)]
+    assert sum(reads) == 50 and cursor is not None
+
+    pages = read_all(gallery, collapse=0)
+    assert pages == [
+        [("pimage_camera_0_1119.jpg", 49)],
+        [("pimage_camera_0_1069.jpg", 49)],
+        [("pimage_camera_0_1019.jpg", 19), ("pimage_camera_0_900.jpg", 0)],
+    ]
+
+
+@pytest.mark.parametrize("query, distance", [
+    ({}, None),
+    ({"collapse": "0"}, None),
+    ({"collapse": "1"}, 6),
+    ({"collapse": "true"}, 6),
+    ({"collapse": ""}, 6),
+    ({"collapse": "1", "distance": "1"}, 1),
+    ({"collapse": "yes", "distance": "0"}, 0),
+    ({"distance": "3"}, None),
+])
+def test_collapse_flag_and_distance(camui, query, distance):
+    assert camui.parse_collapse(query) == distance
+    if distance is not None:
+        assert camui.parse_collapse(dict(pair.split("=") for pair in camui.collapse_query(distance).split("&"))) == distance
+
+
+@pytest.mark.parametrize("query", [{"collapse": "3"}, {"collapse": "1", "distance": "-1"}, {"collapse": "1", "distance": "near"}])
+def test_bad_collapse_is_rejected(camui, query):
+    with pytest.raises(ValueError):
+        camui.parse_collapse(query)
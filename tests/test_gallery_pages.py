@@ -0,0 +1,25 @@
+def test_invalid_cursor_is_a_400_with_the_reason(camui):
+    client = camui.app.test_client()
+    response = client.get("/image_gallery?cursor=not-a-cursor")
+    assert response.status_code == 400
+    assert b"Invalid cursor: not-a-cursor" in response.data
+
+    response = client.get("/get_image_for_page?cursor=not-a-cursor")
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid cursor: not-a-cursor"}
+
+
+def test_only_versioned_thumbnails_are_immutable(camui, tmp_path, monkeypatch):
+    thumbnails = camui.ThumbnailCache(str(tmp_path), str(tmp_path / "thumbnails"))
+    monkeypatch.setattr(camui.image_gallery_manager, "thumbnails", thumbnails)
+    camui.Image.new("RGB", (64, 48)).save(tmp_path / "pimage_camera_0_1700000000.jpg")
+    client = camui.app.test_client()
+
+    response = client.get("/thumb/pimage_camera_0_1700000000.jpg?w=240&v=1700000000")
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+
+    response = client.get("/thumb/pimage_camera_0_1700000000.jpg?w=240")
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "private, no-cache"
+    assert response.headers.get("ETag") or response.headers.get("Last-Modified")
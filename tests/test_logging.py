@@ -0,0 +1,54 @@
+import json
+import logging
+
+import pytest
+
+
+def record(camui, level=logging.INFO, lineno=1, msg="frame", **fields):
+    return logging.makeLogRecord({"name": "camui", "levelno": level, "levelname": logging.getLevelName(level),
+                                  "pathname": "app.py", "lineno": lineno, "msg": msg, "created": 1700000000.25,
+                                  **camui.log_fields(**fields)})
+
+
+def test_debug_sampler_passes_one_record_in_n_per_call_site(camui):
+    sampler = camui.DebugSampler(every=3)
+    passed = {site: [sampler.filter(record(camui, logging.DEBUG, lineno=site)) for _ in range(7)] for site in (10, 20)}
+    assert passed[10] == passed[20] == [True, False, False, True, False, False, True]
+
+    sampled = record(camui, logging.DEBUG, lineno=30, camera=0)
+    assert sampler.filter(sampled)
+    assert sampled.fields == {"camera": 0, "sampled": "1/3"}
+    # Only DEBUG is sampled
+    assert all(sampler.filter(record(camui, logging.INFO, lineno=40)) for _ in range(5))
+
+
+def test_structured_formatter_logfmt(camui):
+    line = camui.StructuredFormatter().format(record(camui, msg="camera ready", camera=0, error="no such file", timings={"open": 0.5}))
+    assert line == ('ts=2023-11-14T22:13:20.250+00:00 level=info logger=camui msg="camera ready" camera=0 '
+                    'error="no such file" timings="{\\"open\\": 0.5}"')
+
+
+def test_structured_formatter_json(camui):
+    line = camui.StructuredFormatter("json").format(record(camui, logging.WARNING, msg="slow", seconds=2.5))
+    assert json.loads(line) == {"ts": "2023-11-14T22:13:20.250+00:00", "level": "warning", "logger": "camui",
+                                "msg": "slow", "seconds": 2.5}
+
+
+@pytest.mark.parametrize("body, error", [
+    ({"colour": "red"}, "Unknown logging settings: colour"),
+    ({"level": "loud"}, "Unknown log level"),
+    ({"level": "debug", "loggers": {"camui": "chatty"}}, "Unknown log level"),
+    ({"level": "debug", "loggers": ["camui"]}, "loggers must map"),
+    ({"format": "xml"}, "Unknown log format"),
+    ({"debug_sample_every": "often"}, "Invalid debug_sample_every"),
+    (["level"], "Expected a JSON object"),
+])
+def test_logging_endpoint_rejects_bad_settings_without_applying_any(camui, body, error):
+    client = camui.app.test_client()
+    before = client.get("/logging").get_json()
+    camui_level = logging.getLogger("camui").level
+    response = client.post("/logging", json=body)
+    assert response.status_code == 400
+    assert error in response.get_json()["error"]
+    assert client.get("/logging").get_json() == before
+    assert logging.getLogger("camui").level == camui_level
@@ -0,0 +1,17 @@
+import pytest
+
+
+@pytest.mark.parametrize("interval", ["nan", "inf", "-inf", "fast"])
+def test_bad_interval_is_rejected(camui, camera, interval):
+    camera_num = camera.camera_info["Num"]
+    response = camui.app.test_client().get(f"/metadata_stream_{camera_num}?interval={interval}")
+    assert response.status_code == 400
+    assert "Invalid interval" in response.get_json()["error"]
+
+
+def test_interval_is_clamped(camui):
+    config = camui.app.config
+    assert camui.parse_metadata_interval(None) == config['metadata_stream_interval']
+    assert camui.parse_metadata_interval("0") == config['metadata_min_interval']
+    assert camui.parse_metadata_interval("1e300") == config['metadata_max_interval']
+    assert camui.parse_metadata_interval("2.5") == 2.5
@@ -0,0 +1,26 @@
+import json
+import os
+
+
+def test_profile_edited_in_place_is_picked_up(camui, tmp_path):
+    (tmp_path / "night.json").write_text(json.dumps({"model": "imx708"}))
+    catalogue = camui.ProfileCatalogue(str(tmp_path))
+    assert catalogue.list() == [{"filename": "night.json", "model": "imx708"}]
+
+    # Rewriting the file in place leaves the folder mtime as it was
+    folder_mtime = os.stat(tmp_path).st_mtime_ns
+    with open(tmp_path / "night.json", "w") as f:
+        json.dump({"model": "imx477", "controls": {}}, f)
+    os.utime(tmp_path, ns=(folder_mtime, folder_mtime))
+    assert catalogue.list() == [{"filename": "night.json", "model": "imx477"}]
+    assert catalogue.list(model="imx708") == []
+
+
+def test_new_and_deleted_profiles(camui, tmp_path):
+    catalogue = camui.ProfileCatalogue(str(tmp_path))
+    assert catalogue.list() == []
+    (tmp_path / "a.json").write_text(json.dumps({"model": "imx708"}))
+    (tmp_path / ".tmp_b.json").write_text("{")
+    assert [entry["filename"] for entry in catalogue.list()] == ["a.json"]
+    os.remove(tmp_path / "a.json")
+    assert catalogue.list() == []
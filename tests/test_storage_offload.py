@@ -0,0 +1,182 @@
+import hashlib
+import hmac
+import http.server
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+
+class StandInServer(http.server.ThreadingHTTPServer):
+    """Records every upload and answers with the next status out of `statuses` (then 200)."""
+    def __init__(self, statuses=()):
+        self.statuses = list(statuses)
+        self.uploads = []
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.uploads.append((self.path, dict(self.headers), body))
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    servers = []
+
+    def start(statuses=()):
+        servers.append(StandInServer(statuses))
+        return servers[-1]
+    yield start
+    for stand_in in servers:
+        stand_in.shutdown()
+        stand_in.server_close()
+
+
+@pytest.fixture
+def offload(camui, tmp_path):
+    gallery = tmp_path / "gallery"
+    gallery.mkdir()
+    (gallery / "pimage_camera_0_1700000000.jpg").write_bytes(b"\xff\xd8" + b"x" * 1000)
+    return camui.StorageOffload(str(gallery), str(tmp_path / "storage-sinks.json"), str(tmp_path / "queue.sqlite3"))
+
+
+def run_due_job(offload):
+    with offload.condition:
+        job, sink, wait = offload.claim()
+    assert job is not None, f"no job due, next one in {wait}s"
+    offload.run_job(job, sink)
+
+
+def test_s3_signature_matches_an_independent_sigv4_computation(camui):
+    sink = camui.S3Sink("s3", {"type": "s3", "endpoint": "http://minio.local:9000", "bucket": "photos", "region": "eu-west-1",
+                               "access_key": "AKIDEXAMPLE", "secret_key": "wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY"})
+    now = datetime(2024, 5, 17, 12, 30, 45, tzinfo=timezone.utc)
+    url, headers = sink.request_target("pimage_camera_0_1700000000.jpg", now=now)
+
+    assert url == "http://minio.local:9000/photos/pimage_camera_0_1700000000.jpg"
+    canonical_request = "\n".join([
+        "PUT", "/photos/pimage_camera_0_1700000000.jpg", "",
+        "host:minio.local:9000", "x-amz-content-sha256:UNSIGNED-PAYLOAD", "x-amz-date:20240517T123045Z", "",
+        "host;x-amz-content-sha256;x-amz-date", "UNSIGNED-PAYLOAD"])
+    string_to_sign = "\n".join(["AWS4-HMAC-SHA256", "20240517T123045Z", "20240517/eu-west-1/s3/aws4_request",
+                                hashlib.sha256(canonical_request.encode()).hexdigest()])
+    key = hmac.new(b"AWS4wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY", b"20240517", hashlib.sha256).digest()
+    key = hmac.new(key, b"eu-west-1", hashlib.sha256).digest()
+    key = hmac.new(key, b"s3", hashlib.sha256).digest()
+    key = hmac.new(key, b"aws4_request", hashlib.sha256).digest()
+    signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+    assert headers == {
+        "x-amz-content-sha256": "UNSIGNED-PAYLOAD",
+        "x-amz-date": "20240517T123045Z",
+        "Authorization": ("AWS4-HMAC-SHA256 Credential=AKIDEXAMPLE/20240517/eu-west-1/s3/aws4_request, "
+                          f"SignedHeaders=host;x-amz-content-sha256;x-amz-date, Signature={signature}"),
+    }
+
+
+def test_s3_key_is_percent_encoded_in_the_signed_path(camui):
+    sink = camui.S3Sink("s3", {"type": "s3", "endpoint": "https://s3.amazonaws.com", "bucket": "photos",
+                               "access_key": "a", "secret_key": "b", "layout": "pi cam/{filename}"})
+    url, _ = sink.request_target("pimage_camera_0_1700000000.jpg")
+    assert url == "https://s3.amazonaws.com/photos/pi%20cam/pimage_camera_0_1700000000.jpg"
+
+
+def test_failed_upload_is_retried_with_backoff(offload, server):
+    stand_in = server(statuses=[503, 500])
+    offload.configure({"sinks": [{"name": "nas", "type": "http", "url": stand_in.url, "headers": {"Authorization": "Bearer token"}}]}, save=False)
+    offload.enqueue(["pimage_camera_0_1700000000.jpg"])
+
+    for attempts, backoff in ((1, 5), (2, 10)):
+        before = time.time()
+        run_due_job(offload)
+        job = offload.db.execute("SELECT * FROM jobs").fetchone()
+        assert job["attempts"] == attempts and job["running"] == 0
+        assert "HTTP 50" in job["last_error"]
+        assert before + backoff <= job["next_attempt"] <= time.time() + backoff
+        with offload.condition:
+            assert offload.claim() == (None, None, pytest.approx(backoff, abs=1))
+        offload.retry_now()
+
+    run_due_job(offload)
+    assert offload.db.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 0
+    assert offload.status()["sinks"]["nas"] == {"queued": 0, "failing": 0, "running": 0}
+    path, headers, body = stand_in.uploads[-1]
+    assert len(stand_in.uploads) == 3
+    assert path == "/pimage_camera_0_1700000000.jpg"
+    assert headers["Authorization"] == "Bearer token"
+    assert body == b"\xff\xd8" + b"x" * 1000
+
+
+def test_backoff_is_capped(offload, server):
+    stand_in = server(statuses=[500])
+    offload.configure({"sinks": [{"name": "nas", "type": "http", "url": stand_in.url}]}, save=False)
+    offload.enqueue(["pimage_camera_0_1700000000.jpg"])
+    offload.db.execute("UPDATE jobs SET attempts = 20")
+    run_due_job(offload)
+    job = offload.db.execute("SELECT * FROM jobs").fetchone()
+    assert job["next_attempt"] <= time.time() + offload.MAX_BACKOFF
+
+
+def test_upload_of_a_deleted_file_is_dropped(offload, server):
+    stand_in = server()
+    offload.configure({"sinks": [{"name": "nas", "type": "http", "url": stand_in.url}]}, save=False)
+    offload.enqueue(["pimage_camera_0_1700000000.jpg"])
+    os.remove(os.path.join(offload.upload_folder, "pimage_camera_0_1700000000.jpg"))
+    run_due_job(offload)
+    assert offload.db.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 0
+    assert stand_in.uploads == []
+
+
+def test_secrets_and_headers_are_masked_and_kept_on_save(offload):
+    offload.configure({"sinks": [
+        {"name": "nas", "type": "http", "url": "http://nas.local", "headers": {"Authorization": "Bearer token", "X-Api-Key": "abc"}},
+        {"name": "s3", "type": "s3", "endpoint": "http://minio.local", "bucket": "b", "access_key": "a", "secret_key": "secret"},
+    ]})
+    config = offload.get_config()
+    assert config["sinks"][0]["headers"] == {"Authorization": "********", "X-Api-Key": "********"}
+    assert config["sinks"][1]["secret_key"] == "********"
+
+    # The settings page posts back what it read, with one header changed
+    config["sinks"][0]["headers"]["X-Api-Key"] = "def"
+    offload.configure(config)
+    assert offload.config["sinks"][0]["headers"] == {"Authorization": "Bearer token", "X-Api-Key": "def"}
+    assert offload.config["sinks"][1]["secret_key"] == "secret"
+    assert offload.sinks["nas"].headers["Authorization"] == "Bearer token"
+
+
+def test_bandwidth_limiter_holds_the_rate(camui):
+    limiter = camui.BandwidthLimiter(100_000)
+    start = time.monotonic()
+    # The first second's worth goes straight out, the rest is paced
+    for _ in range(30):
+        limiter.consume(10_000)
+    elapsed = time.monotonic() - start
+    assert 1.8 <= elapsed <= 2.5
+
+
+def test_bandwidth_limiter_is_shared_by_concurrent_uploads(camui):
+    limiter = camui.BandwidthLimiter(100_000)
+    limiter.consume(100_000)  # Empty the bucket
+    start = time.monotonic()
+    threads = [threading.Thread(target=lambda: [limiter.consume(10_000) for _ in range(5)]) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert 0.9 <= time.monotonic() - start <= 1.5
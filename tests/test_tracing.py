@@ -0,0 +1,14 @@
+def test_frequent_spans_do_not_push_out_rare_ones(camui, monkeypatch):
+    monkeypatch.setattr(camui, "recent_spans", {})
+    with camui.Span("take_still", camera=0):
+        pass
+    for value in range(500):
+        with camui.Span("update_settings", camera=0, setting="Brightness", value=value):
+            pass
+
+    client = camui.app.test_client()
+    spans = client.get("/traces?limit=1000").get_json()
+    assert [span["span"] for span in spans].count("update_settings") == camui.RECENT_SPANS_PER_NAME
+    assert spans[0]["value"] == 499  # Newest first
+    assert [span["span"] for span in client.get("/traces?span=take_still").get_json()] == ["take_still"]
+    assert client.get("/traces?span=unknown").get_json() == []
@@ -0,0 +1,59 @@
+import threading
+import time
+
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def test_hung_capture_is_abandoned_and_the_camera_reopened(camui, monkeypatch):
+    for setting, value in (("camera_capture_timeout", 1), ("watchdog_command_grace", 1), ("watchdog_interval", 0.2)):
+        monkeypatch.setitem(camui.app.config, setting, value)
+    camera = camui.cameras[0]
+    old_picam2 = camera.picam2
+    hung_callers = []
+
+    def capture():
+        try:
+            camera.take_still(0, "pimage_camera_0_1700000001")
+        except camui.CameraCommandTimeout as e:
+            hung_callers.append(e)
+    old_picam2.inject_fault("hang")
+    threading.Thread(target=capture, daemon=True).start()
+
+    assert wait_for(lambda: (camera.watchdog.last_fault or {}).get("reason") == "command_hung", 15)
+    assert wait_for(lambda: camera.watchdog.last_fault["result"] == "ok", 15), camera.watchdog.last_fault
+    assert camera.watchdog.last_fault["action"] == "reopen"
+    assert camera.picam2 is not old_picam2 and old_picam2.closed
+    assert hung_callers
+    assert not camera.capturing_still
+    assert time.monotonic() - camera.last_frame_time < 1
+    # The camera takes commands again
+    assert camera.take_still_from_feed(0, "snapshot_0")
+
+
+def test_recovery_counts_as_ok_only_once_frames_flow(camui, monkeypatch):
+    monkeypatch.setitem(camui.app.config, "watchdog_interval", 0.2)
+    camera = camui.cameras[0]
+    watchdog = camera.watchdog
+    assert wait_for(lambda: watchdog.pending_action is None, 20)
+    counters = {(action, result): camui.pipeline_recoveries.labels(0, action, result)
+                for action in ("restart_stream", "reconfigure") for result in ("ok", "failed")}
+    before = {key: counter.value for key, counter in counters.items()}
+    watchdog.attempts = 0
+    watchdog.next_attempt = 0.0
+    # A sticky stall outlives restarting the stream, so the first recovery doesn't bring frames back
+    camera.picam2.inject_fault("stall", sticky=True)
+    assert wait_for(lambda: watchdog.last_fault and watchdog.last_fault["result"] == "pending"
+                    and watchdog.last_fault["action"] == "restart_stream", 20)
+    assert counters["restart_stream", "ok"].value == before["restart_stream", "ok"]
+    assert wait_for(lambda: watchdog.last_fault["action"] == "reconfigure", 20)
+    assert counters["restart_stream", "failed"].value == before["restart_stream", "failed"] + 1
+    camera.picam2.inject_fault(None)
+    assert wait_for(lambda: watchdog.last_fault["result"] == "ok", 20), watchdog.last_fault
+    assert counters["reconfigure", "ok"].value == before["reconfigure", "ok"] + 1